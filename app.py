@@ -1,11 +1,22 @@
 # Run this app with `python app.py` and
 # visit http://127.0.0.1:8050/ in your web browser.
 
-from dash import Dash, html, dcc, Input, Output
+import os
+import glob
+import dash
+import utils
+
+from dash import Dash, html, dcc, ctx, no_update, Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
 
-from data_handler import pull_data
-from fig_creator import create_fig_dict
+from datetime import datetime
+
+from data_handler import pull_data, data_is_current, resources_changed
+from fig_creator import create_fig_dict, fig_version, clicked_phu, date_ranges, default_days, downsample_points, zoom_range
+from refresh import Snapshot, LazyDict, RefreshScheduler
+import shared_store
+from http_cache import install_http_cache, install_callback_cache, files_version
+from metrics import install_metrics, profiled, span
 from utils import custom_strftime, change_card
 
 # CSS Style 
@@ -27,25 +38,19 @@ CONTENT_STYLE = {
 }
 
 # App Settings
-app = Dash(external_stylesheets=[dbc.themes.SPACELAB], suppress_callback_exceptions=True)
+app = Dash(external_stylesheets=[dbc.themes.SPACELAB], suppress_callback_exceptions=True, compress=True)
 app.title = "Ontario COVID-19 Dashboard"
 
-# Create data and figure dictionaries for future processing
-data_dict = pull_data()
-assert data_dict is not None
-
-now, fig_dict = create_fig_dict(data_dict)
-assert fig_dict is not None
-
 # Sidebar html
-sidebar = html.Div(
+def create_sidebar(snapshot):
+    return html.Div(
     [
         html.H2("Ontario", style={"margin": "0px"}),
         html.H2("COVID-19", style={"margin": "0px"}),
         html.H2("Dashboard", style={"margin": "0px"}),
         html.Hr(),
         html.P(
-            f"{custom_strftime('%B {S}, %Y', now)}", className="lead"
+            f"{custom_strftime('%B {S}, %Y', snapshot.now)}", className="lead"
         ),
         dbc.Nav(
             [
@@ -57,6 +62,9 @@ sidebar = html.Div(
             vertical=True,
             pills=True,
         ),
+        html.P(
+            f"Updated {snapshot.now.strftime('%H:%M')}", className="text-muted small", style={"margin-top": "16px"}
+        ),
     ],
     style=SIDEBAR_STYLE,
 )
@@ -65,20 +73,27 @@ sidebar = html.Div(
 # Create each page object - the callbacks will swap between them on user interaction
 content = html.Div(id="page-content", style=CONTENT_STYLE)
 
-app.layout = html.Div([dcc.Location(id="url"), sidebar, content])
+def serve_layout():
+    # Called on every page load, so the sidebar always reflects the latest snapshot
+    return html.Div([dcc.Location(id="url"), create_sidebar(scheduler.snapshot), content])
+
+def create_range_control(page):
+    # Picks the date range of the time-series graphs on a page
+    return dbc.RadioItems(id=f"{page}-range",
+                          options=[{"label": label, "value": label} for label in date_ranges],
+                          value=next(label for label, days in date_ranges.items() if days == default_days),
+                          inline=True)
 
-cases_page = dbc.Container([
+def create_cases_page(data_dict, fig_dict):
+    return dbc.Container([
                 dbc.Row([
                     dbc.Col(html.H2("COVID-19 Case Information Today"), width='auto'), 
                     ]),
                 html.Hr(),
                 dbc.Row([
-                    dbc.Col(change_card(data=data_dict['cases_tl'], col='ACTIVE_CASES', date_col='Reported Date', \
-                        title="Active Cases", color_invert=True), width='auto'), 
-                    dbc.Col(change_card(data=data_dict['cases_tl'], col='New Cases', date_col='Reported Date', \
-                        title="New Cases", color_invert=True), width='auto'),
-                    dbc.Col(change_card(data=data_dict['cases_tl'], col='New Deaths', date_col='Reported Date', \
-                        title="New Deaths", color_invert=True), width='auto')
+                    dbc.Col(change_card(data_dict['kpis'], 'active_cases', title="Active Cases", color_invert=True), width='auto'), 
+                    dbc.Col(change_card(data_dict['kpis'], 'new_cases', title="New Cases", color_invert=True), width='auto'),
+                    dbc.Col(change_card(data_dict['kpis'], 'new_deaths', title="New Deaths", color_invert=True), width='auto')
                     ]),
                 dbc.Row([
                     dbc.Col(html.H2("Active COVID-19 Cases by PHU"), width='auto'), 
@@ -92,9 +107,16 @@ cases_page = dbc.Container([
                     id="cases-tabs",
                     active_tab="map_cases_count",
                 ),
-                dbc.Spinner(children=html.Div(id="cases-tab-content", className="p-4"), color="primary"),
+                html.Div(dcc.Graph(id="cases-map",
+                                   figure=fig_dict['map_cases'],
+                                   config={"displayModeBar": False}), className="p-4"),
+                dcc.Store(id="cases-map-metrics",
+                          data={tab: fig_dict[tab] for tab in ["map_cases_count", "map_cases_rate"]}),
+                dcc.Graph(id="cases-phu-history",
+                          figure=fig_dict.get_history(None, "map_cases_count", default_days)),
                 dbc.Row([
                     dbc.Col(html.H2("Active COVID-19 Cases and Deaths Over Time"), width='auto'), 
+                    dbc.Col(create_range_control("cases"), width='auto', align='center'),
                     ]),
                 html.Hr(),
                 dcc.Graph(id='fig_cases_death_area',
@@ -106,19 +128,19 @@ cases_page = dbc.Container([
                 dcc.Graph(id='fig_vax_ratio_time',
                           figure=fig_dict['fig_vax_ratio_time'])])
 
-tests_page = dbc.Container([
+def create_tests_page(data_dict, fig_dict):
+    return dbc.Container([
                 dbc.Row([
                     dbc.Col(html.H2("COVID-19 Testing Today"), width='auto'), 
                     ]),
                 html.Hr(),
                 dbc.Row([
-                    dbc.Col(change_card(data=data_dict['cases_tl'], col='Total tests completed in the last day', \
-                        date_col='Reported Date', title="Test Volume", color_invert=False), width='auto'), 
-                    dbc.Col(change_card(data=data_dict['cases_tl'], col='Percent positive tests in last day', \
-                        date_col='Reported Date', title="Positive Test Rate", color_invert=True, percentage=True), width='auto'),
+                    dbc.Col(change_card(data_dict['kpis'], 'test_volume', title="Test Volume", color_invert=False), width='auto'), 
+                    dbc.Col(change_card(data_dict['kpis'], 'percent_positive', title="Positive Test Rate", color_invert=True, percentage=True), width='auto'),
                     ]),
                  dbc.Row([
                     dbc.Col(html.H2("COVID-19 Testing Over Time", style={"margin-top": "32px"}), width='auto'), 
+                    dbc.Col(create_range_control("tests"), width='auto', align='end'),
                     ]),
                 html.Hr(),
                 dcc.Graph(id='tests_hosp_area',
@@ -137,7 +159,13 @@ tests_page = dbc.Container([
             id="tests-tabs",
             active_tab="map_ont_test_count",
         ),
-        dbc.Spinner(children=html.Div(id="tests-tab-content", className="p-4"), color="primary"),
+        html.Div(dcc.Graph(id="tests-map",
+                           figure=fig_dict['map_tests'],
+                           config={"displayModeBar": False}), className="p-4"),
+        dcc.Store(id="tests-map-metrics",
+                  data={tab: fig_dict[tab] for tab in ["map_ont_test_count", "map_ont_test_rate", "map_ont_test_tpr"]}),
+        dcc.Graph(id="tests-phu-history",
+                  figure=fig_dict.get_history(None, "map_ont_test_count", default_days)),
         dbc.Row([
             dbc.Col(html.H2("COVID-19 Positive Test Rate by Age Group (7 Day Average)"), width='auto'), 
             ]),
@@ -146,21 +174,20 @@ tests_page = dbc.Container([
             figure=fig_dict['fig_tests_age']),
 ])
 
-vaccine_page = dbc.Container([
+def create_vaccine_page(data_dict, fig_dict):
+    return dbc.Container([
                 dbc.Row([
                     dbc.Col(html.H2("COVID-19 Vaccination Status Today"), width='auto'), 
                     ]),
                 html.Hr(),
                 dbc.Row([
-                    dbc.Col(change_card(data=data_dict['vax_stat'], col='per_partially', date_col='report_date', \
-                        title="At Least One Dose", color_invert=False, percentage=True), width='auto'), 
-                    dbc.Col(change_card(data=data_dict['vax_stat'], col='per_fully', date_col='report_date', \
-                        title="Fully Vaccinated", color_invert=False, percentage=True), width='auto'),
-                    dbc.Col(change_card(data=data_dict['vax_stat'], col='per_boosted', date_col='report_date', \
-                        title="Boosted", color_invert=False, percentage=True), width='auto')
+                    dbc.Col(change_card(data_dict['kpis'], 'per_partially', title="At Least One Dose", color_invert=False, percentage=True), width='auto'), 
+                    dbc.Col(change_card(data_dict['kpis'], 'per_fully', title="Fully Vaccinated", color_invert=False, percentage=True), width='auto'),
+                    dbc.Col(change_card(data_dict['kpis'], 'per_boosted', title="Boosted", color_invert=False, percentage=True), width='auto')
                     ]),
                 dbc.Row([
                     dbc.Col(html.H2("COVID-19 Vaccination Over Time", style={"margin-top": "32px"}), width='auto'), 
+                    dbc.Col(create_range_control("vaccine"), width='auto', align='end'),
                     ]),
                 html.Hr(),
                 dcc.Graph(id='fig_vax',
@@ -176,18 +203,20 @@ vaccine_page = dbc.Container([
                 ]),
                 ])
 
-hosp_page = dbc.Container([
+def create_hosp_page(data_dict, fig_dict):
+    return dbc.Container([
                 dbc.Row([
                     dbc.Col(html.H2("COVID-19 Hospitalizations Today"), width='auto'), 
                     ]),
                 html.Hr(),
                 dbc.Row([
-                    dbc.Col(change_card(data=data_dict['hosp_vax'], col='total', date_col='date', title="Total", color_invert=True), width='auto'), 
-                    dbc.Col(change_card(data=data_dict['hosp_vax'], col='icu', date_col='date', title="ICU", color_invert=True), width='auto'),
-                    dbc.Col(change_card(data=data_dict['hosp_vax'], col='nonicu', date_col='date', title="Non-ICU", color_invert=True), width='auto')
+                    dbc.Col(change_card(data_dict['kpis'], 'hosp_total', title="Total", color_invert=True), width='auto'), 
+                    dbc.Col(change_card(data_dict['kpis'], 'hosp_icu', title="ICU", color_invert=True), width='auto'),
+                    dbc.Col(change_card(data_dict['kpis'], 'hosp_nonicu', title="Non-ICU", color_invert=True), width='auto')
                     ]),
                 dbc.Row([
                     dbc.Col(html.H2("Hospitalizations Over Time", style={"margin-top": "32px"}), width='auto'), 
+                    dbc.Col(create_range_control("hosp"), width='auto', align='end'),
                 ]),
                 html.Hr(),
                 dbc.Row([
@@ -213,6 +242,93 @@ hosp_page = dbc.Container([
             ])
 
 
+def build_data():
+    '''
+    Pulls the data and stores every figure built from it, so that workers sharing the data only read them
+    '''
+
+    data_dict = pull_data()
+
+    if data_dict is not None:
+        _, fig_dict = create_fig_dict(data_dict)
+        for key in fig_dict:
+            fig_dict[key]
+
+    return data_dict
+
+@profiled
+def build_snapshot():
+    '''
+    Pulls the data and sets up the figures and pages built from it, returning them together as a Snapshot
+    '''
+
+    with span("snapshot"):
+        return create_snapshot()
+
+def create_snapshot():
+    # Create data and figure dictionaries for future processing. With a shared store, only one worker
+    # pulls the data and builds the figures, and the rest map its copy of the data
+    if shared_store.enabled:
+        data_dict = shared_store.build_or_attach(build_data, refresh=scheduler.snapshot is not None,
+                                                 is_current=data_is_current)
+    else:
+        data_dict = pull_data()
+    if data_dict is None:
+        raise RuntimeError("Failed to pull data")
+
+    now, fig_dict = create_fig_dict(data_dict)
+    assert fig_dict is not None
+
+    # Pages (and the figures on them) are only built when they are first visited
+    pages = LazyDict({"/": lambda: create_cases_page(data_dict, fig_dict),
+                      "/hospitalizations": lambda: create_hosp_page(data_dict, fig_dict),
+                      "/testing": lambda: create_tests_page(data_dict, fig_dict),
+                      "/vaccinations": lambda: create_vaccine_page(data_dict, fig_dict)})
+
+    # The snapshot's content only depends on its data, figure code and build time (which stored figures keep), so
+    # snapshots of the same data built by other workers or by a refresh that changed nothing share its version
+    created = datetime.now()
+    version = f"{data_dict.get('data_version')}-{fig_version}-{now.isoformat()}"
+
+    return Snapshot(data_dict=data_dict, fig_dict=fig_dict, now=now, pages=pages, created=created, version=version)
+
+# The first snapshot is built before serving, then refreshed in the background each day once the day's data
+# is usually published - and again each hour after that until it is, as long as a resource has been republished
+scheduler = RefreshScheduler(build_snapshot, is_current=lambda snapshot: data_is_current(snapshot.data_dict, snapshot.created.date()),
+                             changed=resources_changed)
+scheduler.refresh()
+scheduler.start()
+
+app.layout = serve_layout
+
+# Identifies the code and assets the pages are served with
+code_version = files_version([__file__, utils.__file__] + sorted(glob.glob(os.path.join(app.config.assets_folder, "*"))),
+                             dash.__version__, dbc.__version__)
+
+# Stage timings and callback latencies are exposed on /metrics. This goes first so that the responses
+# answered early by the caches below are timed too - /metrics itself is neither tagged nor cached
+install_metrics(app)
+
+# Pages and layouts are revalidated with ETags, so returning visitors only re-download them when they change
+install_http_cache(app, pages=["/", "/hospitalizations", "/testing", "/vaccinations"],
+                   get_version=lambda: scheduler.snapshot.version, code_version=code_version)
+
+# Time-series graphs on each page, which are redrawn for the date range picked on that page
+range_graphs = {"cases": ['fig_cases_death_area', 'fig_vax_ratio_time'],
+                "tests": ['tests_hosp_area', 'fig_tests_age'],
+                "vaccine": ['fig_vax'],
+                "hosp": ['fig_hosp_area']}
+
+# Pages with a PHU map, whose clicked PHU's history is shown under it
+history_pages = ["cases", "tests"]
+
+# Page content, the ranged graphs and the PHU histories only depend on their inputs and the snapshot,
+# so their serialized responses are reused
+callback_cache = install_callback_cache(app, outputs={"page-content.children"} |
+                                                     {f"{key}.figure" for keys in range_graphs.values() for key in keys} |
+                                                     {f"{page}-phu-history.figure" for page in history_pages},
+                                        get_version=lambda: scheduler.snapshot.version)
+
 
 # Callback to move between pages
 @app.callback(Output("page-content", "children"), [Input("url", "pathname")])
@@ -221,14 +337,10 @@ def render_page_content(pathname):
     This callback takes the 'pathname' property of the url, and renders 
     the page content depending on what the value of 'pathname' is.
     """
-    if pathname == "/":
-        return cases_page
-    elif pathname == "/hospitalizations":
-        return hosp_page
-    elif pathname == "/testing":
-        return tests_page
-    elif pathname == "/vaccinations":
-        return vaccine_page
+    pages = scheduler.snapshot.pages
+
+    if pathname in pages:
+        return pages[pathname]
     # If the user tries to reach a different page, return a 404 message
     return dbc.Container(
         [
@@ -239,41 +351,65 @@ def render_page_content(pathname):
     )
 
 
-# These callbacks handle the count/rates tab changes on certain pages
-@app.callback(
-    Output("tests-tab-content", "children"),
-    Input("tests-tabs", "active_tab")
-)
-def tests_render_tab_content(active_tab):
-    """
-    This callback takes the 'active_tab' property as input, and renders 
-    the tab content depending on what the value of 'active_tab' is.
-    """
+# These callbacks redraw the time-series graphs for the picked date range, and (since long ranges are
+# downsampled) at full resolution for the range they are zoomed into. The default range is already
+# shown when a page is rendered, so they only run once the range or zoom is changed
+def register_range_callback(page, key):
+    @app.callback(Output(key, "figure"), Input(f"{page}-range", "value"), Input(key, "relayoutData"),
+                  prevent_initial_call=True)
+    def update_range(label, relayout):
+        fig_dict = scheduler.snapshot.fig_dict
+        days = date_ranges[label]
+
+        if ctx.triggered_id == key:
+            x_range = zoom_range(relayout)
+
+            if x_range is None or downsample_points is None:
+                return no_update
+            if x_range != "reset":
+                return fig_dict.get_zoom(key, days, x_range)
+
+        return fig_dict.get_range(key, days)
+
+for page, keys in range_graphs.items():
+    for key in keys:
+        register_range_callback(page, key)
 
-    if active_tab is not None:
-        return dcc.Graph(id=active_tab,
-                         figure=fig_dict[active_tab],
-                         config={"displayModeBar": False})
 
-    return "No tab selected"
+# These callbacks show the history of the PHU clicked on a page's map, for the metric of the map's
+# selected tab over the page's date range
+def register_history_callback(page):
+    @app.callback(Output(f"{page}-phu-history", "figure"), Input(f"{page}-map", "clickData"),
+                  Input(f"{page}-tabs", "active_tab"), Input(f"{page}-range", "value"), prevent_initial_call=True)
+    def update_history(click, tab, label):
+        snapshot = scheduler.snapshot
+        return snapshot.fig_dict.get_history(clicked_phu(snapshot.data_dict, click), tab, date_ranges[label])
 
+for page in history_pages:
+    register_history_callback(page)
 
-@app.callback(
-    Output("cases-tab-content", "children"),
-    Input("cases-tabs", "active_tab")
+
+# These callbacks handle the count/rates tab changes on certain pages. They run in the browser
+# (see assets/maps.js), swapping in the selected tab's values while keeping the PHU boundaries
+# already loaded with the map
+app.clientside_callback(
+    ClientsideFunction(namespace="maps", function_name="switch_metric"),
+    Output("tests-map", "figure"),
+    Input("tests-tabs", "active_tab"),
+    State("tests-map-metrics", "data"),
+    State("tests-map", "figure")
 )
-def cases_render_tab_content(active_tab):
-    """
-    This callback takes the 'active_tab' property as input, and renders 
-    the tab content depending on what the value of 'active_tab' is.
-    """
 
-    if active_tab is not None:
-        return dcc.Graph(id=active_tab,
-                         figure=fig_dict[active_tab],
-                         config={"displayModeBar": False})
+app.clientside_callback(
+    ClientsideFunction(namespace="maps", function_name="switch_metric"),
+    Output("cases-map", "figure"),
+    Input("cases-tabs", "active_tab"),
+    State("cases-map-metrics", "data"),
+    State("cases-map", "figure")
+)
 
-    return "No tab selected"
+# WSGI entry point for multi-worker servers
+server = app.server
 
 # Run app server
 if __name__ == '__main__':
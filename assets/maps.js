@@ -0,0 +1,16 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    maps: {
+        // Returns the map figure for the selected tab, reusing the PHU boundaries of the current figure
+        // so that switching tabs only swaps the per-PHU values and color scale
+        switch_metric: function(active_tab, metrics, figure) {
+            if (!active_tab || !metrics || !(active_tab in metrics) || !figure) {
+                return window.dash_clientside.no_update;
+            }
+
+            const fig = JSON.parse(JSON.stringify(metrics[active_tab]));
+            fig.data[0].geojson = figure.data[0].geojson;
+
+            return fig;
+        }
+    }
+});
@@ -0,0 +1,50 @@
+# Times loading each stored resource in every cache format, along with the size on disk.
+# Run from the repository root (after at least one pull) with `python benchmarks/bench_cache.py [repeats]`
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+
+import data_handler
+from data_handler import key_dict, read_cache, write_cache, cache_path
+
+formats = ["csv", "parquet", "feather"] if data_handler.pyarrow is not None else ["csv"]
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    os.chdir(root)
+    data_dict = {key: read_cache(key) for key in key_dict}
+
+    # Write every format into a scratch ./data so the stored files aren't touched
+    scratch = tempfile.mkdtemp()
+    os.makedirs(os.path.join(scratch, "data"))
+    os.chdir(scratch)
+
+    try:
+        print(f"{'resource':>12} {'rows':>9} " + " ".join(f"{fmt + ' (ms)':>14} {'MiB':>6}" for fmt in formats))
+
+        for key, df in data_dict.items():
+            row = f"{key:>12} {len(df):>9} "
+
+            for fmt in formats:
+                write_cache(key, df, fmt)
+
+                times = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    read_cache(key, fmt)
+                    times.append(time.perf_counter() - start)
+
+                size = os.path.getsize(cache_path(key, fmt)) / 2**20
+                row += f"{min(times) * 1000:>14.1f} {size:>6.1f} "
+
+            print(row)
+    finally:
+        os.chdir(root)
+        shutil.rmtree(scratch)
@@ -0,0 +1,49 @@
+# Reports the time taken to extend the stored derived tables (see 'derived.py') with newly added days against
+# deriving them in full, as the number of days added grows - 'tests/test_derived.py' checks that they match.
+# Run from the repository root with `python benchmarks/bench_derived.py [days] [phus]`
+
+import os
+import sys
+import time
+
+import pandas as pd
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from data_handler import key_dict, date_col_dict, set_types
+from derived import update_derived
+from synthetic import make_resources, make_phu_match
+
+def up_to(data_dict, last):
+    '''
+    Function returns the resources in data_dict with only their rows up to the given date
+    '''
+
+    return {**{key: df[df[date_col_dict[key]] <= last].reset_index(drop=True) for key, df in data_dict.items()
+               if key in key_dict}, 'phu_match': data_dict['phu_match']}
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    phus = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    data_dict = {key: set_types(key, df).sort_values(date_col_dict[key], kind='stable', ignore_index=True)
+                 for key, df in make_resources(days, phus).items()}
+    data_dict['phu_match'] = make_phu_match(phus)
+    end = data_dict['cases_tl']['Reported Date'].max()
+
+    full, full_time = timed(update_derived, data_dict)
+    print(f"{days} days, {sum(len(table) for table in full.values())} derived rows, full update {full_time * 1000:.1f} ms")
+    print(f"{'days added':>10} {'incremental (ms)':>17} {'speedup':>8}")
+
+    for added in [1, 7, 30, 365]:
+        stored = update_derived(up_to(data_dict, end - pd.Timedelta(days=added)))
+        _, elapsed = timed(update_derived, data_dict, stored)
+
+        print(f"{added:>10} {elapsed * 1000:>17.1f} {full_time / elapsed:>7.1f}x")
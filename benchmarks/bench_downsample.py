@@ -0,0 +1,43 @@
+# Builds each time-series figure over the whole history of synthetic resources, and reports its build time
+# and payload size at full resolution and downsampled with each method (see 'downsample_points' in 'fig_creator.py').
+# Run from the repository root with `python benchmarks/bench_downsample.py [days] [points]`
+
+import os
+import sys
+import time
+
+import pandas as pd
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fig_creator
+from data_handler import set_types, data_transforms
+from fig_creator import fig_builders, range_figs, downsample_fig, downsample_methods
+from synthetic import make_resources, make_phu_match
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    points = int(sys.argv[2]) if len(sys.argv) > 2 else fig_creator.downsample_points or 500
+
+    data_dict = data_transforms({**{key: set_types(key, df) for key, df in make_resources(days).items()},
+                                 'phu_match': make_phu_match()})
+    now = pd.Timestamp.now()
+
+    print(f"{days} days, at most {points} points per trace")
+    print(f"{'figure':>22} {'method':>8} {'build (ms)':>11} {'KiB':>9}")
+
+    for key in sorted(range_figs):
+        fig, build_time = timed(fig_builders[key], data_dict, now, key, None)
+        print(f"{key:>22} {'full':>8} {build_time * 1000:>11.1f} {len(fig.to_json()) / 1024:>9.1f}")
+
+        for method in downsample_methods:
+            fig_creator.downsample_method = method
+            reduced, reduce_time = timed(downsample_fig, fig, points)
+            print(f"{'':>22} {method:>8} {(build_time + reduce_time) * 1000:>11.1f} {len(reduced.to_json()) / 1024:>9.1f}")
@@ -0,0 +1,135 @@
+# Pulls every resource from a local stand-in for the Ontario Data API (see 'ckan_stub.py') under a set of
+# network conditions, and reports the time, bytes, throughput, peak memory and requests each pull takes, along
+# with the retries, skipped resources and failures. Each scenario pulls into an empty data folder, then again into
+# the one it wrote (where every resource is unchanged, so only its metadata is requested), then again after every
+# resource is republished with new records, which exercises incremental pulls and the fall back on stored files. The "paged" scenario
+# caps the records returned per request, as the real API may, so each resource takes several requests.
+# Run from the repository root with `python benchmarks/bench_fetch.py [days] [phus]`
+
+import os
+import sys
+import time
+import shutil
+import warnings
+import tempfile
+import tracemalloc
+
+from contextlib import redirect_stdout
+from io import StringIO
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import data_handler
+from data_handler import resource_dict, pull_data_from_api
+from ckan_stub import CKANStub
+
+# Stand-in settings of each scenario, and the arguments passed to pull_data_from_api
+scenarios = {
+    "baseline": ({}, {}),
+    "serial": ({}, {'max_workers': 1}),
+    "latency": ({'latency': 0.2, 'jitter': 0.1}, {}),
+    "slow link": ({'bandwidth': 20 * 1024 * 1024}, {}),
+    "errors": ({'error_rate': 0.3}, {}),
+    "outage": ({'fail': set(resource_dict)}, {}),
+    "paged": ({'max_limit': 5000}, {}),
+    "no gzip": ({'compress': False}, {}),
+    "uncond.": ({}, {'conditional': False})}
+
+def point_at(url):
+    '''
+    Function points the data handler's resource URLs at the given API
+    '''
+
+    data_handler.api_url = url
+    for key, resource_id in resource_dict.items():
+        data_handler.key_dict[key] = f"{url}/datastore_search?resource_id={resource_id}&limit=1000000"
+
+def measure(stub, trace=False, **kwargs):
+    stub.reset_stats()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+
+    # The pull's own messages about failures and new records would break up the table
+    with redirect_stdout(StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        stats = {}
+        data_dict, errors = pull_data_from_api(stats=stats, **kwargs)
+
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    rows = sum(len(df) for df in (data_dict or {}).values())
+    return {'time': elapsed, 'bytes': stub.bytes_sent, 'peak': peak,
+            'requests': sum(stub.requests.values()) + sum(stub.metadata_requests.values()),
+            'retries': sum(info['retries'] for info in stats.values()),
+            'skipped': sum(info['status'] == "unchanged" for info in stats.values()),
+            'saved': sum(info['saved'] for info in stats.values()),
+            'errors': sum(stub.errors.values()), 'failed': len(errors), 'ok': data_dict is not None, 'rows': rows}
+
+def run_passes(stub, trace=False, **kwargs):
+    '''
+    Function pulls into an empty data folder, again into the one it wrote, and again after the stand-in republishes
+    every resource with a day's worth of records added, and returns the results of each
+    '''
+
+    cwd = os.getcwd()
+    folder = tempfile.mkdtemp(prefix="bench_fetch_")
+    os.makedirs(os.path.join(folder, "data"))
+    os.chdir(folder)
+
+    # The newest records of each resource are held back until it is republished, so the last pass appends them
+    held = {}
+    for key, records in stub.records.items():
+        held[key] = records[-max(1, len(records) // 200):]
+        stub.records[key] = records[:-len(held[key])]
+
+    try:
+        results = [measure(stub, trace, **kwargs) for _ in range(2)]
+
+        for key in list(held):
+            stub.records[key] = stub.records[key] + held.pop(key)
+        stub.republish()
+
+        return results + [measure(stub, trace, **kwargs)]
+    finally:
+        for key, records in held.items():
+            stub.records[key] = stub.records[key] + records
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 800
+    phus = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    stub = CKANStub(days, phus)
+    point_at(stub.start())
+
+    print(f"{days} days of synthetic data")
+    print(f"{'scenario':>10} {'pass':>11} {'time (s)':>9} {'MB':>7} {'MB/s':>7} {'peak MB':>8} {'requests':>9} {'retries':>8} "
+          f"{'skipped':>8} {'saved MB':>9} {'errors':>7} {'failed':>7} {'rows':>8}")
+
+    try:
+        for name, (settings, kwargs) in scenarios.items():
+            for label, value in {'latency': 0.0, 'jitter': 0.0, 'bandwidth': None, 'max_limit': None,
+                                 'error_rate': 0.0, 'fail': set(), 'compress': True}.items():
+                setattr(stub, label, settings.get(label, value))
+
+            # tracemalloc slows parsing down several times over, so memory is measured by a separate run
+            timed = run_passes(stub, **kwargs)
+            traced = run_passes(stub, trace=True, **kwargs)
+
+            for pass_name, result, peak in zip(["empty", "stored", "republished"], timed, [t['peak'] for t in traced]):
+                mb = result['bytes'] / 1e6
+                status = "" if result['ok'] else "  (no data)"
+
+                print(f"{name:>10} {pass_name:>11} {result['time']:>9.2f} {mb:>7.1f} {mb / result['time']:>7.1f} "
+                      f"{peak / 1e6:>8.1f} {result['requests']:>9} {result['retries']:>8} {result['skipped']:>8} "
+                      f"{result['saved'] / 1e6:>9.1f} {result['errors']:>7} {result['failed']:>7} {result['rows']:>8}{status}")
+    finally:
+        stub.stop()
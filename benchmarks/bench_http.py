@@ -0,0 +1,47 @@
+# Measures the bytes transferred for a first and a returning visit to each page of the dashboard,
+# with and without gzip. Run from the repository root with `python benchmarks/bench_http.py`
+
+import os
+import sys
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+os.chdir(root)
+
+from app import app
+
+pages = ["/", "/hospitalizations", "/testing", "/vaccinations"]
+
+def page_load(client, path, encoding, etags):
+    '''
+    Makes the requests the browser makes to load a page, returning the bytes received and the ETags seen
+    '''
+
+    headers = {"Accept-Encoding": encoding}
+    received = 0
+    seen = {}
+
+    for url in [path, "/_dash-layout", "/_dash-dependencies"]:
+        response = client.get(url, headers=dict(headers, **({"If-None-Match": etags[url]} if url in etags else {})))
+        received += len(response.data)
+        seen[url] = response.headers.get("ETag")
+
+    body = {"output": "page-content.children",
+            "outputs": {"id": "page-content", "property": "children"},
+            "inputs": [{"id": "url", "property": "pathname", "value": path}],
+            "changedPropIds": ["url.pathname"]}
+    received += len(client.post("/_dash-update-component", json=body, headers=headers).data)
+
+    return received, seen
+
+if __name__ == '__main__':
+    client = app.server.test_client()
+
+    print(f"{'page':>18} {'identity (KiB)':>15} {'gzip (KiB)':>11} {'gzip, returning (KiB)':>22}")
+
+    for path in pages:
+        identity, _ = page_load(client, path, "identity", {})
+        gzip, etags = page_load(client, path, "gzip", {})
+        returning, _ = page_load(client, path, "gzip", etags)
+
+        print(f"{path:>18} {identity / 2**10:>15.1f} {gzip / 2**10:>11.1f} {returning / 2**10:>22.1f}")
@@ -0,0 +1,72 @@
+# Measures the choropleth maps built from the PHU boundaries at each stored resolution: build time and
+# JSON payload size, and writes an HTML page per resolution that reports Plotly's render time in the browser.
+# Run from the repository root (after at least one pull) with `python benchmarks/bench_maps.py [output_dir]`
+
+import os
+import sys
+import time
+import json
+import tempfile
+import pandas as pd
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+
+from data_handler import pull_data_from_files, data_transforms
+from fig_creator import create_maps, full_map_dict
+from geometry import resolution_dict, load_geometry
+
+# Each page draws every map in turn and shows how long each took to render
+page_template = '''<html>
+<head><script src="https://cdn.plot.ly/plotly-2.27.0.min.js"></script></head>
+<body>
+<pre id="timings">Rendering...</pre>
+<div id="plot"></div>
+<script>
+const figs = {figs};
+const lines = [];
+(async () => {{
+    for (const [key, fig] of Object.entries(figs)) {{
+        const start = performance.now();
+        await Plotly.newPlot("plot", fig.data, fig.layout);
+        lines.push(key + ": " + (performance.now() - start).toFixed(1) + " ms");
+        Plotly.purge("plot");
+    }}
+    document.getElementById("timings").textContent = lines.join("\\n");
+}})();
+</script>
+</body>
+</html>
+'''
+
+if __name__ == '__main__':
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+    os.makedirs(out_dir, exist_ok=True)
+
+    os.chdir(root)
+    data_dict = pull_data_from_files()
+    data_dict['phu_match'] = pd.read_csv("./shapefiles/phu-id-match.csv")
+    data_dict['phu_map'] = load_geometry()
+    data_dict = data_transforms(data_dict)
+
+    print(f"{'resolution':>10} {'vertices':>9} {'build (s)':>10} {'map JSON (KiB)':>15}")
+
+    for resolution in resolution_dict:
+        data_dict['phu_map'] = load_geometry(resolution)
+        vertices = sum(len(geom.exterior.coords) if geom.geom_type == 'Polygon' else
+                       sum(len(part.exterior.coords) for part in geom.geoms) for geom in data_dict['phu_map'].geometry)
+
+        start = time.perf_counter()
+        fig_dict = create_maps(data_dict, {})
+        elapsed = time.perf_counter() - start
+
+        # Only the full maps carry the boundaries, the other tabs reuse them in the browser
+        figs = {key: json.loads(fig_dict[key].to_json()) for key in full_map_dict}
+        size = sum(len(json.dumps(fig, separators=(',', ':'))) for fig in figs.values()) / len(figs) / 2**10
+
+        with open(os.path.join(out_dir, f"maps_{resolution}.html"), 'w') as f:
+            f.write(page_template.format(figs=json.dumps(figs)))
+
+        print(f"{resolution:>10} {vertices:>9} {elapsed:>10.2f} {size:>15.1f}")
+
+    print(f"Open the pages in {out_dir} in a browser for render times")
@@ -0,0 +1,85 @@
+# Compares the json.load + read_json path for datastore_search responses against the streaming
+# record parser, reporting parse time and peak traced memory for each.
+# Run from the repository root with `python benchmarks/bench_parse.py [n_records]`
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from io import BytesIO, StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from data_handler import read_records
+
+def make_response(n_records, seed=0):
+    '''
+    Builds a datastore_search response body shaped like the 'cases_phu' resource
+    '''
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-03-01", periods=n_records // 34 + 1).strftime("%Y-%m-%dT00:00:00")
+
+    records = [{"_id": i + 1,
+                "FILE_DATE": dates[i // 34],
+                "PHU_NAME": f"Public Health Unit {i % 34}",
+                "PHU_NUM": 2200 + i % 34,
+                "ACTIVE_CASES": int(rng.integers(0, 3000)),
+                "RESOLVED_CASES": int(rng.integers(0, 90000)),
+                "DEATHS": int(rng.integers(0, 900))} for i in range(n_records)]
+
+    body = {"help": "https://data.ontario.ca/api/3/action/help_show?name=datastore_search",
+            "success": True,
+            "result": {"include_total": True,
+                       "records_format": "objects",
+                       "records": records,
+                       "fields": [{"type": "int", "id": key} for key in records[0]],
+                       "total": n_records}}
+
+    return json.dumps(body).encode()
+
+def parse_json(fileobj):
+    # The original parse path in pull_data_from_api
+    jsonobj = json.load(fileobj)
+
+    io = StringIO()
+    json.dump(jsonobj['result']['records'], io)
+
+    return pd.read_json(io.getvalue(), orient='records')
+
+def measure(parse, body):
+    '''
+    Returns the parsed DataFrame, the time taken and the peak traced memory for one parse of body
+    '''
+
+    fileobj = BytesIO(body)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = parse(fileobj)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return df, elapsed, peak
+
+if __name__ == '__main__':
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    body = make_response(n_records)
+    print(f"{n_records} records, {len(body) / 2**20:.1f} MiB response")
+
+    results = {}
+    for name, parse in [("json.load + read_json", parse_json), ("streaming", read_records)]:
+        df, elapsed, peak = measure(parse, body)
+        results[name] = df
+
+        frame_mib = df.memory_usage(deep=True).sum() / 2**20
+        print(f"{name:>22}: {elapsed:6.2f}s, peak {peak / 2**20:7.1f} MiB, frame {frame_mib:6.1f} MiB")
+
+    pd.testing.assert_frame_equal(*results.values())
+    print("Outputs match")
@@ -0,0 +1,138 @@
+# Times each stage of the data and figure pipeline on synthetic data written to a scratch folder, and
+# appends the results to a JSON history, comparing them with the last run at the same scale.
+# Run from the repository root with `python benchmarks/bench_pipeline.py [days] [phus] [age groups] [repeats]`
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+
+from datetime import datetime
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+import geometry
+import fig_creator
+import data_handler
+from utils import change_card
+from synthetic import write_data_dir
+
+history_path = os.path.join(root, "benchmarks", "history.json")
+
+# Changes slower than this (as a fraction of the last run, and by at least regression_min_time seconds,
+# so noise in the fastest stages isn't flagged) are reported as regressions
+regression_threshold = 0.2
+regression_min_time = 0.005
+
+def time_stage(func, repeats, setup=None):
+    '''
+    Function returns the fastest of repeats calls of func (with the result of setup as its argument,
+    if given - setup isn't timed) along with the result of the last call
+    '''
+
+    times = []
+
+    for _ in range(repeats):
+        args = (setup(),) if setup is not None else ()
+
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+def run_pipeline(repeats):
+    '''
+    Function times each stage of the pipeline in the current folder, and returns the timings in seconds
+    '''
+
+    timings = {}
+
+    timings['pull_data_from_files'], resources = time_stage(data_handler.pull_data_from_files, repeats)
+
+    phu_match = pd.read_csv("./shapefiles/phu-id-match.csv")
+    timings['data_transforms'], data_dict = time_stage(data_handler.data_transforms, repeats,
+                                                       setup=lambda: {**{key: df.copy() for key, df in resources.items()},
+                                                                      'phu_match': phu_match})
+
+    timings['kpi_snapshot'], data_dict['kpis'] = time_stage(lambda: data_handler.kpi_snapshot(data_dict), repeats)
+
+    # The simplified boundaries are built once, then loaded
+    geometry.load_geometry()
+    timings['load_geometry'], data_dict['phu_map'] = time_stage(geometry.load_geometry, repeats)
+
+    # Every figure is built from scratch, without the figure caches
+    fig_creator.cache_figs = False
+
+    def build_figs():
+        fig_creator.fig_cache.figs.clear()
+        now, fig_dict = fig_creator.create_fig_dict(data_dict)
+        return {key: fig_dict[key] for key in fig_dict}
+
+    timings['create_fig_dict'], _ = time_stage(build_figs, repeats)
+    timings['create_maps'], _ = time_stage(lambda: fig_creator.create_maps(data_dict, {}), repeats)
+    timings['change_card'], _ = time_stage(lambda: [change_card(data_dict['kpis'], key, key) for key in data_handler.kpi_dict],
+                                           repeats)
+
+    return timings
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    days, phus, age_groups, repeats = args + [1000, None, None, 3][len(args):]
+    scale = {'days': days, 'phus': phus, 'age_groups': age_groups}
+
+    scratch = tempfile.mkdtemp()
+
+    try:
+        write_data_dir(scratch, days, phus, age_groups)
+        os.chdir(scratch)
+        timings = run_pipeline(repeats)
+    finally:
+        os.chdir(root)
+        shutil.rmtree(scratch)
+
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path, 'r') as f:
+            history = json.load(f)
+
+    previous = next((run for run in reversed(history) if run['scale'] == scale), None)
+
+    print(f"{days} days, {phus or 'real'} PHUs, {age_groups or 'real'} age groups, best of {repeats}")
+    print(f"{'stage':>22} {'ms':>10} {'previous':>10} {'change':>8}")
+
+    for stage, elapsed in timings.items():
+        row = f"{stage:>22} {elapsed * 1000:>10.1f}"
+
+        if previous is not None and stage in previous['timings']:
+            change = elapsed / previous['timings'][stage] - 1
+            row += f" {previous['timings'][stage] * 1000:>10.1f} {change:>+8.1%}"
+            if change > regression_threshold and elapsed - previous['timings'][stage] > regression_min_time:
+                row += "  regression"
+
+        print(row)
+
+    history.append({'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(), 'pandas': pd.__version__,
+                    'scale': scale, 'repeats': repeats, 'timings': timings})
+
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=2)
+
+    if previous is not None:
+        print(f"Compared with {previous['commit']} ({previous['date']})")
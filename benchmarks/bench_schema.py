@@ -0,0 +1,33 @@
+# Pulls every resource from the API and reports the memory used by each DataFrame as pulled, with all
+# columns and inferred types, and after it is cast to its schema in 'data_handler.py'.
+# Run from the repository root with `python benchmarks/bench_schema.py`
+
+import os
+import sys
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+
+from data_handler import key_dict, fetch_resource, set_types
+
+def frame_bytes(df):
+    return df.memory_usage(index=True, deep=True).sum()
+
+if __name__ == '__main__':
+    print(f"{'resource':>12} {'rows':>9} {'columns':>9} {'before (MiB)':>13} {'after (MiB)':>12} {'saved':>7}")
+
+    total_before = total_after = 0
+
+    for key, key_url in key_dict.items():
+        raw = fetch_resource(key_url)
+        before = frame_bytes(raw)
+
+        df = set_types(key, raw.copy())
+        after = frame_bytes(df)
+
+        total_before += before
+        total_after += after
+
+        print(f"{key:>12} {len(df):>9} {f'{raw.shape[1]}->{df.shape[1]}':>9} {before / 2**20:>13.2f} {after / 2**20:>12.2f} {1 - after / before:>7.1%}")
+
+    print(f"{'total':>12} {'':>9} {'':>9} {total_before / 2**20:>13.2f} {total_after / 2**20:>12.2f} {1 - total_after / total_before:>7.1%}")
@@ -0,0 +1,34 @@
+# Reports the time taken by each step of data_transforms on synthetic resources, against the total of the
+# original (pre-vectorization) transforms - 'tests/test_transforms.py' checks that their output matches.
+# Run from the repository root with `python benchmarks/bench_transforms.py [days]`
+
+import os
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from data_handler import set_types, data_transforms
+from synthetic import make_resources, make_phu_match
+from tests.test_transforms import legacy_transforms
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    resources = {key: set_types(key, df) for key, df in make_resources(days).items()}
+    print(f"{days} days, {sum(len(df) for df in resources.values())} rows")
+
+    start = time.perf_counter()
+    legacy_transforms({key: df.copy() for key, df in resources.items()})
+    legacy_time = time.perf_counter() - start
+
+    timings = {}
+    start = time.perf_counter()
+    data_transforms({**{key: df.copy() for key, df in resources.items()}, 'phu_match': make_phu_match()}, timings)
+    total_time = time.perf_counter() - start
+
+    for key, elapsed in timings.items():
+        print(f"{key:>12} {elapsed * 1000:>10.1f} ms")
+    print(f"{'total':>12} {total_time * 1000:>10.1f} ms (original {legacy_time * 1000:.1f} ms)")
@@ -0,0 +1,46 @@
+# Starts a number of server workers at once, with and without the shared data store, and reports each
+# one's startup time and memory (proportional set size, so pages shared between workers are split among them).
+# Linux only. Run from the repository root (after at least one pull) with `python benchmarks/bench_workers.py [workers]`
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Each worker imports the app (which builds or attaches to its data), then reports back
+worker = '''
+import json, time, resource
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+with open("/proc/self/smaps_rollup") as f:
+    pss = next(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+print(json.dumps({"startup": elapsed, "pss": pss / 1024,
+                  "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+def start_workers(n, shared):
+    env = dict(os.environ, SHARED_STORE="1" if shared else "0")
+    procs = [subprocess.Popen([sys.executable, "-c", worker], cwd=root, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) for _ in range(n)]
+
+    return [json.loads(proc.communicate()[0].strip().splitlines()[-1]) for proc in procs]
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    # Start from an empty store so one of the workers has to build it
+    shutil.rmtree(os.path.join(root, "data", "shared"), ignore_errors=True)
+
+    print(f"{'mode':>8} {'worker':>7} {'startup (s)':>12} {'PSS (MiB)':>10} {'max RSS (MiB)':>14}")
+
+    for shared in [False, True]:
+        results = start_workers(n, shared)
+
+        for i, result in enumerate(results):
+            print(f"{'shared' if shared else 'separate':>8} {i:>7} {result['startup']:>12.2f} {result['pss']:>10.1f} {result['max_rss']:>14.1f}")
+
+        print(f"{'':>8} {'total':>7} {max(r['startup'] for r in results):>12.2f} {sum(r['pss'] for r in results):>10.1f}")
@@ -0,0 +1,199 @@
+# Local stand-in for the Ontario Data Catalogue's CKAN datastore_search API, serving synthetic resources
+# (see 'synthetic.py') so the fetch path can be measured without the real API. Latency, bandwidth,
+# payload size, paging and errors can all be configured. Run it directly to serve on a port:
+# `python benchmarks/ckan_stub.py [port] [days]`, then start the dashboard with
+# ONTARIO_API_URL=http://127.0.0.1:<port>/api/3/action
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import threading
+
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from data_handler import resource_dict
+from synthetic import make_resources
+
+class CKANStub:
+    '''
+    Serves datastore_search for every resource in resource_dict from a background thread. Its settings
+    can be changed between requests:
+
+    latency - seconds before each response starts (plus up to jitter seconds more)
+    bandwidth - bytes per second each response is sent at (None for unlimited)
+    max_limit - most records returned per request, whatever limit was asked for (None for no cap)
+    error_rate - chance of each request failing, with an error status or a response cut off part way
+    fail - keys of resources whose requests always fail
+    compress - whether responses are gzip-compressed for clients that accept it
+
+    resource_show gives each resource's last_modified time, which republish() moves forward
+    '''
+
+    def __init__(self, days=800, phus=None, age_groups=None, extra_columns=0, seed=0):
+        self.latency = 0.0
+        self.jitter = 0.0
+        self.bandwidth = None
+        self.max_limit = None
+        self.error_rate = 0.0
+        self.fail = set()
+        self.compress = True
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+        # Records are kept ready to encode, with any filler columns the real resources have beyond
+        # the ones the dashboard uses
+        self.records = {}
+        self.fields = {}
+        for key, df in make_resources(days, phus, age_groups, seed).items():
+            for i in range(extra_columns):
+                df[f"extra_{i}"] = i * 1000.5
+
+            self.records[key] = json.loads(df.to_json(orient='records'))
+            self.fields[key] = [{'id': col, 'type': 'int' if col == '_id' else 'text'} for col in df.columns]
+
+        self.keys = {resource_id: key for key, resource_id in resource_dict.items()}
+        self.last_modified = {key: "2022-01-01T00:00:00.000000" for key in self.records}
+        self.server = None
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = Counter()
+            self.metadata_requests = Counter()
+            self.errors = Counter()
+            self.bytes_sent = 0
+
+    def republish(self, *keys):
+        '''
+        Marks the given resources (all of them by default) as modified now
+        '''
+
+        for key in keys or self.records:
+            self.last_modified[key] = time.strftime("%Y-%m-%dT%H:%M:%S") + f".{time.time_ns() % 10**9 // 1000:06d}"
+
+    def start(self, port=0):
+        '''
+        Starts serving on the given port (any free one by default), and returns the base URL of the API
+        '''
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="ckan-stub", daemon=True).start()
+
+        return f"http://127.0.0.1:{self.server.server_port}/api/3/action"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path.endswith("/resource_show"):
+            key = self.keys.get(query.get('id'))
+            if key is None:
+                return self.send(request, 404, {'success': False, 'error': {'message': "Not found"}})
+
+            with self.lock:
+                self.metadata_requests[key] += 1
+
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+            return self.send(request, 200, {'success': True, 'result': {
+                'id': query['id'], 'datastore_active': True, 'format': "CSV",
+                'last_modified': self.last_modified[key], 'metadata_modified': self.last_modified[key]}})
+
+        key = self.keys.get(query.get('resource_id'))
+
+        if not url.path.endswith("/datastore_search") or key is None:
+            return self.send(request, 404, {'success': False, 'error': {'message': "Not found"}})
+
+        with self.lock:
+            self.requests[key] += 1
+            failing = key in self.fail or self.random.random() < self.error_rate
+            truncate = failing and self.random.random() < 0.5
+
+        time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        if failing and not truncate:
+            with self.lock:
+                self.errors[key] += 1
+            return self.send(request, 503, {'success': False, 'error': {'message': "Service unavailable"}})
+
+        records = self.records[key]
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 100))
+        if self.max_limit is not None:
+            limit = min(limit, self.max_limit)
+
+        page = records[offset:offset + limit]
+        next_offset = offset + len(page)
+
+        body = {'help': f"{request.path}", 'success': True, 'result': {
+            'resource_id': query['resource_id'], 'fields': self.fields[key], 'records': page,
+            '_links': {'start': f"{url.path}?resource_id={query['resource_id']}&limit={limit}",
+                       'next': f"{url.path}?resource_id={query['resource_id']}&limit={limit}&offset={next_offset}"},
+            'limit': limit, 'offset': offset, 'total': len(records)}}
+
+        if truncate:
+            with self.lock:
+                self.errors[key] += 1
+
+        self.send(request, 200, body, truncate=truncate)
+
+    def send(self, request, status, body, truncate=False):
+        data = json.dumps(body).encode()
+        compressed = self.compress and "gzip" in request.headers.get("Accept-Encoding", "")
+
+        if compressed:
+            data = gzip.compress(data, compresslevel=6)
+
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        if compressed:
+            request.send_header("Content-Encoding", "gzip")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+
+        # A cut off response stops half way, with the connection closed
+        if truncate:
+            data = data[:len(data) // 2]
+            request.close_connection = True
+
+        chunk = 1 << 16
+        for start in range(0, len(data), chunk):
+            request.wfile.write(data[start:start + chunk])
+            if self.bandwidth:
+                time.sleep(min(chunk, len(data) - start) / self.bandwidth)
+
+        with self.lock:
+            self.bytes_sent += len(data)
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8800
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 800
+
+    stub = CKANStub(days)
+    print(f"Serving {days} days of synthetic data at {stub.start(port)}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.stop()
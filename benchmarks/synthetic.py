@@ -0,0 +1,168 @@
+# Generates synthetic resources shaped like the Ontario Data Catalogue ones, for benchmarks that
+# shouldn't depend on the API or on the size of the real data. Running it directly writes a data folder:
+# `python benchmarks/synthetic.py <folder> [days] [phus] [age groups]`
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from datetime import date
+from shapely.geometry import box
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+
+from data_handler import key_dict, set_types, write_cache
+
+# Age groups of the vaccination resource, which the figures expect to find
+vax_age_groups = ['05-11yrs', '12-17yrs', '18-29yrs', '30-39yrs', '40-49yrs', '50-59yrs', '60-69yrs', '70-79yrs', '80+',
+                  'Adults_18plus', 'Ontario_12plus']
+
+def make_phu_match(phus=None, seed=0):
+    '''
+    Function returns the PHU ID, name and population table - the real one, or a synthetic one of the given
+    number of PHUs, which starts with the real PHUs and is padded with made up ones
+    '''
+
+    phu_match = pd.read_csv(os.path.join(root, "shapefiles", "phu-id-match.csv"))
+
+    if phus is None:
+        return phu_match
+
+    rng = np.random.default_rng(seed)
+    extra = max(phus - len(phu_match), 0)
+
+    padding = pd.DataFrame({
+        "PHU_ID": 90000 + np.arange(extra),
+        "NAME_ENG": [f"Synthetic Health Unit {i}" for i in range(extra)],
+        "POP": rng.integers(20000, 2000000, extra)})
+
+    return pd.concat([phu_match.head(phus), padding], ignore_index=True)
+
+def make_resources(days=800, phus=None, age_groups=None, seed=0):
+    '''
+    Function returns a dictionary of synthetic resources covering the given number of days up to today,
+    with the columns and value formats of the API (dates as strings, test volumes with thousands separators).
+    The per-PHU resources have a row per day for each PHU of make_phu_match(phus), and the vaccination by
+    age resource one for each of age_groups groups (at least the real ones, padded with made up ones)
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    phu_match = make_phu_match(phus, seed)
+    phu_ids = phu_match['PHU_ID'].to_numpy()
+    phu_names = phu_match['NAME_ENG'].to_numpy()
+
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=days, freq="D").strftime("%Y-%m-%d")
+    n = len(dates)
+
+    data_dict = {}
+
+    deaths = np.cumsum(rng.integers(0, 50, n)).astype(float)
+    deaths_new = deaths.copy()
+    deaths[-30:] = np.nan
+
+    data_dict['cases_tl'] = pd.DataFrame({
+        "Reported Date": dates,
+        "Total Cases": np.cumsum(rng.integers(100, 5000, n)),
+        "Deaths": deaths,
+        "Deaths_New_Methodology": deaths_new,
+        "Total tests completed in the last day": rng.integers(1000, 90000, n),
+        "Percent positive tests in last day": rng.uniform(1, 30, n).round(1)})
+
+    data_dict['cases_phu'] = pd.DataFrame({
+        "FILE_DATE": np.repeat(dates, len(phu_ids)),
+        "PHU_NAME": np.tile(phu_names, n),
+        "PHU_NUM": np.tile(phu_ids, n),
+        "ACTIVE_CASES": rng.integers(0, 3000, n * len(phu_ids)),
+        "RESOLVED_CASES": rng.integers(0, 90000, n * len(phu_ids)),
+        "DEATHS": rng.integers(0, 900, n * len(phu_ids))})
+
+    cases_vaxed = {"Date": dates}
+    for col in ["covid19_cases_unvac", "covid19_cases_partial_vac", "covid19_cases_full_vac", "covid19_cases_vac_unknown"]:
+        cases_vaxed[col] = rng.integers(0, 3000, n)
+    for col in ["cases_unvac_rate_per100K", "cases_partial_vac_rate_per100K", "cases_full_vac_rate_per100K"]:
+        cases_vaxed[col] = rng.uniform(1, 200, n).round(2)
+    data_dict['cases_vaxed'] = pd.DataFrame(cases_vaxed)
+
+    at_least_one = np.linspace(1e5, 1.3e7, n).astype(int)
+    data_dict['vax_stat'] = pd.DataFrame({
+        "report_date": dates,
+        "total_individuals_at_least_one": at_least_one,
+        "total_individuals_fully_vaccinated": (at_least_one * 0.9).astype(int),
+        "total_individuals_3doses": np.where(np.arange(n) > n // 2, (at_least_one * 0.5).astype(int), np.nan)})
+
+    groups = vax_age_groups + [f"synthetic_{i}" for i in range(max((age_groups or 0) - len(vax_age_groups), 0))]
+    population = rng.integers(500000, 2000000, n * len(groups))
+    data_dict['vax_age'] = pd.DataFrame({
+        "Date": np.repeat(dates, len(groups)),
+        "Agegroup": np.tile(groups, n),
+        "At least one dose_cumulative": (population * 0.8).astype(int),
+        "fully_vaccinated_cumulative": (population * 0.7).astype(int),
+        "third_dose_cumulative": (population * 0.4).astype(int),
+        "Total population": population})
+
+    hosp_vax = {"date": dates}
+    for col in ["icu_unvac", "icu_partial_vac", "icu_full_vac",
+                "hospitalnonicu_unvac", "hospitalnonicu_partial_vac", "hospitalnonicu_full_vac"]:
+        hosp_vax[col] = rng.integers(0, 800, n)
+    data_dict['hosp_vax'] = pd.DataFrame(hosp_vax)
+
+    data_dict['tests_phu'] = pd.DataFrame({
+        "DATE": np.repeat(dates, len(phu_ids)),
+        "PHU_name": np.tile(phu_names, n),
+        "PHU_num": np.tile(phu_ids, n),
+        "percent_positive_7d_avg": rng.uniform(0, 0.3, n * len(phu_ids)).round(4),
+        "test_volumes_7d_avg": [f"{v:,}" for v in rng.integers(10, 20000, n * len(phu_ids))],
+        "tests_per_1000_7d_avg": rng.uniform(0, 10, n * len(phu_ids)).round(2)})
+
+    ages = ["0to13", "14to17", "18to24", "25to64", "65+"]
+    data_dict['tests_age'] = pd.DataFrame({
+        "DATE": np.repeat(dates, len(ages)),
+        "age_category": np.tile(ages, n),
+        "percent_positive_7d_avg": rng.uniform(0, 0.3, n * len(ages)).round(4)})
+
+    for df in data_dict.values():
+        df.insert(0, "_id", np.arange(1, len(df) + 1))
+
+    return data_dict
+
+def write_data_dir(path, days=800, phus=None, age_groups=None, seed=0):
+    '''
+    Function writes a folder the dashboard can run from - stored resources in ./data, marked as pulled today,
+    and PHU boundaries (a grid of squares) with their ID table in ./shapefiles - and returns the resources
+    '''
+
+    os.makedirs(os.path.join(path, "data"), exist_ok=True)
+    os.makedirs(os.path.join(path, "shapefiles"), exist_ok=True)
+
+    phu_match = make_phu_match(phus, seed)
+    phu_match.to_csv(os.path.join(path, "shapefiles", "phu-id-match.csv"), index=False)
+
+    # The maps join the boundaries to the ID table by position, so they are written in the same order
+    side = int(np.ceil(np.sqrt(len(phu_match))))
+    squares = [box(-95 + (i % side), 42 + i // side, -94 + (i % side), 43 + i // side) for i in range(len(phu_match))]
+    gpd.GeoDataFrame({"PHU_ID": phu_match['PHU_ID']}, geometry=squares, crs=4326) \
+        .to_file(os.path.join(path, "shapefiles", "MOH_PHU_BOUNDARY.shp"))
+
+    resources = make_resources(days, phus, age_groups, seed)
+
+    cwd = os.getcwd()
+    os.chdir(path)
+
+    try:
+        for key in key_dict:
+            write_cache(key, set_types(key, resources[key].copy()))
+
+        with open("./data/last_pull.txt", 'w') as f:
+            f.write(date.today().isoformat())
+    finally:
+        os.chdir(cwd)
+
+    return resources
+
+if __name__ == '__main__':
+    write_data_dir(sys.argv[1], *[int(arg) for arg in sys.argv[2:5]])
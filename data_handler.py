@@ -1,24 +1,197 @@
 
 import os
+import re
+import glob
 import json
+import codecs
+import pickle
+import gzip
+import random
+import hashlib
+import time
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import geometry
+import metrics
+import derived
+from metrics import span, observe_stage
 
 from datetime import date
 from io import StringIO
-from urllib.request import urlopen
+from http.client import HTTPException
+from contextlib import contextmanager
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import pyarrow.feather
+    ArrowException = pyarrow.lib.ArrowException
+except ImportError:
+    pyarrow = None
+    ArrowException = ()
+
+# Base URL of the Ontario Data Catalogue API - it can be pointed at a local stand-in (see benchmarks/ckan_stub.py)
+api_url = os.environ.get("ONTARIO_API_URL", "https://data.ontario.ca/api/3/action")
+
+# IDs of the resources on the Ontario Data Catalogue
+resource_dict = {
+    "cases_tl": "ed270bb8-340b-41f9-a7c6-e8ef587e6d11",
+    "cases_phu": "d1bfe1ad-6575-4352-8302-09ca81f7ddfc",
+    "cases_vaxed": "eed63cf2-83dd-4598-b337-b288c0a89a16",
+    "vax_stat": "8a89caa9-511c-4568-af89-7f2174b4378c",
+    "vax_age": "775ca815-5028-4e9b-9dd4-6975ff1be021",
+    "hosp_vax": "274b819c-5d69-4539-a4db-f2950794138c",
+    "tests_phu": "07bc0e21-26b5-4152-b609-c1958cb7b227",
+    "tests_age": "05214a0d-d8d9-4ea4-8d2a-f6e3833ba471"}
 
 # URLs to call API on
-key_dict = {
-    "cases_tl": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=ed270bb8-340b-41f9-a7c6-e8ef587e6d11&limit=1000000",
-    "cases_phu": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=d1bfe1ad-6575-4352-8302-09ca81f7ddfc&limit=1000000",
-    "cases_vaxed": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=eed63cf2-83dd-4598-b337-b288c0a89a16&limit=1000000",
-    "vax_stat": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=8a89caa9-511c-4568-af89-7f2174b4378c&limit=1000000",
-    "vax_age": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=775ca815-5028-4e9b-9dd4-6975ff1be021&limit=1000000",
-    "hosp_vax": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=274b819c-5d69-4539-a4db-f2950794138c&limit=1000000",
-    "tests_phu": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=07bc0e21-26b5-4152-b609-c1958cb7b227&limit=1000000",
-    "tests_age": "https://data.ontario.ca/api/3/action/datastore_search?resource_id=05214a0d-d8d9-4ea4-8d2a-f6e3833ba471&limit=1000000"}
+key_dict = {key: f"{api_url}/datastore_search?resource_id={resource_id}&limit=1000000" for key, resource_id in resource_dict.items()}
+
+# Date column of each resource, used to check which days are already stored
+date_col_dict = {
+    "cases_tl": "Reported Date",
+    "cases_phu": "FILE_DATE",
+    "cases_vaxed": "Date",
+    "vax_stat": "report_date",
+    "vax_age": "Date",
+    "hosp_vax": "date",
+    "tests_phu": "DATE",
+    "tests_age": "DATE"}
+
+# Columns of each resource that are used downstream and their types - every other column is dropped when
+# the resource is read. Counts are stored as int32 (falling back on float64 if they have gaps), repeated
+# labels as categoricals and the date column is parsed with the resource's date format (None to infer it).
+# Columns typed None are kept as they are read
+schema_dict = {
+    "cases_tl": {
+        'date_format': "%Y-%m-%d",
+        'columns': {
+            "_id": "int32",
+            "Reported Date": "datetime64[ns]",
+            "Total Cases": "int32",
+            "Deaths": "float64",
+            "Deaths_New_Methodology": "float64",
+            "Total tests completed in the last day": "float64",
+            "Percent positive tests in last day": "float64"}},
+    "cases_phu": {
+        'date_format': "%Y-%m-%d",
+        'columns': {
+            "_id": "int32",
+            "FILE_DATE": "datetime64[ns]",
+            "PHU_NAME": "category",
+            "PHU_NUM": "int32",
+            "ACTIVE_CASES": "int32"}},
+    "cases_vaxed": {
+        'date_format': "%Y-%m-%d",
+        'columns': {
+            "_id": "int32",
+            "Date": "datetime64[ns]",
+            "covid19_cases_unvac": "int32",
+            "covid19_cases_partial_vac": "int32",
+            "covid19_cases_full_vac": "int32",
+            "covid19_cases_vac_unknown": "int32",
+            "cases_unvac_rate_per100K": "float64",
+            "cases_partial_vac_rate_per100K": "float64",
+            "cases_full_vac_rate_per100K": "float64"}},
+    "vax_stat": {
+        'date_format': "%Y-%m-%d",
+        'columns': {
+            "_id": "int32",
+            "report_date": "datetime64[ns]",
+            "total_individuals_at_least_one": "int32",
+            "total_individuals_fully_vaccinated": "int32",
+            "total_individuals_3doses": "float64"}},
+    "vax_age": {
+        'date_format': None,
+        'columns': {
+            "_id": "int32",
+            "Date": "datetime64[ns]",
+            "Agegroup": "category",
+            "At least one dose_cumulative": "int32",
+            "fully_vaccinated_cumulative": "int32",
+            "third_dose_cumulative": "int32",
+            "Total population": "int32"}},
+    "hosp_vax": {
+        'date_format': "%Y-%m-%d",
+        'columns': {
+            "_id": "int32",
+            "date": "datetime64[ns]",
+            "icu_unvac": "int32",
+            "icu_partial_vac": "int32",
+            "icu_full_vac": "int32",
+            "hospitalnonicu_unvac": "int32",
+            "hospitalnonicu_partial_vac": "int32",
+            "hospitalnonicu_full_vac": "int32"}},
+    "tests_phu": {
+        'date_format': "%Y-%m-%d",
+        'columns': {
+            "_id": "int32",
+            "DATE": "datetime64[ns]",
+            "PHU_name": "category",
+            "PHU_num": "int32",
+            "percent_positive_7d_avg": "float64",
+            "test_volumes_7d_avg": None,
+            "tests_per_1000_7d_avg": "float64"}},
+    "tests_age": {
+        'date_format': "%Y-%m-%d",
+        'columns': {
+            "_id": "int32",
+            "DATE": "datetime64[ns]",
+            "age_category": "category",
+            "percent_positive_7d_avg": "float64"}}}
+
+# Metrics shown on the dashboard's change cards - the transformed resource and column each is read from.
+# Their latest and previous values are computed once per pull by kpi_snapshot
+kpi_dict = {
+    "active_cases": ("cases_tl", "ACTIVE_CASES"),
+    "new_cases": ("cases_tl", "New Cases"),
+    "new_deaths": ("cases_tl", "New Deaths"),
+    "test_volume": ("cases_tl", "Total tests completed in the last day"),
+    "percent_positive": ("cases_tl", "Percent positive tests in last day"),
+    "per_partially": ("vax_stat", "per_partially"),
+    "per_fully": ("vax_stat", "per_fully"),
+    "per_boosted": ("vax_stat", "per_boosted"),
+    "hosp_total": ("hosp_vax", "total"),
+    "hosp_icu": ("hosp_vax", "icu"),
+    "hosp_nonicu": ("hosp_vax", "nonicu")}
+
+# Maximum number of resources pulled from the API at once, and the timeout (in seconds) for each one
+max_workers = 8
+fetch_timeout = 120
+
+# Whether resources with a stored file only pull the records newer than it from the API
+incremental_pulls = True
+
+# Days after which a resource that has been pulled incrementally is pulled in full again. Incremental pulls only
+# check the last stored record, so revisions to earlier records are only picked up by full pulls
+full_pull_days = 7
+
+# Whether each stored resource's last_modified time in the catalogue is checked before pulling it, so that
+# resources which haven't been republished since their last pull are read from their stored file instead
+conditional_pulls = True
+
+# Number of times a failed request is retried, and the delay (in seconds) before the first retry, which
+# doubles after each one (plus random jitter)
+fetch_retries = 3
+retry_backoff = 1.0
+
+# Whether API responses are parsed record by record rather than loaded whole with json.load
+stream_records = True
+
+# Format resources are stored in under ./data - "feather" (memory-mapped on load) and "parquet" keep
+# column types such as dates and need pyarrow, while "csv" does not
+cache_format = "feather" if pyarrow is not None else "csv"
+
+# Whether the transformed data dictionary is stored and reused while its inputs are unchanged
+cache_transforms = True
+
+# Matches the start of the records array in a datastore_search response
+records_pattern = re.compile(r'"records"\s*:\s*\[')
+
+# Matches the total number of records of the resource in a datastore_search response
+total_pattern = re.compile(r'"total"\s*:\s*(\d+)')
 
 def pull_data():
     '''
@@ -34,45 +207,516 @@ def pull_data():
             last = date.fromisoformat(f.readline())
 
     if last is not None and now <= last:
+        # Nothing has been pulled, so the stored transforms can be used if the inputs are unchanged
+        if cache_transforms:
+            with span("read_transformed"):
+                data_dict = read_transformed(input_fingerprint())
+            if data_dict is not None:
+                return data_dict
+
         data_dict = pull_data_from_files()
     else:
-        data_dict = pull_data_from_api()
-        with open("./data/last_pull.txt", 'w') as f:
-            f.write(now.isoformat())
+        data_dict, errors = pull_data_from_api()
 
+        if data_dict is None:
+            return None
 
-    phu_match = pd.read_csv("./shapefiles/phu-id-match.csv")
-    phu_map = gpd.read_file("./shapefiles/MOH_PHU_BOUNDARY.shp").set_crs(epsg=4326)
+        # Only mark today as pulled if every resource came from the API and today's data was published,
+        # so that a pull made before it is published is made again
+        if not errors and data_is_current(data_dict, now):
+            with open("./data/last_pull.txt", 'w') as f:
+                f.write(now.isoformat())
+        elif not errors:
+            print("Today's data isn't published yet, so it will be pulled again on the next refresh")
+
+        # If no resource was republished, the stored files are unchanged and so are their transforms
+        if cache_transforms:
+            with span("read_transformed"):
+                transformed = read_transformed(input_fingerprint())
+            if transformed is not None:
+                return transformed
+
+
+    with span("geometry"):
+        phu_match = pd.read_csv("./shapefiles/phu-id-match.csv")
+        phu_map = geometry.load_geometry()
 
     data_dict['phu_map'] = phu_map
     data_dict['phu_match'] = phu_match
 
-    data_dict = data_transforms(data_dict)
+    timings = {}
+    with span("transforms"):
+        data_dict = data_transforms(data_dict, timings, derived.read_derived())
+    for step, seconds in timings.items():
+        observe_stage("transform", seconds, step=step)
+
+    with span("write_derived"):
+        derived.write_derived(data_dict['derived'])
+
+    with span("kpis"):
+        data_dict['kpis'] = kpi_snapshot(data_dict)
+
+    with span("phu_history"):
+        data_dict['phu_history'] = phu_history(data_dict)
+
+    # Downstream caches (such as the stored figures) are keyed by the data version
+    data_dict['data_version'] = input_fingerprint()
+
+    if cache_transforms:
+        with span("write_transformed"):
+            write_transformed(data_dict['data_version'], data_dict)
 
     return data_dict
 
+def pull_data_from_api(max_workers=max_workers, timeout=fetch_timeout, stream=stream_records, incremental=incremental_pulls,
+                       conditional=conditional_pulls, stats=None):
+    '''
+    Function pulls data from Ontario Data API and returns it in a dictionary along with a dictionary
+    of the resources that failed, or None if failure. Resources are pulled concurrently, and any
+    resource that fails falls back on its stored file when one exists. What was pulled for each
+    resource is recorded in stats, if given (see fetch_key)
+    '''
+
+    stats = {} if stats is None else stats
+
+    with span("fetch"):
+        data_dict, errors = fetch_resources(max_workers=max_workers, timeout=timeout, stream=stream, incremental=incremental,
+                                            conditional=conditional, stats=stats)
+
+    resource_meta = read_resource_meta()
+
+    for key in data_dict:
+        if stats[key]['status'] == "unchanged":
+            continue
+
+        with span("write_cache", resource=key):
+            write_cache(key, data_dict[key])
 
-def pull_data_from_api():
+        # Resources are only skipped later if their last_modified time was known when they were pulled
+        meta = resource_meta.pop(key, {})
+        pulled = stats[key]['status'] == "pulled"
+        resource_meta[key] = {'last_modified': stats[key]['last_modified'],
+                              'bytes': stats[key]['bytes'] if pulled else meta.get('bytes', 0),
+                              'full_pull': date.today().isoformat() if pulled else meta.get('full_pull')}
+
+    write_resource_meta(resource_meta)
+    report_fetch(stats)
+
+    for key, error in errors.items():
+        print(f"Failed to pull '{key}' from the Ontario Data API: {error!r}")
+
+        if not cache_exists(key):
+            return None, errors
+
+        print(f"Using stored file for '{key}'")
+        with span("read_cache", resource=key):
+            data_dict[key] = read_cache(key)
+
+    return data_dict, errors
+
+def report_fetch(stats):
     '''
-    Function pulls data from Ontario Data API and returns it in a dictionary,
-    or None if failure
+    Function prints a summary of the requests and bytes a pull took and saved, and adds them to the fetch metrics
     '''
 
-    data_dict = {}
+    totals = {name: sum(info[name] for info in stats.values()) for name in ['requests', 'retries', 'bytes', 'decoded', 'saved']}
+    skipped = [key for key, info in stats.items() if info['status'] == "unchanged"]
 
-    for key, key_url in key_dict.items():
-        fileobj = urlopen(key_url)
-        jsonobj = json.load(fileobj)
+    for key, info in stats.items():
+        metrics.fetch_requests.inc(info['requests'], resource=key)
+        metrics.fetch_retries.inc(info['retries'], resource=key)
+        metrics.fetch_bytes.inc(info['bytes'], resource=key, kind="transferred")
+        metrics.fetch_bytes.inc(info['decoded'], resource=key, kind="uncompressed")
+        metrics.fetch_bytes_saved.inc(info['saved'], resource=key)
+        metrics.fetch_skipped.inc(info['status'] == "unchanged", resource=key)
 
-        io = StringIO()
-        json.dump(jsonobj['result']['records'], io)
+    print(f"Made {totals['requests']} requests to the Ontario Data API ({totals['retries']} retries), transferring "
+          f"{totals['bytes'] / 1e6:.1f} MB ({totals['decoded'] / 1e6:.1f} MB uncompressed). Skipped {len(skipped)} "
+          f"resources unchanged since their last pull, saving {totals['saved'] / 1e6:.1f} MB")
 
-        data_dict[key] = pd.read_json(io.getvalue(), orient='records')
+def fetch_resources(keys=None, max_workers=max_workers, timeout=fetch_timeout, stream=stream_records, incremental=incremental_pulls,
+                    conditional=conditional_pulls, stats=None):
+    '''
+    Function pulls the given resources (all of key_dict by default) from the Ontario Data API concurrently,
+    and returns a dictionary of the DataFrames pulled and a dictionary of the exceptions for those that failed.
+    If incremental, resources with a stored file only pull the records added since it was written, and if
+    conditional, those which haven't been modified since are read from it instead.
+    What was pulled for each resource is recorded in stats, if given (see fetch_key)
+    '''
 
-    for key in data_dict:
-        data_dict[key].to_csv(f"./data/{key}.csv", index=False)
+    keys = list(key_dict) if keys is None else list(keys)
+    stats = {} if stats is None else stats
+    resource_meta = read_resource_meta() if conditional or incremental else {}
 
-    return data_dict
+    frames = {}
+    errors = {}
+
+    if not keys:
+        return frames, errors
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys)))) as pool:
+        futures = {}
+        for key in keys:
+            stats[key] = {'status': None, 'last_modified': None, 'requests': 0, 'retries': 0, 'bytes': 0, 'decoded': 0, 'saved': 0}
+            futures[pool.submit(fetch_key, key, timeout, stream, incremental, conditional, resource_meta.get(key), stats[key])] = key
+
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                frames[key] = set_types(key, future.result())
+            except Exception as e:
+                stats[key]['status'] = "failed"
+                errors[key] = e
+
+    return frames, errors
+
+def fetch_key(key, timeout=fetch_timeout, stream=stream_records, incremental=incremental_pulls, conditional=conditional_pulls,
+              meta=None, info=None):
+    '''
+    Function pulls a single resource by its key - only its new records, if incremental and it has a stored
+    file that was pulled in full within full_pull_days (according to meta) - and times the pull (including its
+    parsing) as its "fetch_resource" stage. If conditional, the
+    resource's last_modified time is checked first, and if it matches the one in meta (recorded when the stored
+    file was pulled) the stored file is read instead. The outcome ("pulled", "appended" or "unchanged"), the
+    last_modified time and the requests and bytes the pull took are recorded in info
+    '''
+
+    info = {} if info is None else info
+    stored = cache_exists(key)
+
+    with span("fetch_resource", resource=key):
+        if conditional:
+            info['last_modified'] = fetch_last_modified(key, timeout, info)
+
+            if stored and meta is not None and info['last_modified'] is not None and info['last_modified'] == meta.get('last_modified'):
+                info['status'] = "unchanged"
+                info['saved'] = meta.get('bytes', 0)
+                return read_cache(key)
+
+        if incremental and stored and not full_pull_due(meta):
+            return fetch_resource_delta(key, timeout, stream, info)
+
+        info['status'] = "pulled"
+        return fetch_resource(key_dict[key], timeout, stream, info)
+
+def full_pull_due(meta, today=None):
+    '''
+    Function returns whether a stored resource is due to be pulled in full again, given its entry in
+    resource_meta.json (or None if it has none)
+    '''
+
+    if meta is None or not meta.get('full_pull'):
+        return True
+
+    today = today or date.today()
+    return (today - date.fromisoformat(meta['full_pull'])).days >= full_pull_days
+
+def fetch_last_modified(key, timeout=fetch_timeout, info=None):
+    '''
+    Function returns the time a resource was last modified according to its catalogue metadata, or None if
+    it can't be found (in which case the resource is pulled as usual)
+    '''
+
+    info = {} if info is None else info
+    url = f"{api_url}/resource_show?id={resource_dict[key]}"
+
+    for attempt in range(fetch_retries + 1):
+        try:
+            with open_url(url, timeout, info) as fileobj:
+                result = json.load(fileobj)['result']
+
+            return result.get('last_modified') or result.get('metadata_modified')
+        except (OSError, EOFError, ValueError, HTTPException) as e:
+            if not should_retry(attempt, e):
+                print(f"Could not check whether '{key}' was modified: {e!r}")
+                return None
+
+            wait_to_retry(url, attempt, e, info)
+
+def resources_changed(timeout=fetch_timeout):
+    '''
+    Function returns whether any resource has been republished since it was last pulled, by comparing the
+    last_modified time in its catalogue metadata with the one recorded in resource_meta.json. Resources whose
+    time isn't known (or that have no stored file) count as changed
+    '''
+
+    resource_meta = read_resource_meta()
+
+    for key in key_dict:
+        recorded = resource_meta.get(key, {}).get('last_modified')
+
+        if recorded is None or not cache_exists(key) or fetch_last_modified(key, timeout) != recorded:
+            return True
+
+    return False
+
+def read_resource_meta():
+    '''
+    Function returns the last_modified time and download size of each resource when it was last pulled
+    '''
+
+    try:
+        with open("./data/resource_meta.json", 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_resource_meta(resource_meta):
+    with open("./data/resource_meta.json.tmp", 'w') as f:
+        json.dump(resource_meta, f, indent=1)
+
+    os.replace("./data/resource_meta.json.tmp", "./data/resource_meta.json")
+
+def should_retry(attempt, error):
+    '''
+    Function checks whether a request that failed with error on the given attempt (counting from 0) should be
+    retried - not after fetch_retries retries, nor for client errors (other than timeouts and rate limits),
+    which won't go away on their own
+    '''
+
+    return attempt < fetch_retries and not (isinstance(error, HTTPError) and error.code < 500 and error.code not in (408, 429))
+
+def wait_to_retry(url, attempt, error, info):
+    '''
+    Function waits before retrying a failed request - an exponential backoff from retry_backoff, plus random
+    jitter so that concurrent pulls don't retry in lockstep - and counts the retry in info
+    '''
+
+    delay = retry_backoff * 2 ** attempt + random.uniform(0, retry_backoff)
+    info['retries'] = info.get('retries', 0) + 1
+
+    print(f"Retrying {url} in {delay:.1f}s after {error!r}")
+    time.sleep(delay)
+
+@contextmanager
+def open_url(url, timeout=fetch_timeout, info=None):
+    '''
+    Function opens a URL of the Ontario Data API asking for a gzip-compressed response, and yields a file object
+    of the decompressed response. The requests made and the bytes transferred and decompressed are added to info
+    '''
+
+    info = {} if info is None else info
+    info['requests'] = info.get('requests', 0) + 1
+
+    with urlopen(Request(url, headers={"Accept-Encoding": "gzip"}), timeout=timeout) as response:
+        transferred = CountingReader(response, info, 'bytes')
+        compressed = response.headers.get("Content-Encoding") == "gzip"
+
+        yield CountingReader(gzip.GzipFile(fileobj=transferred) if compressed else transferred, info, 'decoded')
+
+class CountingReader:
+    '''
+    Wraps a file object, adding the number of bytes read from it to info[name]
+    '''
+
+    def __init__(self, fileobj, info, name):
+        self.fileobj = fileobj
+        self.info = info
+        self.name = name
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.info[self.name] = self.info.get(self.name, 0) + len(data)
+        return data
+
+def fetch_resource(key_url, timeout=fetch_timeout, stream=stream_records, info=None, offset=0):
+    '''
+    Function pulls a single resource from the Ontario Data API (from the given record on) and returns it as a
+    DataFrame. The API may return fewer records per request than asked for, so further pages are requested by
+    offset until the resource's total is reached
+    '''
+
+    info = {} if info is None else info
+    pages = []
+    pulled = 0
+
+    while True:
+        page_url = key_url if offset + pulled == 0 else f"{key_url}&offset={offset + pulled}"
+        page, total = fetch_page(page_url, timeout, stream, info)
+
+        pages.append(page)
+        pulled += len(page)
+
+        if total is None or offset + pulled >= total:
+            break
+        if len(page) == 0:
+            print(f"Only {offset + pulled} of {total} records were returned for {key_url}")
+            break
+
+    return pages[0] if len(pages) == 1 else pd.concat(pages, ignore_index=True)
+
+def fetch_page(page_url, timeout=fetch_timeout, stream=stream_records, info=None):
+    '''
+    Function makes one datastore_search request and returns its records as a DataFrame, along with the total
+    number of records of the resource (or None if it isn't given). Requests that fail with a server or
+    connection error, or whose response is cut off part way, are retried (see should_retry)
+    '''
+
+    for attempt in range(fetch_retries + 1):
+        try:
+            with open_url(page_url, timeout, info) as fileobj:
+                if stream:
+                    meta = {}
+                    return read_records(fileobj, meta=meta), meta.get('total')
+
+                jsonobj = json.load(fileobj)
+            break
+        except (OSError, EOFError, ValueError, HTTPException) as e:
+            if not should_retry(attempt, e):
+                raise
+
+            wait_to_retry(page_url, attempt, e, info)
+
+    io = StringIO()
+    json.dump(jsonobj['result']['records'], io)
+
+    return pd.read_json(io.getvalue(), orient='records'), jsonobj['result'].get('total')
+
+def fetch_resource_delta(key, timeout=fetch_timeout, stream=stream_records, info=None):
+    '''
+    Function pulls only the records of a resource that come after its stored file, and returns the stored
+    data with them appended. Falls back on a full pull if the schema has changed, if the last stored record
+    has changed or there are no records after it (so the resource was republished without simply growing),
+    or if records after it are dated before it. Revisions to other earlier records aren't seen here, which is
+    why resources are also pulled in full every full_pull_days. Whether it was "appended" or "pulled" in full
+    is recorded in info
+    '''
+
+    info = {} if info is None else info
+
+    cached = read_cache(key)
+    date_col = date_col_dict[key]
+
+    if len(cached) == 0 or '_id' not in cached or date_col not in cached:
+        info['status'] = "pulled"
+        return fetch_resource(key_dict[key], timeout, stream, info)
+
+    # Pull the last stored record again along with everything after it, to check that it hasn't changed
+    delta = fetch_resource(key_dict[key], timeout, stream, info, offset=len(cached) - 1)
+
+    if len(delta) == 0:
+        reason = "records were removed"
+    else:
+        delta = set_types(key, delta)
+
+        if list(delta.columns) != list(cached.columns):
+            reason = "schema changed"
+        elif delta['_id'].iloc[0] != cached['_id'].iloc[-1] or delta[date_col].iloc[0] != cached[date_col].iloc[-1]:
+            reason = "stored records changed"
+        elif len(delta) == 1:
+            reason = "records were republished without new ones"
+        elif delta[date_col].iloc[1:].min() < cached[date_col].iloc[-1]:
+            reason = "earlier days were revised"
+        else:
+            print(f"Pulled {len(delta) - 1} new records for '{key}'")
+            info['status'] = "appended"
+            return pd.concat([cached, delta.iloc[1:]], ignore_index=True)
+
+    print(f"Pulling all of '{key}' since its {reason}")
+    info['status'] = "pulled"
+    return fetch_resource(key_dict[key], timeout, stream, info)
+
+def read_records(fileobj, batch_size=100000, meta=None):
+    '''
+    Function parses the records of a datastore_search response one at a time into column buffers and
+    returns them as a DataFrame, so that neither the full response text nor its dict tree is held in memory.
+    Column dtypes are converted the same way pd.read_json converts them. The resource's total number of
+    records is put in meta, if given
+    '''
+
+    columns = {}
+    batches = []
+    n = 0
+
+    for record in iter_records(fileobj, meta=meta):
+        for col, value in record.items():
+            values = columns.get(col)
+            if values is None:
+                values = columns[col] = [None] * n
+            values.append(value)
+
+        n += 1
+
+        # Pad out any columns this record was missing
+        if len(record) < len(columns):
+            for values in columns.values():
+                if len(values) < n:
+                    values.append(None)
+
+        # Flush the buffers into a typed frame every batch_size records to bound their size
+        if n == batch_size:
+            batches.append(pd.DataFrame(columns))
+            columns = {col: [] for col in columns}
+            n = 0
+
+    if n > 0 or not batches:
+        batches.append(pd.DataFrame(columns))
+
+    df = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+    del batches
+
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+
+        lower = col.lower()
+        is_date = lower.endswith(('_at', '_time')) or lower.startswith('timestamp') or lower in ('modified', 'date', 'datetime')
+
+        try:
+            df[col] = pd.to_datetime(df[col]) if is_date else pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            pass
+
+    return df
+
+def iter_records(fileobj, chunk_size=1 << 20, meta=None):
+    '''
+    Function incrementally reads a datastore_search response and yields each record in it as a dict. Once
+    the records are read, the resource's total number of records (which may come before or after them) is
+    put in meta, if given
+    '''
+
+    decoder = json.JSONDecoder()
+    reader = codecs.getreader('utf-8')(fileobj)
+
+    # Read up to the start of the records array
+    buf = ''
+    match = None
+    while match is None:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            raise ValueError("Response does not contain any records")
+        buf += chunk
+        match = records_pattern.search(buf)
+
+    head = buf[:match.start()]
+    pos = match.end()
+    eof = False
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == ']':
+            if meta is not None:
+                # The rest of the response is only a few small fields
+                total = total_pattern.search(head) or total_pattern.search(buf[pos:] + reader.read())
+                meta['total'] = int(total.group(1)) if total else None
+            return
+
+        try:
+            record, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # The next record runs past the end of the buffer, so read in more of the response
+            if eof:
+                raise
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        yield record
 
 def pull_data_from_files():
     '''
@@ -82,69 +726,367 @@ def pull_data_from_files():
     data_dict = {}
 
     for key, key_url in key_dict.items():
-        data_dict[key] = pd.read_csv(f"./data/{key}.csv")
+        with span("read_cache", resource=key):
+            data_dict[key] = read_cache(key)
 
     return data_dict
 
-def data_transforms (data_dict):
+def cache_path(key, fmt=None):
+    '''
+    Function returns the path of the stored file for a resource in the given format (cache_format by default)
+    '''
+
+    return f"./data/{key}.{fmt or cache_format}"
+
+def cache_exists(key):
+    '''
+    Function checks whether a resource has been stored, either in cache_format or as a CSV awaiting migration
+    '''
+
+    return os.path.exists(cache_path(key)) or os.path.exists(cache_path(key, "csv"))
+
+def read_cache(key, fmt=None):
+    '''
+    Function reads the stored file for a resource, migrating it from CSV to the given format the
+    first time it is read
+    '''
+
+    fmt = fmt or cache_format
+    path = cache_path(key, fmt)
+
+    if fmt != "csv" and not os.path.exists(path):
+        df = set_types(key, pd.read_csv(cache_path(key, "csv")))
+
+        if write_cache(key, df, fmt) == fmt:
+            os.remove(cache_path(key, "csv"))
+
+        return df
+
+    # Files stored before a change to the schema are brought in line with it as they are read
+    if fmt == "feather":
+        return set_types(key, pyarrow.feather.read_table(path, memory_map=True).to_pandas())
+    elif fmt == "parquet":
+        return set_types(key, pd.read_parquet(path, memory_map=True))
+
+    return set_types(key, pd.read_csv(path))
+
+def write_cache(key, df, fmt=None):
+    '''
+    Function stores a resource in the given format, falling back on CSV if its columns can't be stored
+    with types. Returns the format that was written
+    '''
+
+    fmt = fmt or cache_format
+
+    # Only CSV can be written without pyarrow
+    if fmt != "csv" and pyarrow is None:
+        print(f"Storing '{key}' as CSV since {fmt} needs pyarrow, which isn't installed")
+        fmt = "csv"
+
+    path = cache_path(key, fmt)
+
+    if fmt == "csv":
+        df.to_csv(path + ".tmp", index=False)
+    else:
+        try:
+            if fmt == "feather":
+                df.reset_index(drop=True).to_feather(path + ".tmp", compression="uncompressed")
+            else:
+                df.to_parquet(path + ".tmp", index=False)
+        except (ArrowException, TypeError, ValueError) as e:
+            print(f"Storing '{key}' as CSV since it could not be stored as {fmt}: {e!r}")
+
+            for stale in (path + ".tmp", path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+
+            return write_cache(key, df, "csv")
+
+    # Replace the stored file in one step so readers never see a partial write
+    os.replace(path + ".tmp", path)
+
+    return fmt
+
+def set_types(key, df):
+    '''
+    Function keeps only the columns of a resource listed in its schema and casts them to their types, so
+    resources have the same compact form whether they were pulled or read from a stored file
+    '''
+
+    schema = schema_dict[key]
+    columns = [col for col in schema['columns'] if col in df]
+
+    missing = [col for col in schema['columns'] if col not in df]
+    if missing:
+        print(f"Resource '{key}' is missing columns {missing}")
+
+    if columns != list(df.columns):
+        df = df[columns].copy()
+
+    for col in columns:
+        dtype = schema['columns'][col]
+
+        if dtype is not None and str(df[col].dtype) != dtype:
+            df[col] = cast_column(df[col], dtype, schema['date_format'])
+
+    return df
+
+def cast_column(series, dtype, date_format=None):
+    '''
+    Function casts a column to the given schema type. Integer columns with missing or out of range values
+    are cast to float64 instead, and columns that can't be cast are returned as they are
+    '''
+
+    try:
+        if dtype.startswith("datetime64"):
+            # Not exact, so that timestamps with a time after the date are parsed too
+            if date_format is None:
+                return pd.to_datetime(series)
+            return pd.to_datetime(series, format=date_format, exact=False)
+
+        if dtype == "category":
+            return series.astype("category")
+
+        values = pd.to_numeric(series)
+
+        if dtype.startswith("int"):
+            info = np.iinfo(dtype)
+
+            if values.isna().any() or (len(values) > 0 and (values.min() < info.min or values.max() > info.max)) \
+                    or not (values % 1 == 0).all():
+                return values.astype("float64")
+
+        return values.astype(dtype)
+    except (ValueError, TypeError) as e:
+        print(f"Could not cast column '{series.name}' to {dtype}: {e!r}")
+        return series
+
+def input_fingerprint():
+    '''
+    Function returns a hash identifying the inputs of data_transforms - the stored resources, the PHU
+    boundaries at the map resolution and the code in this file and 'derived.py' - so that stored transforms can be matched to them
+    '''
+
+    fingerprint = hashlib.sha1()
+
+    for path in [__file__, derived.__file__]:
+        with open(path, 'rb') as f:
+            fingerprint.update(f.read())
+
+    fingerprint.update(f"{pd.__version__} {gpd.__version__} {geometry.map_resolution}".encode())
+
+    paths = [cache_path(key) if os.path.exists(cache_path(key)) else cache_path(key, "csv") for key in key_dict]
+    paths += sorted(glob.glob("./shapefiles/MOH_PHU_BOUNDARY.*")) + ["./shapefiles/phu-id-match.csv"]
+    paths += [geometry.geometry_path(geometry.map_resolution)]
+
+    # Stored files are only ever replaced whole, so their size and modification time identify them
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint.update(f"{path} {stat.st_size} {stat.st_mtime_ns}".encode())
+
+    return fingerprint.hexdigest()
+
+def read_transformed(fingerprint):
+    '''
+    Function returns the stored transformed data dictionary for the given input fingerprint, or None
+    if there isn't one
+    '''
+
+    path = f"./data/transformed-{fingerprint}.pkl"
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Could not read stored transforms: {e!r}")
+        return None
+
+def write_transformed(fingerprint, data_dict):
+    '''
+    Function stores the transformed data dictionary under its input fingerprint, replacing any stored
+    for older inputs
+    '''
+
+    path = f"./data/transformed-{fingerprint}.pkl"
+
+    with open(path + ".tmp", 'wb') as f:
+        pickle.dump(data_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(path + ".tmp", path)
+
+    for old in glob.glob("./data/transformed-*.pkl"):
+        if old != path:
+            os.remove(old)
+
+# Step that transforms each resource, run in order by data_transforms
+transform_steps = {}
+
+def transform_step (key):
+    '''
+    Registers the decorated function as the transform of the given resource. Steps are called with the
+    resource's DataFrame and the data dictionary, and return the transformed DataFrame
+    '''
+
+    def register(func):
+        transform_steps[key] = func
+        return func
+
+    return register
+
+def data_transforms (data_dict, timings=None, stored_derived=None):
     '''
     Function performs a variety of data transforms to DataFrames in the input dictionary, 
-    which are used for downstream figure creation
+    which are used for downstream figure creation. Dates are already parsed by each resource's schema,
+    and each resource is sorted by them first. The derived tables (see 'derived.py') are then updated
+    from stored_derived, if given, before the steps that use them.
+    The time taken by each step is recorded in timings, if given
     '''
 
-    data_dict['hosp_vax']['icu'] = data_dict['hosp_vax']['icu_unvac'] +\
-                                   data_dict['hosp_vax']['icu_partial_vac'] +\
-                                   data_dict['hosp_vax']['icu_full_vac']
+    # Resources are kept sorted by date (stably, so rows within a day keep their order), which lets
+    # figures find date ranges by binary search
+    start = time.perf_counter()
+    for key in key_dict:
+        if not data_dict[key][date_col_dict[key]].is_monotonic_increasing:
+            data_dict[key] = data_dict[key].sort_values(date_col_dict[key], kind='stable', ignore_index=True)
+
+    if timings is not None:
+        timings['sort'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data_dict['derived'] = derived.update_derived(data_dict, stored_derived)
+
+    if timings is not None:
+        timings['derived'] = time.perf_counter() - start
+
+    for key, step in transform_steps.items():
+        start = time.perf_counter()
+        data_dict[key] = step(data_dict[key], data_dict)
+
+        if timings is not None:
+            timings[key] = time.perf_counter() - start
 
-    data_dict['hosp_vax']['nonicu'] = data_dict['hosp_vax']['hospitalnonicu_unvac'] +\
-                                     data_dict['hosp_vax']['hospitalnonicu_partial_vac'] +\
-                                     data_dict['hosp_vax']['hospitalnonicu_full_vac'] 
+    return data_dict
+
+@transform_step('hosp_vax')
+def transform_hosp_vax (df, data_dict):
+    df['icu'] = df['icu_unvac'] + df['icu_partial_vac'] + df['icu_full_vac']
+    df['nonicu'] = df['hospitalnonicu_unvac'] + df['hospitalnonicu_partial_vac'] + df['hospitalnonicu_full_vac']
+    df['tot_unvac'] = df['hospitalnonicu_unvac'] + df['icu_unvac']
+    df['tot_partial_vac'] = df['hospitalnonicu_partial_vac'] + df['icu_partial_vac']
+    df['tot_full_vac'] = df['hospitalnonicu_full_vac'] + df['icu_full_vac']
+    df['total'] = df['icu'] + df['nonicu']
+
+    return df
+
+@transform_step('cases_tl')
+def transform_cases_tl (df, data_dict):
+    df['Deaths'] = df['Deaths'].fillna(df['Deaths_New_Methodology'])
+    df['Tests'] = df['Total tests completed in the last day']
+    df['Percent positive tests in last day'] = df['Percent positive tests in last day'] / 100
+    df['Positive Tests'] = df['Total tests completed in the last day'] * df['Percent positive tests in last day']
 
-    data_dict['hosp_vax']['date'] = pd.to_datetime(data_dict['hosp_vax']['date'], format='%Y-%m-%d')
-    data_dict['hosp_vax']['tot_unvac'] = data_dict['hosp_vax']['hospitalnonicu_unvac'] + data_dict['hosp_vax']['icu_unvac']
-    data_dict['hosp_vax']['tot_partial_vac'] = data_dict['hosp_vax']['hospitalnonicu_partial_vac'] + data_dict['hosp_vax']['icu_partial_vac']
-    data_dict['hosp_vax']['tot_full_vac'] = data_dict['hosp_vax']['hospitalnonicu_full_vac'] + data_dict['hosp_vax']['icu_full_vac']
-    data_dict['hosp_vax']['total'] = data_dict['hosp_vax']['icu'] + data_dict['hosp_vax']['nonicu']
+    # Daily deltas and active case totals come from the derived tables, which have a row for each row of cases_tl
+    province = data_dict['derived']['province']
+    df['New Cases'] = province['new_cases'].to_numpy()
+    df['New Deaths'] = province['new_deaths'].to_numpy()
 
-    data_dict['cases_tl']['Reported Date'] = pd.to_datetime(data_dict['cases_tl']['Reported Date'], format='%Y-%m-%d')
-    data_dict['cases_tl']['Deaths'] = data_dict['cases_tl']['Deaths'].where(~data_dict['cases_tl']['Deaths'].isna(), data_dict['cases_tl']['Deaths_New_Methodology'])
-    data_dict['cases_tl']['Tests'] = data_dict['cases_tl']['Total tests completed in the last day']
-    data_dict['cases_tl']['Percent positive tests in last day'] = data_dict['cases_tl']['Percent positive tests in last day'] / 100
-    data_dict['cases_tl']['Positive Tests'] = data_dict['cases_tl']['Total tests completed in the last day'] * data_dict['cases_tl']['Percent positive tests in last day']
-    data_dict['cases_tl']['New Cases'] = np.concatenate((np.array([np.nan]), data_dict['cases_tl']['Total Cases'].to_numpy()[1:] - data_dict['cases_tl']['Total Cases'].to_numpy()[:-1]))
-    data_dict['cases_tl']['New Deaths'] = np.concatenate((np.array([np.nan]), data_dict['cases_tl']['Deaths'].to_numpy()[1:] - data_dict['cases_tl']['Deaths'].to_numpy()[:-1]))
-    data_dict['cases_tl']['New Deaths'] = data_dict['cases_tl']['New Deaths'].apply(lambda x: x if x >= 0 else np.nan)
+    active_cases = data_dict['derived']['active']['active_cases'].rename('ACTIVE_CASES').rename_axis('FILE_DATE')
+    return pd.merge(df, active_cases, how='left', left_on='Reported Date', right_on='FILE_DATE')
 
-    data_dict['cases_vaxed']['Date'] = pd.to_datetime(data_dict['cases_vaxed']['Date'], format='%Y-%m-%d')
-    data_dict['cases_vaxed']['Tot Cases'] = data_dict['cases_vaxed']['covid19_cases_unvac'] + data_dict['cases_vaxed']['covid19_cases_partial_vac'] +\
-                                            data_dict['cases_vaxed']['covid19_cases_full_vac'] + data_dict['cases_vaxed']['covid19_cases_vac_unknown']
+@transform_step('cases_vaxed')
+def transform_cases_vaxed (df, data_dict):
+    df['Tot Cases'] = df['covid19_cases_unvac'] + df['covid19_cases_partial_vac'] + \
+                      df['covid19_cases_full_vac'] + df['covid19_cases_vac_unknown']
 
+    return df
 
-    data_dict['vax_stat']['Date'] = pd.to_datetime(data_dict['vax_stat']['report_date'], format='%Y-%m-%d')
-    data_dict['vax_stat']['Tot Vaxed'] = data_dict['vax_stat']['total_individuals_fully_vaccinated']
-    data_dict['vax_stat']['part Vaxed'] = data_dict['vax_stat']['total_individuals_at_least_one'] - data_dict['vax_stat']['total_individuals_fully_vaccinated']
-    data_dict['vax_stat']['UnVaxed'] = 14826276 - data_dict['vax_stat']['total_individuals_at_least_one']
-    data_dict['vax_stat']['UnVaxed12o'] = 13038032 - data_dict['vax_stat']['total_individuals_at_least_one']
+@transform_step('vax_stat')
+def transform_vax_stat (df, data_dict):
+    df['Date'] = df['report_date']
+    df['Tot Vaxed'] = df['total_individuals_fully_vaccinated']
+    df['part Vaxed'] = df['total_individuals_at_least_one'] - df['total_individuals_fully_vaccinated']
+    df['UnVaxed'] = 14826276 - df['total_individuals_at_least_one']
+    df['UnVaxed12o'] = 13038032 - df['total_individuals_at_least_one']
 
-    data_dict['vax_stat']['per_partially'] = data_dict['vax_stat']['total_individuals_at_least_one'] / 14826276
-    data_dict['vax_stat']['per_fully'] = data_dict['vax_stat']['total_individuals_fully_vaccinated'] / 14826276
-    data_dict['vax_stat']['per_boosted'] = data_dict['vax_stat']['total_individuals_3doses'] / 14826276
+    df['per_partially'] = df['total_individuals_at_least_one'] / 14826276
+    df['per_fully'] = df['total_individuals_fully_vaccinated'] / 14826276
+    df['per_boosted'] = df['total_individuals_3doses'] / 14826276
 
-    data_dict['vax_age']['Date'] = pd.to_datetime(data_dict['vax_age']['Date'])
+    return df
 
-    data_dict['cases_phu']['FILE_DATE'] = pd.to_datetime(data_dict['cases_phu']['FILE_DATE'], format='%Y-%m-%d')
-    cases_phu = data_dict['cases_phu'][['FILE_DATE', 'ACTIVE_CASES']].groupby('FILE_DATE').sum()
-    data_dict['cases_tl'] = pd.merge(data_dict['cases_tl'], cases_phu, how='left', left_on='Reported Date', right_on='FILE_DATE')
+@transform_step('tests_phu')
+def transform_tests_phu (df, data_dict):
+    # Volumes come from the API as strings with thousands separators. Only the distinct strings are parsed,
+    # since the same volumes recur across days and PHUs
+    if not pd.api.types.is_numeric_dtype(df['test_volumes_7d_avg']):
+        codes, uniques = pd.factorize(df['test_volumes_7d_avg'])
+        volumes = pd.Series(uniques).str.replace(',', '', regex=False).astype('int64').to_numpy()
+        # Missing volumes (code -1) are kept as NaN
+        df['test_volumes_7d_avg'] = volumes[codes] if (codes >= 0).all() else np.where(codes >= 0, volumes[codes], np.nan)
 
-    data_dict['tests_phu']['DATE'] = pd.to_datetime(data_dict['tests_phu']['DATE'], format='%Y-%m-%d')
-    data_dict['tests_phu']['test_volumes_7d_avg'] = data_dict['tests_phu']['test_volumes_7d_avg'].apply(lambda x: int(x.replace(',', '')))
+    return df
 
-    data_dict['tests_age']['DATE'] = pd.to_datetime(data_dict['tests_age']['DATE'], format='%Y-%m-%d')
+@transform_step('tests_age')
+def transform_tests_age (df, data_dict):
     tests_age_key = {"0to13": "0 to 13 Years Old",
-                        "14to17": "14 to 17 Years Old",
-                        "18to24": "18 to 24 Years Old",
-                        "25to64": "25 to 64 Years Old",
-                        "65+": "65+ Years Old"}
-    data_dict['tests_age']['age_category'] = data_dict['tests_age']['age_category'].apply(lambda x: tests_age_key[x])
+                     "14to17": "14 to 17 Years Old",
+                     "18to24": "18 to 24 Years Old",
+                     "25to64": "25 to 64 Years Old",
+                     "65+": "65+ Years Old"}
+
+    # Only the categories themselves are relabeled
+    df['age_category'] = df['age_category'].map(tests_age_key)
+
+    return df
+
+def data_is_current (data_dict, today=None):
+    '''
+    Function returns whether the daily case counts include the given day's (today's by default) report
+    '''
+
+    today = pd.Timestamp(today or date.today())
+    return bool(len(data_dict['cases_tl'])) and data_dict['cases_tl'][date_col_dict['cases_tl']].max() >= today
+
+def kpi_snapshot (data_dict):
+    '''
+    Function returns a table of the value of each metric in kpi_dict on the latest day of its resource and
+    on the day before that (the first row of each day), with one pass over each resource
+    '''
+
+    rows = {}
+
+    for key in dict.fromkeys(key for key, _ in kpi_dict.values()):
+        df = data_dict[key]
+        dates = df[date_col_dict[key]]
+        cols = [col for kpi_key, col in kpi_dict.values() if kpi_key == key]
+
+        latest = dates.max()
+        earlier = dates < latest
+
+        curr = df[cols].iloc[np.argmax((dates == latest).to_numpy())]
+        last = df[cols].iloc[np.argmax((dates == dates[earlier].max()).to_numpy())] if earlier.any() else curr * np.nan
+
+        for kpi, (kpi_key, col) in kpi_dict.items():
+            if kpi_key == key:
+                rows[kpi] = {'date': latest, 'current': curr[col], 'previous': last[col]}
+
+    return pd.DataFrame.from_dict(rows, orient='index').loc[list(kpi_dict)]
+
+def phu_history (data_dict):
+    '''
+    Function returns the cases and testing history of every PHU as one table indexed by (PHU_ID, date) and
+    sorted, so that the history of a PHU (and a range of its dates) is an index slice rather than a mask
+    over every row. Active cases and their rates (per 100k of the PHU's population) come from the derived PHU table
+    '''
+
+    cases = data_dict['derived']['phu'][['active_cases', 'active_case_rate']].reset_index()
+    tests = data_dict['tests_phu'][['PHU_num', 'DATE', 'test_volumes_7d_avg', 'tests_per_1000_7d_avg', 'percent_positive_7d_avg']] \
+        .rename(columns={'PHU_num': 'PHU_ID', 'DATE': 'date'})
+
+    history = pd.merge(cases, tests, how="outer", on=['PHU_ID', 'date'])
 
-    return data_dict
\ No newline at end of file
+    return history.set_index(['PHU_ID', 'date']).sort_index()
@@ -0,0 +1,188 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Windows (in days) of the rolling averages kept for each derived series
+rolling_windows = (7, 14)
+
+# Whether derived tables are stored in ./data between pulls, and only extended with the days added since
+incremental_derived = True
+
+# Function that derives each table, with the resource it is derived from and that resource's date column
+derived_tables = {}
+
+def derived_table (name, resource, date_col):
+    '''
+    Registers the decorated function as the one deriving the named table from the given resource. It is
+    called with the rows of the resource (sorted by date_col) and the data dict, and returns the table
+    indexed by date - or by (group, date), sorted - with a row for each date of the rows it was given
+    '''
+
+    def register(func):
+        derived_tables[name] = (resource, date_col, func)
+        return func
+
+    return register
+
+def add_rolling (table, columns, group=None):
+    '''
+    Adds the rolling average over each of rolling_windows days of each of columns to table, which is indexed
+    by date (within group, if given). Windows are by date rather than by row, so missing days aren't spanned
+    '''
+
+    values = table[columns] if group is None else table[columns].reset_index(group).groupby(group)[columns]
+
+    # Each window is one pass over every column, and grouped results keep the table's (group, date) order
+    for days in rolling_windows:
+        averages = values.rolling(f"{days}D").mean()
+
+        for col in columns:
+            table[f"{col}_{days}d_avg"] = averages[col].to_numpy()
+
+    return table
+
+@derived_table('province', 'cases_tl', 'Reported Date')
+def derive_province (df, data_dict):
+    # Daily new cases and deaths - drops in the death count are corrections rather than new deaths
+    deaths = df['Deaths'].fillna(df['Deaths_New_Methodology'])
+    new_deaths = deaths.diff()
+
+    table = pd.DataFrame({'new_cases': df['Total Cases'].diff().to_numpy(),
+                          'new_deaths': new_deaths.where(new_deaths >= 0).to_numpy()},
+                         index=pd.DatetimeIndex(df['Reported Date'], name='date'))
+
+    return add_rolling(table, ['new_cases', 'new_deaths'])
+
+@derived_table('active', 'cases_phu', 'FILE_DATE')
+def derive_active (df, data_dict):
+    # Total active cases over all PHUs on each day
+    table = df.groupby('FILE_DATE')['ACTIVE_CASES'].sum().rename('active_cases').rename_axis('date').to_frame()
+
+    return add_rolling(table, ['active_cases'])
+
+@derived_table('phu', 'cases_phu', 'FILE_DATE')
+def derive_phu (df, data_dict):
+    table = pd.DataFrame({'PHU_ID': df['PHU_NUM'].to_numpy(), 'date': df['FILE_DATE'].to_numpy(),
+                          'active_cases': df['ACTIVE_CASES'].to_numpy()})
+
+    population = data_dict['phu_match'].set_index('PHU_ID')['POP']
+    table['active_case_rate'] = table['active_cases'] / table['PHU_ID'].map(population).to_numpy() * 100000
+
+    table = table.set_index(['PHU_ID', 'date']).sort_index()
+    table['active_cases_change'] = table.groupby(level='PHU_ID')['active_cases'].diff()
+
+    return add_rolling(table, ['active_cases', 'active_case_rate'], group='PHU_ID')
+
+@derived_table('age', 'vax_age', 'Date')
+def derive_age (df, data_dict):
+    table = pd.DataFrame({'Agegroup': df['Agegroup'].astype(str).to_numpy(), 'date': df['Date'].to_numpy()})
+
+    # Share of each age group with each dose, and the doses given each day
+    for dose, col in [('first_dose', 'At least one dose_cumulative'), ('full', 'fully_vaccinated_cumulative'),
+                      ('third_dose', 'third_dose_cumulative')]:
+        table[f"{dose}_coverage"] = (df[col] / df['Total population']).to_numpy()
+        table[f"{dose}_cumulative"] = df[col].to_numpy()
+
+    table = table.set_index(['Agegroup', 'date']).sort_index()
+
+    for dose in ['first_dose', 'full', 'third_dose']:
+        table[f"new_{dose}s"] = table.groupby(level='Agegroup')[f"{dose}_cumulative"].diff()
+
+    return add_rolling(table, ['new_first_doses', 'new_fulls', 'new_third_doses'], group='Agegroup')
+
+def context_rows (dates, last):
+    '''
+    Returns the position of the first row (of rows sorted by dates) needed to derive the days after last -
+    enough days before it to fill the longest rolling window and take each daily change
+    '''
+
+    return dates.searchsorted(last - pd.Timedelta(days=max(rolling_windows)), side='left')
+
+def rows_check (df, data_dict):
+    '''
+    Returns a hash of the given rows of a resource, the PHU table, the windows and the code in this file. The
+    stored table of a resource holds the hash of all the rows it was derived from, and is only extended if the
+    same rows of the resource still give the same hash - so revisions to any earlier day rebuild it
+    '''
+
+    check = hashlib.sha1()
+    with open(__file__, 'rb') as f:
+        check.update(f.read())
+    check.update(repr(rolling_windows).encode())
+    check.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    check.update(pd.util.hash_pandas_object(data_dict['phu_match'], index=False).to_numpy().tobytes())
+
+    return check.hexdigest()
+
+def update_derived (data_dict, stored=None):
+    '''
+    Returns every derived table for the resources in data_dict (which must be sorted by date). Tables in stored
+    (from an earlier update) are only extended with the days after their last one, derived from those days
+    and the few before them - as long as the resource's rows up to then are unchanged - and are derived in
+    full otherwise. Each table keeps what is needed to check this in its attrs
+    '''
+
+    stored = stored or {}
+    tables = {}
+
+    for name, (resource, date_col, func) in derived_tables.items():
+        df = data_dict[resource]
+        dates = df[date_col]
+        old = stored.get(name)
+        table = None
+
+        # An empty resource has no last date to extend from, so its table is derived in full (and is empty)
+        if len(dates) == 0:
+            table = func(df, data_dict)
+            table.attrs = {'last_date': None, 'rows': 0, 'check': rows_check(df, data_dict)}
+            tables[name] = table
+            continue
+
+        if old is not None and old.attrs.get('last_date') is not None:
+            last = old.attrs['last_date']
+            start, end = context_rows(dates, last), dates.searchsorted(last, side='right')
+
+            if end == old.attrs['rows'] and rows_check(df.iloc[:end], data_dict) == old.attrs['check']:
+                new = func(df.iloc[start:], data_dict)
+                new = new[new.index.get_level_values('date') > last]
+                table = pd.concat([old, new]) if len(new) else old.copy()
+
+                # Every new row is later than the stored rows of its group, so a stable sort by group alone
+                # puts grouped tables back in (group, date) order
+                if isinstance(table.index, pd.MultiIndex) and len(new):
+                    table = table.iloc[np.argsort(table.index.get_level_values(0).to_numpy(), kind='stable')]
+
+        if table is None:
+            table = func(df, data_dict)
+
+        last = dates.iloc[-1]
+        table.attrs = {'last_date': last, 'rows': len(df), 'check': rows_check(df, data_dict)}
+        tables[name] = table
+
+    return tables
+
+def read_derived (path="./data/derived.pkl"):
+    '''
+    Returns the stored derived tables, or None if there are none (or they can't be read)
+    '''
+
+    if not incremental_derived or not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Could not read stored derived tables: {e!r}")
+        return None
+
+def write_derived (tables, path="./data/derived.pkl"):
+    if not incremental_derived:
+        return
+
+    # Replace the file in one step so other processes never read a partial one
+    with open(f"{path}.tmp{os.getpid()}", 'wb') as f:
+        pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp{os.getpid()}", path)
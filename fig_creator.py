@@ -1,21 +1,271 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
 import numpy as np
 import pandas as pd
 
-import plotly 
+import plotly
 import plotly.express as px
 import plotly.graph_objects as go
 
+from metrics import span
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# Whether built figures are stored to disk and reused while the data version and day are unchanged
+cache_figs = True
+
+# Maximum number of figures held in memory at once, across all data versions
+fig_cache_size = 32
+
+# Identifies the figure code, so stored figures are rebuilt whenever it changes
+with open(__file__, 'rb') as f:
+    fig_version = hashlib.sha1(f.read()).hexdigest()[:12]
+
+# Date ranges that can be picked for the time-series figures, in days back from today (None for the
+# whole history), and the range they are shown with by default
+date_ranges = {"3 Months": 90, "6 Months": 180, "1 Year": 365, "All": None}
+default_days = 180
+
+# Maximum number of points sent per trace of the time-series figures (None to send every point), and
+# how they are chosen - "lttb" (Largest-Triangle-Three-Buckets) or "minmax" (the extremes of each bucket).
+# Zooming into a figure fetches the zoomed range at full resolution
+downsample_points = 500
+downsample_method = "lttb"
+
+# Function that builds each figure, keyed by the figure's key in the figure dict
+fig_builders = {}
+
+# Keys of the time-series figures, which can be built for any date range
+range_figs = set()
+
+def fig_builder (*keys, ranged=False):
+    '''
+    Registers the decorated function as the builder of the given figure keys. Builders are called
+    with the data dict, the build time and the key of the figure to build - and the number of days
+    to show, if ranged
+    '''
+
+    def register(func):
+        for key in keys:
+            fig_builders[key] = func
+            if ranged:
+                range_figs.add(key)
+        return func
+
+    return register
+
+def recent_rows (df: pd.DataFrame, date_col: str, now: pd.Timestamp, days):
+    '''
+    Returns the rows of df dated within the given number of days before now (all of them if days is None).
+    Resources are sorted by date, so the first row is found by binary search rather than a full mask
+    '''
+
+    if days is None:
+        return df
+
+    return df.iloc[df[date_col].searchsorted(now - pd.Timedelta(days=days), side='right'):]
+
+class FigCache:
+    '''
+    Thread-safe LRU cache of built figures, keyed by the stamp (data version and day) and figure key
+    '''
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.figs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, stamp: str, key: str):
+        with self.lock:
+            fig = self.figs.get((stamp, key))
+            if fig is not None:
+                self.figs.move_to_end((stamp, key))
+            return fig
+
+    def put(self, stamp: str, key: str, fig):
+        with self.lock:
+            self.figs[(stamp, key)] = fig
+            self.figs.move_to_end((stamp, key))
+
+            while len(self.figs) > self.maxsize:
+                self.figs.popitem(last=False)
+
+fig_cache = FigCache(fig_cache_size)
+
+class LazyFigDict(Mapping):
+    '''
+    Read-only dict of figures which are each built the first time they are accessed - or read from disk,
+    if they were stored for the same stamp - and kept in the shared LRU figure cache
+    '''
+
+    def __init__(self, data_dict: dict, now: pd.Timestamp, stamp: str, path: str = None):
+        self.data_dict = data_dict
+        self.now = now
+        self.stamp = stamp
+        self.path = path
+
+    def __getitem__(self, key):
+        return self.get_range(key, default_days)
+
+    def get_range(self, key: str, days):
+        '''
+        Returns the figure for key showing the given number of days (for time-series figures), with
+        each range cached and stored separately
+        '''
+
+        if key not in fig_builders:
+            raise KeyError(key)
+
+        name = key if key not in range_figs or days == default_days else f"{key}-{days or 'all'}"
+
+        fig = fig_cache.get(self.stamp, name)
+
+        if fig is None:
+            with span("figure", figure=name):
+                fig = self.load(key, name, days)
+            fig_cache.put(self.stamp, name, fig)
+
+        return fig
+
+    def get_zoom(self, key: str, days, x_range):
+        '''
+        Returns the time-series figure for key showing the given number of days, zoomed into x_range
+        at full resolution (or downsampled again, if the zoomed range still has too many points)
+        '''
+
+        name = f"{key}-{days or 'all'}-full"
+
+        # Full resolution figures are only kept in memory
+        fig = fig_cache.get(self.stamp, name)
+
+        with span("zoom", figure=key):
+            if fig is None:
+                fig = fig_builders[key](self.data_dict, self.now, key, days)
+                fig_cache.put(self.stamp, name, fig)
+
+            return downsample_fig(fig, downsample_points, x_range)
+
+    def get_history(self, phu_id, tab: str, days):
+        '''
+        Returns the history of a PHU for the metric of the given map tab, showing the given number of days
+        '''
+
+        with span("phu_history", tab=tab):
+            return create_phu_history(self.data_dict, self.now, phu_id, tab, days)
+
+    def build(self, key: str, days):
+        if key in range_figs:
+            fig = fig_builders[key](self.data_dict, self.now, key, days)
+            return downsample_fig(fig, downsample_points) if downsample_points else fig
+
+        return fig_builders[key](self.data_dict, self.now, key)
+
+    def load(self, key: str, name: str, days):
+        '''
+        Reads the stored figure (under name) for key, or builds and stores it if there isn't one
+        '''
+
+        if self.path is None:
+            return self.build(key, days)
+
+        fig_path = os.path.join(self.path, f"{name}.json")
+
+        if os.path.exists(fig_path):
+            with open(fig_path, 'r') as f:
+                return json.load(f)
+
+        fig = self.build(key, days)
+
+        # The folder is made again (with this snapshot's build time) in case it was pruned while this snapshot
+        # was still being served. Replace the file in one step so other processes never read a partial figure
+        if not os.path.exists(os.path.join(self.path, "meta.json")):
+            create_fig_cache(self.path, self.now)
+        with open(f"{fig_path}.tmp{os.getpid()}", 'w') as f:
+            f.write(fig.to_json())
+        os.replace(f"{fig_path}.tmp{os.getpid()}", fig_path)
+
+        return fig
+
+    def __iter__(self):
+        return iter(fig_builders)
+
+    def __len__(self):
+        return len(fig_builders)
+
 def create_fig_dict (data_dict: dict):
     '''
-    Creates dict of Plotly figures for use in Dash application
+    Returns the dict of Plotly figures for use in Dash application. Figures are only built when first
+    accessed, and are read from disk if they were already built today for the same data version
     '''
 
-    fig_dict = {}
     now = pd.Timestamp.now()
+    version = data_dict.get('data_version')
+    stamp = f"{now.date().isoformat()}-{version}-{fig_version}"
+
+    if not cache_figs or version is None:
+        return now, LazyFigDict(data_dict, now, stamp)
+
+    path = f"./data/figs/{stamp}"
+
+    if os.path.exists(os.path.join(path, "meta.json")):
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            now = pd.Timestamp(json.load(f)['now'])
+    else:
+        now = create_fig_cache(path, now)
+
+    return now, LazyFigDict(data_dict, now, stamp, path)
 
-    # Cases Area Charts
+def create_fig_cache (path: str, now: pd.Timestamp):
+    '''
+    Creates the folder figures for a new stamp are stored in, removing those of older stamps, and returns
+    the build time its figures are built with - now, unless another process created it first
+    '''
+
+    # The build time is stored first, so every process builds the stamp's figures with the same one
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+        json.dump({'now': now.isoformat()}, f)
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another process created it first - possibly without a build time, if it was made by an older version,
+        # in which case the first process to link one in sets it
+        try:
+            os.link(os.path.join(tmp_path, "meta.json"), os.path.join(path, "meta.json"))
+        except OSError:
+            pass
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    with open(os.path.join(path, "meta.json"), 'r') as f:
+        now = pd.Timestamp(json.load(f)['now'])
+
+    # The previous stamp is kept, since other workers (and the snapshot being swapped out) may still use it.
+    # Other processes may be removing the same folders at once
+    parent = os.path.dirname(path)
+    older = []
+    for old in os.listdir(parent):
+        if os.path.join(parent, old) != path and '.tmp' not in old:
+            try:
+                older.append((os.path.getmtime(os.path.join(parent, old)), os.path.join(parent, old)))
+            except OSError:
+                pass
+
+    for _, old in sorted(older)[:-1]:
+        shutil.rmtree(old, ignore_errors=True)
+
+    return now
+
+@fig_builder('fig_cases_death_area', ranged=True)
+def create_cases_death_area (data_dict: dict, now: pd.Timestamp, key: str, days=default_days):
+    # Cases Area Charts - with an extra day, which is dropped since it has no change from the day before
     cases_tl = data_dict['cases_tl']
-    cases_tl_view = cases_tl[cases_tl['Reported Date'] > now - pd.Timedelta(days=181)]
+    cases_tl_view = recent_rows(cases_tl, 'Reported Date', now, days + 1 if days is not None else None)
 
     case_area_view = pd.DataFrame(data={"Date": cases_tl_view[1:]['Reported Date']}, columns=['Date'])
     case_area_view['Type'] = "Total Cases"
@@ -40,14 +290,15 @@ def create_fig_dict (data_dict: dict):
     fig_cases_death_area.update_xaxes(title_text="Date")
 
     fig_cases_death_area.update_yaxes(title_text="Active Cases", secondary_y=False, rangemode="tozero")
-    fig_cases_death_area.update_yaxes(title_text="New Deaths", secondary_y=True, rangemode="tozero", range=[0, max(death_area_view['Value'])*1.1])
+    fig_cases_death_area.update_yaxes(title_text="New Deaths", secondary_y=True, rangemode="tozero", range=[0, death_area_view['Value'].max()*1.1])
 
-    fig_dict['fig_cases_death_area'] = fig_cases_death_area
+    return fig_cases_death_area
 
+@fig_builder('fig_vax_ratio_time', ranged=True)
+def create_vax_ratio_time (data_dict: dict, now: pd.Timestamp, key: str, days=default_days):
     # Cases Ratio Charts
     cases_vaxed = data_dict['cases_vaxed']
-    cases_vaxed['ratio'] = cases_vaxed['cases_full_vac_rate_per100K'] / cases_vaxed['cases_unvac_rate_per100K']
-    cases_vaxed_view = cases_vaxed[cases_vaxed['Date'] > now - pd.Timedelta(days=180)]
+    cases_vaxed_view = recent_rows(cases_vaxed, 'Date', now, days)
 
     cases_vaxed_unvac = pd.DataFrame(data={"Date": cases_vaxed_view['Date']}, columns=['Date'])
     cases_vaxed_unvac["Rate Type"] = "Unvaccinated"
@@ -67,63 +318,54 @@ def create_fig_dict (data_dict: dict):
                                 'Partially Vaccinated': px.colors.qualitative.Plotly[3],
                                 'Fully Vaccinated': px.colors.qualitative.Plotly[0]})
 
-    fig_dict['fig_vax_ratio_time'] = fig_vax_ratio_time
+    return fig_vax_ratio_time
 
+@fig_builder('fig_hosp_vax_tot', 'fig_hosp_vax_icu', 'fig_hosp_vax_nonicu', 'fig_hosp_general_pop')
+def create_hosp_pie (data_dict: dict, now: pd.Timestamp, key: str):
     # Hospitalization Pie Charts
     hosp_vax_view = data_dict['hosp_vax'][data_dict['hosp_vax']['date'] == max(data_dict['hosp_vax']['date'])]
-    hosp_vax_stat_view = data_dict['vax_stat'][data_dict['vax_stat']['report_date'] == max(data_dict['vax_stat']['report_date'])]
 
-    hosp_vax_stat_tot_view = hosp_vax_stat_view[['UnVaxed12o','part Vaxed','Tot Vaxed']].T
-    hosp_vax_stat_tot_view = hosp_vax_stat_tot_view.rename(columns={hosp_vax_stat_tot_view.columns[0]: "Count"})
-    hosp_vax_stat_tot_view["Vaccination Status"] = ["Unvaccinated", "Partially Vaccinated", "Fully Vaccinated"]
+    color_discrete_map = {'Unvaccinated': px.colors.qualitative.Plotly[1],
+                          'Partially Vaccinated': px.colors.qualitative.Plotly[3],
+                          'Fully Vaccinated': px.colors.qualitative.Plotly[0],
+                          'Boosted' :px.colors.qualitative.Plotly[2]}
 
-    hosp_vax_tot_view = hosp_vax_view[['tot_unvac','tot_partial_vac','tot_full_vac']].T
-    hosp_vax_tot_view = hosp_vax_tot_view.rename(columns={ hosp_vax_tot_view.columns[0]: "Hospitalizations" })
-    hosp_vax_tot_view["Vaccination Status"] = ["Unvaccinated", "Partially Vaccinated", "Fully Vaccinated"]
+    if key == 'fig_hosp_general_pop':
+        hosp_vax_stat_view = data_dict['vax_stat'][data_dict['vax_stat']['report_date'] == max(data_dict['vax_stat']['report_date'])]
 
-    hosp_vax_icu_view = hosp_vax_view[['icu_unvac','icu_partial_vac','icu_full_vac']].T
-    hosp_vax_icu_view = hosp_vax_icu_view.rename(columns={ hosp_vax_icu_view.columns[0]: "Hospitalizations" })
-    hosp_vax_icu_view["Vaccination Status"] = ["Unvaccinated", "Partially Vaccinated", "Fully Vaccinated"]
+        hosp_vax_stat_tot_view = hosp_vax_stat_view[['UnVaxed12o','part Vaxed','Tot Vaxed']].T
+        hosp_vax_stat_tot_view = hosp_vax_stat_tot_view.rename(columns={hosp_vax_stat_tot_view.columns[0]: "Count"})
+        hosp_vax_stat_tot_view["Vaccination Status"] = ["Unvaccinated", "Partially Vaccinated", "Fully Vaccinated"]
 
-    hosp_vax_nonicu_view = hosp_vax_view[['hospitalnonicu_unvac', 'hospitalnonicu_partial_vac', 'hospitalnonicu_full_vac']].T
-    hosp_vax_nonicu_view = hosp_vax_nonicu_view.rename(columns={ hosp_vax_nonicu_view.columns[0]: "Hospitalizations" })
-    hosp_vax_nonicu_view["Vaccination Status"] = ["Unvaccinated", "Partially Vaccinated", "Fully Vaccinated"]
+        fig_hosp_general_pop = px.pie(hosp_vax_stat_tot_view, values="Count", names="Vaccination Status", \
+            color="Vaccination Status", title='Overall Ontario Vaccination Status (Ages 12+)', height=270, \
+                 color_discrete_map=color_discrete_map)
 
-    fig_hosp_vax_tot = px.pie(hosp_vax_tot_view, values="Hospitalizations", names="Vaccination Status", \
-        color="Vaccination Status", title='Vaccination Status of all Hospitalizations', \
-             color_discrete_map={'Unvaccinated': px.colors.qualitative.Plotly[1],
-                                 'Partially Vaccinated': px.colors.qualitative.Plotly[3],
-                                 'Fully Vaccinated': px.colors.qualitative.Plotly[0],
-                                 'Boosted' :px.colors.qualitative.Plotly[2]})
-    fig_hosp_vax_icu = px.pie(hosp_vax_icu_view, values="Hospitalizations", names="Vaccination Status", \
-        color="Vaccination Status", title='Vaccination Status of ICU Hospitalizations', \
-             color_discrete_map={'Unvaccinated': px.colors.qualitative.Plotly[1],
-                                 'Partially Vaccinated': px.colors.qualitative.Plotly[3],
-                                 'Fully Vaccinated': px.colors.qualitative.Plotly[0],
-                                 'Boosted' :px.colors.qualitative.Plotly[2]})
-    fig_hosp_vax_nonicu = px.pie(hosp_vax_nonicu_view, values="Hospitalizations", names="Vaccination Status", \
-        color="Vaccination Status", title='Vaccination Status of Non-ICU Hospitalizations', \
-             color_discrete_map={'Unvaccinated': px.colors.qualitative.Plotly[1],
-                                 'Partially Vaccinated': px.colors.qualitative.Plotly[3],
-                                 'Fully Vaccinated': px.colors.qualitative.Plotly[0],
-                                 'Boosted' :px.colors.qualitative.Plotly[2]})
-    fig_hosp_general_pop = px.pie(hosp_vax_stat_tot_view, values="Count", names="Vaccination Status", \
-        color="Vaccination Status", title='Overall Ontario Vaccination Status (Ages 12+)', height=270, \
-             color_discrete_map={'Unvaccinated': px.colors.qualitative.Plotly[1],
-                                 'Partially Vaccinated': px.colors.qualitative.Plotly[3],
-                                 'Fully Vaccinated': px.colors.qualitative.Plotly[0],
-                                 'Boosted' :px.colors.qualitative.Plotly[2]})
+        fig_hosp_general_pop.update_layout(margin=dict(b=0))
+
+        return fig_hosp_general_pop
+
+    # Columns and title of each of the hospitalization pies
+    pie_dict = {
+        'fig_hosp_vax_tot': (['tot_unvac','tot_partial_vac','tot_full_vac'], 'Vaccination Status of all Hospitalizations'),
+        'fig_hosp_vax_icu': (['icu_unvac','icu_partial_vac','icu_full_vac'], 'Vaccination Status of ICU Hospitalizations'),
+        'fig_hosp_vax_nonicu': (['hospitalnonicu_unvac', 'hospitalnonicu_partial_vac', 'hospitalnonicu_full_vac'], 'Vaccination Status of Non-ICU Hospitalizations')}
 
-    fig_hosp_general_pop.update_layout(margin=dict(b=0))
+    cols, title = pie_dict[key]
 
-    fig_dict['fig_hosp_vax_tot'] = fig_hosp_vax_tot
-    fig_dict['fig_hosp_vax_icu'] = fig_hosp_vax_icu
-    fig_dict['fig_hosp_vax_nonicu'] = fig_hosp_vax_nonicu
-    fig_dict['fig_hosp_general_pop'] = fig_hosp_general_pop
+    hosp_vax_pie_view = hosp_vax_view[cols].T
+    hosp_vax_pie_view = hosp_vax_pie_view.rename(columns={ hosp_vax_pie_view.columns[0]: "Hospitalizations" })
+    hosp_vax_pie_view["Vaccination Status"] = ["Unvaccinated", "Partially Vaccinated", "Fully Vaccinated"]
 
+    return px.pie(hosp_vax_pie_view, values="Hospitalizations", names="Vaccination Status", \
+        color="Vaccination Status", title=title, \
+             color_discrete_map=color_discrete_map)
+
+@fig_builder('fig_vax', ranged=True)
+def create_vax_area (data_dict: dict, now: pd.Timestamp, key: str, days=default_days):
     # Vaccination Area Charts
     vax_stat = data_dict['vax_stat']
-    vax_stat_view = vax_stat[vax_stat['Date'] > now - pd.Timedelta(days=180)]
+    vax_stat_view = recent_rows(vax_stat, 'Date', now, days)
 
     part_area_view = pd.DataFrame(data={"Date": vax_stat_view['Date']}, columns=['Date'])
     part_area_view['Vaccination Status'] = "Partially Vaccinated"
@@ -136,7 +378,7 @@ def create_fig_dict (data_dict: dict):
     boosted_area_view = pd.DataFrame(data={"Date": vax_stat_view['Date']}, columns=['Date'])
     boosted_area_view['Vaccination Status'] = "Boosted"
     boosted_area_view['Percentage'] = vax_stat['total_individuals_3doses'] / 14826276
-    
+
 
     fig_vax = px.area(pd.concat((boosted_area_view, fully_area_view, part_area_view)), x="Date", y="Percentage", color='Vaccination Status', \
             color_discrete_map={'Unvaccinated': px.colors.qualitative.Plotly[1],
@@ -144,32 +386,40 @@ def create_fig_dict (data_dict: dict):
                                  'Fully Vaccinated': px.colors.qualitative.Plotly[0],
                                  'Boosted' :px.colors.qualitative.Plotly[2]})
 
+    return fig_vax
+
+@fig_builder(*['vax'+str(gp) for gp in range(9)])
+def create_vax_pie (data_dict: dict, now: pd.Timestamp, key: str):
     # Vaccination Pie Charts
     vax_age = data_dict['vax_age']
-    vax_age_view = vax_age[vax_age['Date'] > now - pd.Timedelta(days=1)]
+    # The latest report, which may be from before today (refreshes can run before the day's is published)
+    vax_age_view = vax_age[vax_age['Date'] == vax_age['Date'].max()]
     groups =['05-11yrs', '12-17yrs', '18-29yrs', '30-39yrs','40-49yrs','50-59yrs','60-69yrs','70-79yrs', '80+']
     groupnm =['5-11 Year Olds', '12-17 Year Olds', '18-29 Year Olds', '30-39 Year Olds', \
         '40-49 Year Olds','50-59 Year Olds','60-69 Year Olds','70-79 Year Olds', '80+ Year Olds']
 
-    for gp in range(len(groups)):
-        view_age_view_gp = vax_age_view[vax_age_view['Agegroup'] == groups[gp]]
-        df = pd.DataFrame(data={'Vaccination Status': ['Unvaccinated', 'Partially Vaccinated', 'Fully Vaccinated', 'Boosted'],\
-                             'Count': [view_age_view_gp['Total population'].to_numpy()[0] - view_age_view_gp['At least one dose_cumulative'].to_numpy()[0],
-                                        view_age_view_gp['At least one dose_cumulative'].to_numpy()[0] - view_age_view_gp['fully_vaccinated_cumulative'].to_numpy()[0],
-                                        view_age_view_gp['fully_vaccinated_cumulative'].to_numpy()[0] - view_age_view_gp['third_dose_cumulative'].to_numpy()[0],
-                                        view_age_view_gp['third_dose_cumulative'].to_numpy()[0]]})
+    gp = int(key[len('vax'):])
 
-        pie_fig = px.pie(df, values='Count', names='Vaccination Status', color="Vaccination Status", title='Vaccination Status for '+ groupnm[gp], \
-            color_discrete_map={'Unvaccinated': px.colors.qualitative.Plotly[1],
-                                 'Partially Vaccinated': px.colors.qualitative.Plotly[3],
-                                 'Fully Vaccinated': px.colors.qualitative.Plotly[0],
-                                 'Boosted' :px.colors.qualitative.Plotly[2]})
-        pie_fig.update_traces(sort=False) 
-        fig_dict['vax'+str(gp)] = pie_fig
-    fig_dict['fig_vax'] = fig_vax
+    view_age_view_gp = vax_age_view[vax_age_view['Agegroup'] == groups[gp]]
+    df = pd.DataFrame(data={'Vaccination Status': ['Unvaccinated', 'Partially Vaccinated', 'Fully Vaccinated', 'Boosted'],\
+                         'Count': [view_age_view_gp['Total population'].to_numpy()[0] - view_age_view_gp['At least one dose_cumulative'].to_numpy()[0],
+                                    view_age_view_gp['At least one dose_cumulative'].to_numpy()[0] - view_age_view_gp['fully_vaccinated_cumulative'].to_numpy()[0],
+                                    view_age_view_gp['fully_vaccinated_cumulative'].to_numpy()[0] - view_age_view_gp['third_dose_cumulative'].to_numpy()[0],
+                                    view_age_view_gp['third_dose_cumulative'].to_numpy()[0]]})
+
+    pie_fig = px.pie(df, values='Count', names='Vaccination Status', color="Vaccination Status", title='Vaccination Status for '+ groupnm[gp], \
+        color_discrete_map={'Unvaccinated': px.colors.qualitative.Plotly[1],
+                             'Partially Vaccinated': px.colors.qualitative.Plotly[3],
+                             'Fully Vaccinated': px.colors.qualitative.Plotly[0],
+                             'Boosted' :px.colors.qualitative.Plotly[2]})
+    pie_fig.update_traces(sort=False)
+
+    return pie_fig
 
+@fig_builder('fig_hosp_area', ranged=True)
+def create_hosp_area (data_dict: dict, now: pd.Timestamp, key: str, days=default_days):
     # Hospitalization Area Charts
-    hosp_area_view = data_dict['hosp_vax'][data_dict['hosp_vax']['date'] > now - pd.Timedelta(days=180)]
+    hosp_area_view = recent_rows(data_dict['hosp_vax'], 'date', now, days)
 
     hosp_area_view_icu = pd.DataFrame(data={"Date": hosp_area_view['date']}, columns=['Date'])
     hosp_area_view_icu['Type'] = "ICU"
@@ -183,22 +433,13 @@ def create_fig_dict (data_dict: dict):
                             y='Hospitalizations', color="Type",
                             line_group="Type")
 
+    return fig_hosp_area
 
-    fig_dict['fig_hosp_area'] = fig_hosp_area
-
-    # Tests Line and Area Charts
-    tests_area_view = data_dict['cases_tl'][data_dict['cases_tl']['Reported Date'] > now - pd.Timedelta(days=180)]
-
-    tests_area_view_overall = pd.DataFrame(data={"Date": tests_area_view['Reported Date']}, columns=['Date'])
-    tests_area_view_overall['Type'] = "Tests"
-    tests_area_view_overall['Count'] = data_dict['cases_tl']['Tests']
-
-    tests_area_view_pos = pd.DataFrame(data={"Date": tests_area_view['Reported Date']}, columns=['Date'])
-    tests_area_view_pos['Type'] = "Positive Tests"
-    tests_area_view_pos['Count'] = data_dict['cases_tl']['Positive Tests']
-
+@fig_builder('fig_tests_age', ranged=True)
+def create_tests_age (data_dict: dict, now: pd.Timestamp, key: str, days=default_days):
+    # Tests Line Charts
     tests_age = data_dict['tests_age']
-    tests_age_view = tests_age[tests_age['DATE'] > now - pd.Timedelta(days=180)]
+    tests_age_view = recent_rows(tests_age, 'DATE', now, days)
 
     fig_tests_age = px.line(tests_age_view, x="DATE", y="percent_positive_7d_avg", color='age_category', \
                 labels={
@@ -207,144 +448,337 @@ def create_fig_dict (data_dict: dict):
                      "percent_positive_7d_avg": "% Positive (7 Day Average)"
                  },)
 
-    fig_dict['fig_tests_age'] = fig_tests_age
+    return fig_tests_age
+
+@fig_builder('tests_hosp_area', ranged=True)
+def create_tests_area (data_dict: dict, now: pd.Timestamp, key: str, days=default_days):
+    # Tests Area Charts
+    tests_area_view = recent_rows(data_dict['cases_tl'], 'Reported Date', now, days)
+
+    tests_area_view_overall = pd.DataFrame(data={"Date": tests_area_view['Reported Date']}, columns=['Date'])
+    tests_area_view_overall['Type'] = "Tests"
+    tests_area_view_overall['Count'] = data_dict['cases_tl']['Tests']
 
+    tests_area_view_pos = pd.DataFrame(data={"Date": tests_area_view['Reported Date']}, columns=['Date'])
+    tests_area_view_pos['Type'] = "Positive Tests"
+    tests_area_view_pos['Count'] = data_dict['cases_tl']['Positive Tests']
 
     tests_hosp_area = px.area(pd.concat([tests_area_view_pos,tests_area_view_overall], ignore_index=True), x="Date",
                             y='Count', color="Type",
                             line_group="Type")
 
-    fig_dict['tests_hosp_area'] = tests_hosp_area
+    return tests_hosp_area
+
+# Column, title and color scale of each map, keyed by its tab. Each page gets one full map carrying the
+# PHU boundaries, shown with its first tab's metric. The figure for every tab is kept without the
+# boundaries, so the browser can switch tabs by reusing the ones it already has
+map_dict = {
+    'map_cases_count': ("Active Cases", 'Active Cases by PHU', "ylorrd"),
+    'map_cases_rate': ("Active Case Rate (Per 100k)", 'Active Case Rate (Per 100k) by PHU', "ylorrd"),
+    'map_ont_test_count': ("Testing Volume", 'Testing Volume by PHU', "bugn"),
+    'map_ont_test_rate': ("Testing Rate (Per 1000)", 'Testing Rate (Per 1000) by PHU', "bugn"),
+    'map_ont_test_tpr': ("Test Positive Rate", 'Test Positive Rate by PHU', "ylorrd")}
+
+full_map_dict = {
+    'map_cases': 'map_cases_count',
+    'map_tests': 'map_ont_test_count'}
 
-    # Create maps
-    fig_dict = create_maps(data_dict, fig_dict)
+@fig_builder(*map_dict, *full_map_dict)
+def create_map (data_dict: dict, now: pd.Timestamp, key: str):
+    phu_map = create_map_view(data_dict)
 
-    return now, fig_dict
+    if key in full_map_dict:
+        return create_choropleth(phu_map, *map_dict[full_map_dict[key]])
+
+    return strip_geojson(create_choropleth(phu_map, *map_dict[key]))
 
 def create_maps (data_dict: dict, fig_dict: dict):
     '''
     Creates dict of Plotly choropleth map plots for use in Dash application
     '''
 
+    phu_map = create_map_view(data_dict)
+
+    # Cases Count + Rates, Tests count + rates + positive test rate
+    for key, map_args in map_dict.items():
+        fig_dict[key] = strip_geojson(create_choropleth(phu_map, *map_args))
+
+    for key, tab in full_map_dict.items():
+        fig_dict[key] = create_choropleth(phu_map, *map_dict[tab])
+
+    return fig_dict
+
+def create_map_view (data_dict: dict):
+    '''
+    Returns a copy of the PHU boundaries joined with the latest cases and testing data of each PHU
+    '''
+
     # We create one dataframe connecting all the data to PHUs, before creating all the plots
-    phu_cases = data_dict['cases_phu']
+    phu_cases = data_dict['derived']['phu']
     phu_tests = data_dict['tests_phu']
 
     tests_view = phu_tests[phu_tests['DATE'] == max(phu_tests['DATE'])]
-    cases_view = phu_cases[phu_cases['FILE_DATE'] == max(phu_cases['FILE_DATE'])]
+    # Active cases and their rates on the latest day come from the derived PHU table, indexed by (PHU_ID, date)
+    cases_view = phu_cases.xs(phu_cases.index.get_level_values('date').max(), level='date')
 
-    phu_map = data_dict['phu_map']
+    phu_map = data_dict['phu_map'].copy()
 
-    merged_cases_view = pd.merge(data_dict['phu_match'], cases_view, how="left", left_on="PHU_ID", right_on="PHU_NUM") 
-    merged_tests_view = pd.merge(data_dict['phu_match'], tests_view, how="left", left_on="PHU_ID", right_on="PHU_num") 
+    merged_cases_view = cases_view.reindex(data_dict['phu_match']['PHU_ID']).set_index(data_dict['phu_match'].index)
+    merged_tests_view = pd.merge(data_dict['phu_match'], tests_view, how="left", left_on="PHU_ID", right_on="PHU_num")
 
-    phu_map['Active Cases'] = merged_cases_view['ACTIVE_CASES'] 
-    phu_map['Active Case Rate (Per 100k)'] = merged_cases_view['ACTIVE_CASES'] / merged_cases_view['POP'] * 100000
+    phu_map['Active Cases'] = merged_cases_view['active_cases']
+    phu_map['Active Case Rate (Per 100k)'] = merged_cases_view['active_case_rate']
 
-    phu_map['PHU'] = merged_cases_view['NAME_ENG']
+    phu_map['PHU'] = data_dict['phu_match']['NAME_ENG']
     phu_map['Test Positive Rate'] = merged_tests_view['percent_positive_7d_avg']
     phu_map['Testing Volume'] = merged_tests_view['test_volumes_7d_avg']
     phu_map['Testing Rate (Per 1000)'] = merged_tests_view['tests_per_1000_7d_avg']
     phu_map['id'] = phu_map.index
 
-    phu_map = phu_map.to_crs(epsg=4326)
+    # The stored boundaries are already in EPSG:4326, so this only reprojects other sources
+    if phu_map.crs is not None and phu_map.crs.to_epsg() != 4326:
+        phu_map = phu_map.to_crs(epsg=4326)
+
+    return phu_map
+
+def create_choropleth (phu_map, color: str, title: str, color_continuous_scale: str):
+    '''
+    Creates a Plotly choropleth map of the given column of phu_map
+    '''
 
-    # Cases Count + Rates
-    map_cases_count = px.choropleth(phu_map, geojson=phu_map.geometry, 
-                        locations="id", color="Active Cases", 
-                        hover_data={'PHU':True, 'Active Cases':True, 'id':False},
+    fig = px.choropleth(phu_map, geojson=phu_map.geometry,
+                        locations="id", color=color,
+                        hover_data={'PHU':True, color:True, 'id':False},
                         fitbounds="locations",
                         height=750,
-                        color_continuous_scale="ylorrd")
+                        color_continuous_scale=color_continuous_scale)
 
-    map_cases_count.update_geos(resolution=110)
+    fig.update_geos(resolution=110)
 
-    map_cases_count.update_layout(
+    fig.update_layout(
         title=dict(x=0.5),
-        title_text='Active Cases by PHU',
+        title_text=title,
         margin={"r":0,"t":30,"l":0,"b":10},
         coloraxis={"colorbar":{"title":{"text":""}},
                    "showscale": False},
         dragmode=False)
 
-    map_cases_rate = px.choropleth(phu_map, geojson=phu_map.geometry, 
-                        locations="id", color="Active Case Rate (Per 100k)", 
-                        hover_data={'PHU':True, 'Active Case Rate (Per 100k)':True, 'id':False},
-                        fitbounds="locations",
-                        height=750,
-                        color_continuous_scale="ylorrd")
+    return fig
 
-    map_cases_rate.update_geos(resolution=110)
+def strip_geojson (fig: go.Figure):
+    '''
+    Returns a copy of a choropleth map without its GeoJSON, leaving only the per-PHU values and styling
+    '''
 
-    map_cases_rate.update_layout(
-        title=dict(x=0.5),
-        title_text='Active Case Rate (Per 100k) by PHU',
-        margin={"r":0,"t":30,"l":0,"b":10},
-        coloraxis={"colorbar":{"title":{"text":""}},
-                   "showscale": False},
-        dragmode=False)
+    fig = go.Figure(fig)
+    fig.update_traces(geojson=None)
 
+    return fig
 
-    # Tests count + rates + positive test rate
-    map_ont_test_count = px.choropleth(phu_map, geojson=phu_map.geometry, 
-                        locations="id", color="Testing Volume", 
-                        hover_data={'PHU':True, 'Testing Volume':True, 'id':False},
-                        fitbounds="locations",
-                        height=750,
-                        color_continuous_scale="bugn")
+# Column of the PHU history table (see 'phu_history' in 'data_handler.py') drilled into from each map tab
+history_dict = {
+    'map_cases_count': 'active_cases',
+    'map_cases_rate': 'active_case_rate',
+    'map_ont_test_count': 'test_volumes_7d_avg',
+    'map_ont_test_rate': 'tests_per_1000_7d_avg',
+    'map_ont_test_tpr': 'percent_positive_7d_avg'}
 
-    map_ont_test_count.update_geos(resolution=110)
+def clicked_phu (data_dict: dict, click):
+    '''
+    Returns the ID of the PHU clicked on a map from its clickData, or None if no PHU was clicked
+    '''
 
-    map_ont_test_count.update_layout(
-        title=dict(x=0.5),
-        title_text='Testing Volume by PHU',
-        margin={"r":0,"t":30,"l":0,"b":10},
-        coloraxis={"colorbar":{"title":{"text":""}},
-                   "showscale": False},
-        dragmode=False)
+    if not click or not click.get('points') or click['points'][0].get('location') is None:
+        return None
 
+    # Map locations are the positions of the PHUs in the ID table, which the boundaries are joined to
+    return int(data_dict['phu_match']['PHU_ID'].iloc[int(click['points'][0]['location'])])
 
-    map_ont_test_rate = px.choropleth(phu_map, geojson=phu_map.geometry, 
-                        locations="id", color="Testing Rate (Per 1000)", 
-                        hover_data={'PHU':True, 'Testing Rate (Per 1000)':True, 'id':False},
-                        fitbounds="locations",
-                        height=750,
-                        color_continuous_scale="bugn")
+def create_phu_history (data_dict: dict, now: pd.Timestamp, phu_id, tab: str, days=default_days):
+    '''
+    Creates a line chart of the history of a PHU for the metric of the given map tab over the given number
+    of days, or a prompt to pick a PHU if there isn't one. The history is sliced out of the (PHU, date) index
+    '''
 
-    map_ont_test_rate.update_geos(resolution=110)
+    history = data_dict['phu_history']
+    label = map_dict[tab][0]
 
-    map_ont_test_rate.update_layout(
-        title=dict(x=0.5),
-        title_text='Testing Rate (Per 1000) by PHU',
-        margin={"r":0,"t":30,"l":0,"b":10},
-        coloraxis={"colorbar":{"title":{"text":""}},
-                   "showscale": False},
-        dragmode=False)
+    try:
+        phu_view = None if phu_id is None else history.loc[phu_id]
+    except KeyError:
+        phu_view = None
 
+    if phu_view is None:
+        fig = go.Figure()
+        fig.update_layout(annotations=[{"text": "Click on a PHU in the map to see its history", "showarrow": False,
+                                        "font": {"size": 16}}],
+                          xaxis={"visible": False}, yaxis={"visible": False}, height=300)
+        return fig
 
+    if days is not None:
+        phu_view = phu_view.iloc[phu_view.index.searchsorted(now - pd.Timedelta(days=days), side='right'):]
 
-    map_ont_test_tpr = px.choropleth(phu_map, geojson=phu_map.geometry, 
-                        locations="id", color="Test Positive Rate", 
-                        hover_data={'PHU':True, 'Test Positive Rate':True, 'id':False},
-                        fitbounds="locations",
-                        height=750,
-                        color_continuous_scale="ylorrd")
+    name = data_dict['phu_match'].set_index('PHU_ID').at[phu_id, 'NAME_ENG']
+    x = phu_view.index
+    y = phu_view[history_dict[tab]].to_numpy(dtype=float)
 
-    map_ont_test_tpr.update_geos(resolution=110)
+    # The single line is downsampled before the figure is built, so it is only built once (the static
+    # export builds one for every PHU, tab and range)
+    if downsample_points and len(x) > downsample_points:
+        chosen = downsample_methods[downsample_method](as_numbers(x), y, downsample_points)
+        x, y = x[chosen], y[chosen]
 
-    map_ont_test_tpr.update_layout(
-        title=dict(x=0.5),
-        title_text='Test Positive Rate by PHU',
-        margin={"r":0,"t":30,"l":0,"b":10},
-        coloraxis={"colorbar":{"title":{"text":""}},
-                   "showscale": False},
-        dragmode=False)
+    return go.Figure(go.Scatter(x=x, y=y, mode="lines", hovertemplate=f"Date=%{{x}}<br>{label}=%{{y}}<extra></extra>"),
+                     layout={"title": {"text": f"{label} in {name}", "x": 0.5},
+                             "xaxis": {"title": {"text": "Date"}}, "yaxis": {"title": {"text": label}}})
+
+def lttb (x: np.ndarray, y: np.ndarray, n: int):
+    '''
+    Returns the indices of n points of a line chosen by Largest-Triangle-Three-Buckets - the first and last
+    points, and from each bucket between them the point forming the largest triangle with the point chosen
+    from the bucket before and the average of the bucket after - which keeps the line's visual shape
+    '''
 
-    fig_dict['map_cases_count'] = map_cases_count
-    fig_dict['map_cases_rate'] = map_cases_rate
-    fig_dict['map_ont_test_tpr'] = map_ont_test_tpr
-    fig_dict['map_ont_test_count'] = map_ont_test_count
-    fig_dict['map_ont_test_rate'] = map_ont_test_rate
+    size = len(x)
 
+    if n >= size or n < 3:
+        return np.arange(size)
 
-    return fig_dict
+    # Gaps are treated as zeros when choosing points, but are still shown as gaps
+    y = np.nan_to_num(y)
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+
+    indices = np.empty(n, dtype=int)
+    indices[0], indices[-1] = 0, size - 1
+
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+
+        if i < n - 3:
+            avg_x, avg_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + np.argmax(area)
+        indices[i + 1] = a
+
+    return indices
+
+def minmax (x: np.ndarray, y: np.ndarray, n: int):
+    '''
+    Returns the indices of at most n points of a line - the first and last points, and the lowest and
+    highest points of each of the buckets between them - which keeps every peak and trough
+    '''
+
+    size = len(x)
+
+    if n >= size or n < 4:
+        return np.arange(size)
+
+    y = np.nan_to_num(y)
+    edges = np.linspace(1, size - 1, (n - 2) // 2 + 1).astype(int)
+
+    indices = [0, size - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        indices += [start + np.argmin(y[start:end]), start + np.argmax(y[start:end])]
+
+    return np.unique(indices)
+
+downsample_methods = {"lttb": lttb, "minmax": minmax}
+
+def as_numbers (values):
+    '''
+    Returns the x values of a trace (dates, as arrays or strings, or numbers) as an array of floats
+    '''
+
+    values = np.asarray(values)
+
+    if values.dtype.kind in 'iuf':
+        return values.astype(float)
+    if values.dtype.kind != 'M':
+        values = pd.to_datetime(values).to_numpy()
+
+    return values.astype('datetime64[ns]').astype('int64').astype(float)
+
+def downsample_fig (fig, n: int, x_range=None):
+    '''
+    Returns the figure with each trace reduced to at most n points (per trace) by downsample_method,
+    cropped to the x_range bounds if given. Traces sharing their x values (such as stacked areas) keep
+    the same points, so they still line up. The figure is returned as is if nothing needs to change
+    '''
+
+    original = fig
+    fig = fig.to_plotly_json() if isinstance(fig, go.Figure) else fig
+    data = [dict(trace) for trace in fig['data']]
+
+    # Traces with the same x values are downsampled together
+    groups = []
+    for i, trace in enumerate(data):
+        if trace.get('x') is None or trace.get('y') is None:
+            continue
+
+        x = as_numbers(trace['x'])
+        for group_x, members in groups:
+            if np.array_equal(group_x, x):
+                members.append(i)
+                break
+        else:
+            groups.append((x, [i]))
+
+    changed = x_range is not None
+
+    for x, members in groups:
+        rows = np.arange(len(x))
+
+        if x_range is not None:
+            # One point past each end is kept, so the lines run to the edges of the zoomed range
+            start, end = as_numbers([pd.Timestamp(bound) if isinstance(bound, str) else bound for bound in x_range])
+            inside = np.flatnonzero((x >= start) & (x <= end))
+            if len(inside) > 0:
+                rows = rows[max(inside[0] - 1, 0):inside[-1] + 2]
+
+        if n is not None and len(rows) > n:
+            method = downsample_methods[downsample_method]
+            chosen = np.unique(np.concatenate([rows[method(x[rows], np.asarray(data[i]['y'], dtype=float)[rows], n)]
+                                               for i in members]))
+        else:
+            chosen = rows
+
+        if len(chosen) == len(x):
+            continue
+
+        changed = True
+        for i in members:
+            for attr in ('x', 'y', 'customdata', 'text', 'hovertext'):
+                values = data[i].get(attr)
+                if values is not None and not isinstance(values, str) and len(values) == len(x):
+                    data[i][attr] = np.asarray(values)[chosen]
+
+    if not changed:
+        return original
+
+    layout = dict(fig.get('layout', {}))
+    if x_range is not None:
+        layout['xaxis'] = {**layout.get('xaxis', {}), 'range': list(x_range), 'autorange': False}
+
+    return go.Figure(data=data, layout=layout)
+
+def zoom_range (relayout):
+    '''
+    Returns the x axis range a figure was zoomed to from its relayoutData, "reset" if it was zoomed back
+    out, or None if its x axis wasn't changed
+    '''
+
+    if not relayout:
+        return None
+
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        return (relayout['xaxis.range[0]'], relayout['xaxis.range[1]'])
+    if 'xaxis.range' in relayout:
+        return tuple(relayout['xaxis.range'])
+    if relayout.get('xaxis.autorange'):
+        return "reset"
+
+    return None
@@ -0,0 +1,83 @@
+import os
+import geopandas as gpd
+
+try:
+    import topojson
+except ImportError:
+    topojson = None
+
+# Simplification tolerance (in degrees) of each stored resolution of the PHU boundaries
+resolution_dict = {
+    "full": 0,
+    "high": 0.0005,
+    "medium": 0.002,
+    "low": 0.01}
+
+# Resolution of the PHU boundaries used for the maps
+map_resolution = "medium"
+
+def geometry_path(resolution):
+    '''
+    Returns the path of the stored PHU boundaries at the given resolution
+    '''
+
+    return f"./shapefiles/phu_boundary_{resolution}.geojson"
+
+def build_geometry(resolutions=None):
+    '''
+    Reprojects the PHU boundary shapefile to EPSG:4326 and stores a simplified GeoJSON copy of it
+    at each of the given resolutions (all of resolution_dict by default)
+    '''
+
+    phu_map = gpd.read_file("./shapefiles/MOH_PHU_BOUNDARY.shp")
+    phu_map = phu_map.set_crs(epsg=4326) if phu_map.crs is None else phu_map.to_crs(epsg=4326)
+
+    for resolution in resolutions or resolution_dict:
+        simplified = simplify_geometry(phu_map, resolution_dict[resolution])
+
+        path = geometry_path(resolution)
+        simplified.to_file(path + ".tmp", driver="GeoJSON", COORDINATE_PRECISION=6)
+        os.replace(path + ".tmp", path)
+
+def simplify_geometry(phu_map, tolerance):
+    '''
+    Simplifies the PHU boundaries to the given tolerance without breaking their topology
+    '''
+
+    if tolerance == 0:
+        return phu_map
+
+    # Simplifying the arcs the PHUs share keeps neighbouring borders aligned, without gaps or overlaps
+    if topojson is not None:
+        topology = topojson.Topology(phu_map, toposimplify=tolerance, prevent_oversimplify=True).to_gdf()
+
+        # The topology doesn't keep the order or index of the PHUs, which the maps join the PHU table to by
+        # position - so each simplified shape is matched back to its PHU by ID
+        shapes = topology.set_index('PHU_ID').geometry.reindex(phu_map['PHU_ID'])
+        if len(topology) != len(phu_map) or shapes.isna().any():
+            raise ValueError("Simplified PHU boundaries don't match the PHUs they were simplified from")
+
+        simplified = phu_map.copy()
+        simplified.geometry = gpd.GeoSeries(shapes.to_numpy(), index=phu_map.index, crs="EPSG:4326")
+        return simplified
+
+    simplified = phu_map.copy()
+    simplified.geometry = phu_map.geometry.simplify(tolerance, preserve_topology=True)
+
+    return simplified
+
+def load_geometry(resolution=None):
+    '''
+    Returns the PHU boundaries at the given resolution (map_resolution by default) as a GeoDataFrame,
+    building the stored copy first if it doesn't exist yet
+    '''
+
+    resolution = resolution or map_resolution
+
+    if not os.path.exists(geometry_path(resolution)):
+        build_geometry([resolution])
+
+    return gpd.read_file(geometry_path(resolution))
+
+if __name__ == '__main__':
+    build_geometry()
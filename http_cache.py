@@ -0,0 +1,193 @@
+import gzip
+import json
+import hashlib
+import threading
+
+from flask import request, g
+from collections import OrderedDict
+
+def files_version(paths, *extra):
+    '''
+    Returns a hash of the contents of the given files (and any extra strings, such as package versions),
+    which is the same in every process serving them
+    '''
+
+    version = hashlib.sha1()
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            version.update(hashlib.sha1(f.read()).digest())
+
+    for value in extra:
+        version.update(str(value).encode())
+
+    return version.hexdigest()[:12]
+
+def install_http_cache(app, pages, get_version, code_version):
+    '''
+    Adds ETags to the Dash app's page, layout and dependency responses, and answers requests that
+    already have the current one with a 304 before the response is built. Page and dependency responses
+    only change with code_version (see files_version), while the layout also changes with the version
+    returned by get_version (the current snapshot's). Tags are derived from these alone, so every worker
+    gives the same ones, and a refresh that changes nothing keeps them
+    '''
+
+    server = app.server
+
+    def etag_for(path):
+        if path == "/_dash-layout":
+            tag = f"{code_version}:{get_version()}:{path}"
+        elif path == "/_dash-dependencies" or path in pages:
+            tag = f"{code_version}:{path}"
+        else:
+            return None
+
+        return hashlib.sha1(tag.encode()).hexdigest()
+
+    def set_cache_headers(response, etag):
+        # Weak, since compression changes the bytes but not the content - this also keeps
+        # flask-compress from rewriting the tag
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+
+    @server.before_request
+    def revalidate():
+        if request.method not in ("GET", "HEAD"):
+            return None
+
+        etag = etag_for(request.path)
+
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            response = server.response_class(status=304)
+            set_cache_headers(response, etag)
+            return response
+
+        return None
+
+    @server.after_request
+    def add_etag(response):
+        if request.method in ("GET", "HEAD") and response.status_code == 200:
+            etag = etag_for(request.path)
+
+            if etag is not None:
+                set_cache_headers(response, etag)
+
+        return response
+
+class CallbackCache:
+    '''
+    Thread-safe LRU cache of serialized callback responses, bounded by both the number of responses
+    and their total size, which keeps count of its hits, misses and evictions
+    '''
+
+    def __init__(self, maxsize=64, max_bytes=64 * 2**20):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.responses = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, encoding=None):
+        '''
+        Returns the cached response body for key (gzip-compressed if encoding is "gzip"), or None
+        '''
+
+        with self.lock:
+            entry = self.responses.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.responses.move_to_end(key)
+
+        if encoding != "gzip":
+            return entry['body']
+
+        # Compressed copies are made the first time they're asked for and kept alongside the original. The
+        # copy is made outside the lock, but only counted if the entry is still cached (an evicted entry's
+        # size was already taken off)
+        compressed = entry['gzip']
+        if compressed is None:
+            compressed = gzip.compress(entry['body'], compresslevel=6)
+
+            with self.lock:
+                if entry['gzip'] is None:
+                    entry['gzip'] = compressed
+                    if self.responses.get(key) is entry:
+                        self.size += len(compressed)
+
+        return compressed
+
+    def put(self, key, body):
+        with self.lock:
+            if key in self.responses:
+                return
+
+            self.responses[key] = {'body': body, 'gzip': None}
+            self.size += len(body)
+
+            while len(self.responses) > self.maxsize or (self.size > self.max_bytes and len(self.responses) > 1):
+                _, entry = self.responses.popitem(last=False)
+                self.size -= len(entry['body']) + len(entry['gzip'] or b'')
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.responses), 'bytes': self.size}
+
+def install_callback_cache(app, outputs, get_version, cache=None):
+    '''
+    Serves responses of the callbacks for the given outputs (such as "page-content.children") from a
+    CallbackCache, keyed by the callback's output, inputs, state and triggering inputs and the version returned
+    by get_version. Only callbacks whose response depends on nothing else should be memoized. Returns the cache
+    '''
+
+    server = app.server
+    cache = cache or CallbackCache()
+
+    @server.before_request
+    def serve_cached_callback():
+        if request.method != "POST" or not request.path.endswith("/_dash-update-component"):
+            return None
+
+        body = request.get_json(silent=True) or {}
+
+        if body.get('output') not in outputs:
+            return None
+
+        # Callbacks may answer differently depending on which input triggered them (a zoom or a range change)
+        key = json.dumps([body['output'], body.get('inputs'), body.get('state'), sorted(body.get('changedPropIds') or []),
+                          get_version()], sort_keys=True)
+        encoding = "gzip" if "gzip" in request.headers.get("Accept-Encoding", "") else None
+
+        cached = cache.get(key, encoding)
+
+        if cached is None:
+            g.callback_cache_key = key
+            return None
+
+        g.callback_cache_hit = True
+        response = server.response_class(cached, mimetype="application/json")
+        response.headers["Vary"] = "Accept-Encoding"
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+
+        return response
+
+    @server.after_request
+    def store_callback(response):
+        key = g.pop('callback_cache_key', None)
+
+        if key is not None and response.status_code == 200:
+            cache.put(key, response.get_data())
+
+        return response
+
+    return cache
@@ -0,0 +1,183 @@
+import os
+import time
+import bisect
+import cProfile
+import functools
+import threading
+
+from flask import request, g
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets for durations (in seconds) and response sizes (in bytes)
+time_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+size_buckets = tuple(2**n for n in range(10, 26, 2))
+
+# File a cProfile dump of each snapshot build is written to (viewable with pstats or snakeviz), or None
+profile_path = os.environ.get("PROFILE_BUILD")
+
+# Every metric, in the order they are reported on /metrics
+registry = {}
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+class Metric:
+    '''
+    A metric exposed on /metrics, holding a value for each combination of labels it has been recorded with
+    '''
+
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+        registry[name] = self
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.extend(self.render_value(labels, value))
+
+        return lines
+
+    def render_value(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {value}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        labels = tuple(sorted(labels.items()))
+
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=time_buckets):
+        super().__init__(name, description)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        labels = tuple(sorted(labels.items()))
+
+        with self.lock:
+            counts, total = self.values.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value)
+
+    def render_value(self, labels, value):
+        counts, total = value
+        lines = []
+
+        cumulative = 0
+        for bound, count in zip([*self.buckets, "+Inf"], counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+
+        lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+
+        return lines
+
+stage_seconds = Histogram("dashboard_stage_seconds", "Time taken by each stage of building the dashboard")
+stage_last_seconds = Gauge("dashboard_stage_last_seconds", "Time taken by the last run of each stage of building the dashboard")
+callback_seconds = Histogram("dashboard_callback_seconds", "Time taken to answer each server-side callback")
+callback_bytes = Histogram("dashboard_callback_response_bytes", "Size of the responses of each server-side callback", size_buckets)
+callback_responses = Counter("dashboard_callback_responses_total", "Responses of each server-side callback, by status")
+fetch_requests = Counter("dashboard_fetch_requests_total", "Requests made to the Ontario Data API for each resource")
+fetch_retries = Counter("dashboard_fetch_retries_total", "Requests to the Ontario Data API retried for each resource")
+fetch_bytes = Counter("dashboard_fetch_bytes_total", "Bytes received from the Ontario Data API for each resource, as transferred and uncompressed")
+fetch_skipped = Counter("dashboard_fetch_skipped_total", "Pulls of each resource skipped since it was unchanged since the last one")
+fetch_bytes_saved = Counter("dashboard_fetch_bytes_saved_total", "Bytes not transferred for each resource by skipping pulls of it")
+
+def observe_stage(stage, seconds, **labels):
+    '''
+    Records the time taken by a stage (such as "transform"), with labels telling its runs apart (such as the resource)
+    '''
+
+    stage_seconds.observe(seconds, stage=stage, **labels)
+    stage_last_seconds.set(seconds, stage=stage, **labels)
+
+@contextmanager
+def span(stage, **labels):
+    '''
+    Times the code run inside it as the given stage, recording it even if it raises
+    '''
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, **labels)
+
+def profiled(func):
+    '''
+    Decorator which runs func under cProfile and writes the stats to profile_path, when it is set
+    '''
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if profile_path is None:
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            profiler.dump_stats(profile_path)
+            print(f"Wrote profile of {func.__name__} to {profile_path}")
+
+    return wrapper
+
+def render():
+    return "\n".join(line for metric in registry.values() for line in metric.render()) + "\n"
+
+def install_metrics(app, path="/metrics"):
+    '''
+    Adds a Prometheus-format metrics route to the Dash app, and records the latency, response size and status
+    of every server-side callback, labelled by its output. This must be installed before install_callback_cache,
+    so that responses served from the callback cache are timed too
+    '''
+
+    server = app.server
+
+    @server.route(path)
+    def metrics():
+        return server.response_class(render(), mimetype="text/plain; version=0.0.4")
+
+    @server.before_request
+    def start_callback_timer():
+        if request.method == "POST" and request.path.endswith("/_dash-update-component"):
+            g.callback_start = time.perf_counter()
+
+    @server.after_request
+    def record_callback(response):
+        start = g.pop('callback_start', None)
+
+        if start is not None:
+            output = (request.get_json(silent=True) or {}).get('output', "unknown")
+            cache = "hit" if g.pop('callback_cache_hit', False) else "miss"
+
+            callback_seconds.observe(time.perf_counter() - start, output=output, cache=cache)
+            callback_responses.inc(output=output, status=response.status_code)
+            if not response.direct_passthrough:
+                callback_bytes.observe(len(response.get_data()), output=output, encoding=response.content_encoding or "identity")
+
+        return response
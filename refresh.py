@@ -0,0 +1,136 @@
+import random
+import threading
+
+from datetime import datetime, timedelta, time
+from collections import namedtuple
+from collections.abc import Mapping
+
+# Everything the callbacks serve from - a new one is built on each refresh and swapped in whole
+Snapshot = namedtuple('Snapshot', ['data_dict', 'fig_dict', 'now', 'pages', 'created', 'version'])
+
+class LazyDict(Mapping):
+    '''
+    Read-only dict whose values are each built by calling their builder the first time they are accessed
+    '''
+
+    def __init__(self, builders):
+        self.builders = builders
+        self.values = {}
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            # Concurrent first accesses may both build the value, but only one is kept
+            self.values.setdefault(key, self.builders[key]())
+
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.builders
+
+    def __iter__(self):
+        return iter(self.builders)
+
+    def __len__(self):
+        return len(self.builders)
+
+class RefreshScheduler:
+    '''
+    Rebuilds the dashboard snapshot in a background thread once a day, after the day's data is usually
+    published, retrying failed builds with exponential backoff. If is_current is given and says a new snapshot
+    doesn't have the day's data yet, it is rebuilt again every recheck seconds that day until it does - unless
+    changed is given and says the source data hasn't changed since, as on days without a report. Each new
+    snapshot is published by a single reference swap, so readers of 'snapshot' always see a complete one
+    '''
+
+    def __init__(self, build, refresh_at=time(hour=11), jitter=900, backoff=60, max_backoff=3600, is_current=None,
+                 recheck=3600, changed=None):
+        self.build = build
+        self.refresh_at = refresh_at
+        self.jitter = jitter
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.is_current = is_current
+        self.recheck = recheck
+        self.changed = changed
+
+        self.snapshot = None
+        self.last_success = None
+        self.last_check = None
+        self.last_error = None
+        self.failures = 0
+
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def refresh(self):
+        '''
+        Builds a new snapshot and publishes it, raising if the build fails
+        '''
+
+        snapshot = self.build()
+
+        self.snapshot = snapshot
+        self.last_success = snapshot.created
+        self.failures = 0
+
+        return snapshot
+
+    def next_delay(self, now=None):
+        '''
+        Returns the number of seconds to wait before the next refresh - until the next refresh_at time
+        normally, or an exponential backoff after failures - plus random jitter so that multiple
+        servers don't all hit the API at once
+        '''
+
+        now = now or datetime.now()
+
+        if self.failures > 0:
+            delay = min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+        elif self.waiting_for_data(now):
+            delay = self.recheck
+        else:
+            next_run = datetime.combine(now.date(), self.refresh_at)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            delay = (next_run - now).total_seconds()
+
+        return delay + random.uniform(0, self.jitter)
+
+    def waiting_for_data(self, now):
+        '''
+        Returns whether the current snapshot is missing the day's data after it should have been published
+        '''
+
+        if self.is_current is None or self.snapshot is None or now.time() < self.refresh_at:
+            return False
+
+        return not self.is_current(self.snapshot)
+
+    def run(self):
+        while not self.stopped.wait(self.next_delay()):
+            try:
+                # Rechecks for the day's data only rebuild the snapshot once something has been republished
+                if self.waiting_for_data(datetime.now()) and self.changed is not None and not self.changed():
+                    self.last_check = datetime.now()
+                    print(f"No new dashboard data at {self.last_check.isoformat(timespec='seconds')}")
+                    continue
+
+                self.refresh()
+                print(f"Refreshed dashboard data at {self.last_success.isoformat(timespec='seconds')}")
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                print(f"Dashboard refresh failed ({self.failures} in a row): {e!r}")
+
+    def start(self):
+        '''
+        Starts refreshing in a background daemon thread
+        '''
+
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name="dashboard-refresh", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
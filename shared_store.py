@@ -0,0 +1,195 @@
+import os
+import json
+import mmap
+import time
+import pickle
+
+from datetime import date
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Whether server workers share one data dictionary, built by a single process and memory-mapped
+# read-only by the rest. Meant for multi-worker servers (e.g. `SHARED_STORE=1 gunicorn -w 4 app:server`)
+enabled = os.environ.get("SHARED_STORE", "0") == "1" and fcntl is not None
+
+store_dir = "./data/shared"
+
+# Seconds for which a newly built store is used as is, so workers refreshing around the same time (within
+# the refresh jitter) share one rebuild rather than each pulling the data again
+reuse_within = 1800
+
+# Out-of-band buffers are aligned in the store so the arrays mapped from them are too
+alignment = 64
+
+def build_or_attach(build, refresh=False, is_current=None, reuse_within=reuse_within, store_dir=store_dir):
+    '''
+    Function returns today's published data dictionary, memory-mapped read-only. It is rebuilt by calling build
+    while holding the store's lock - so only one process builds it while the others wait - and published for the
+    rest if there isn't one, or if this is a refresh or is_current says it is missing the day's data - unless
+    it was built (or found unchanged) less than reuse_within seconds ago, by another process refreshing too
+    '''
+
+    os.makedirs(store_dir, exist_ok=True)
+    today = date.today().isoformat()
+
+    def usable(published):
+        if published is None or published['date'] != today:
+            return None
+
+        if time.time() - published['published'] < reuse_within:
+            return attach(published)
+
+        if refresh:
+            return None
+
+        data_dict = attach(published)
+        if data_dict is not None and is_current is not None and not is_current(data_dict):
+            return None
+
+        return data_dict
+
+    data_dict = usable(read_current(store_dir))
+    if data_dict is not None:
+        return data_dict
+
+    with open(os.path.join(store_dir, "build.lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            # Another process may have published it while this one waited for the lock
+            published = read_current(store_dir)
+            data_dict = usable(published)
+            if data_dict is not None:
+                return data_dict
+
+            data_dict = build()
+            if data_dict is None:
+                return None
+
+            # Stores are keyed by data version, so a rebuild that found nothing new keeps the published one
+            if (published is not None and published['data_version'] == data_dict.get('data_version')
+                    and os.path.exists(published['path'])):
+                path = published['path']
+                write_current(store_dir, today, path, published['data_version'])
+            else:
+                path = publish(store_dir, today, data_dict)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # The builder maps the published copy too, so its own copy can be freed
+    return load(path)
+
+def read_current(store_dir):
+    '''
+    Function returns the record of the current store (its day, path, data version and the time it was
+    published), or None if there isn't one
+    '''
+
+    current = os.path.join(store_dir, "current.json")
+
+    if not os.path.exists(current):
+        return None
+
+    try:
+        with open(current, 'r') as f:
+            published = json.load(f)
+    except ValueError:
+        return None
+
+    # Records written by older versions have no data version or time, so their store is rebuilt
+    if 'data_version' not in published or 'published' not in published:
+        return None
+
+    return published
+
+def write_current(store_dir, day, path, data_version):
+    with open(os.path.join(store_dir, "current.json.tmp"), 'w') as f:
+        json.dump({'date': day, 'path': path, 'data_version': data_version, 'published': time.time()}, f)
+    os.replace(os.path.join(store_dir, "current.json.tmp"), os.path.join(store_dir, "current.json"))
+
+def attach(published):
+    '''
+    Function returns the data dictionary of the given published store, or None if it can't be mapped
+    '''
+
+    if not os.path.exists(published['path']):
+        return None
+
+    try:
+        return load(published['path'])
+    except Exception as e:
+        print(f"Could not attach to shared data store: {e!r}")
+        return None
+
+def publish(store_dir, day, data_dict):
+    '''
+    Function writes the data dictionary to a new store file and makes it the current one, removing the
+    files of older stores. Returns the path of the new store
+    '''
+
+    # Contiguous arrays (the bulk of the DataFrames) are written out of band, so they can be mapped
+    # straight from the file instead of being copied into each process
+    buffers = []
+
+    def out_of_band(buffer):
+        try:
+            buffers.append(buffer.raw())
+            return False
+        except BufferError:
+            return True
+
+    payload = pickle.dumps(data_dict, protocol=5, buffer_callback=out_of_band)
+
+    offset = len(payload)
+    sections = []
+    for buffer in buffers:
+        offset += -offset % alignment
+        sections.append([offset, buffer.nbytes])
+        offset += buffer.nbytes
+
+    header = json.dumps({'pickle': len(payload), 'buffers': sections}).encode()
+    start = 8 + len(header)
+    start += -start % alignment
+
+    path = os.path.join(store_dir, f"data-{day}-{str(data_dict.get('data_version'))[:12]}-{os.getpid()}.bin")
+
+    with open(path + ".tmp", 'wb') as f:
+        f.write(len(header).to_bytes(8, 'little') + header)
+        f.write(b'\0' * (start - f.tell()))
+        f.write(payload)
+
+        for (section_offset, _), buffer in zip(sections, buffers):
+            f.write(b'\0' * (start + section_offset - f.tell()))
+            f.write(buffer)
+
+    os.replace(path + ".tmp", path)
+
+    write_current(store_dir, day, path, data_dict.get('data_version'))
+
+    # Processes still using an older store keep their mapping of it after it's removed
+    for old in os.listdir(store_dir):
+        if old.startswith("data-") and os.path.join(store_dir, old) != path:
+            os.remove(os.path.join(store_dir, old))
+
+    return path
+
+def load(path):
+    '''
+    Function maps the store file at path read-only and returns the data dictionary held in it
+    '''
+
+    with open(path, 'rb') as f:
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    header_len = int.from_bytes(view[:8], 'little')
+    header = json.loads(bytes(view[8:8 + header_len]))
+
+    start = 8 + header_len
+    start += -start % alignment
+
+    buffers = [view[start + offset:start + offset + length] for offset, length in header['buffers']]
+
+    return pickle.loads(view[start:start + header['pickle']], buffers=buffers)
@@ -0,0 +1,134 @@
+// Draws a page exported by static_export.py from its prebuilt figures, and does in the browser what the live
+// server's callbacks do - switching map tabs and date ranges, and showing the history of a clicked PHU
+(function () {
+    const bundle = JSON.parse(document.getElementById("static-bundle").textContent);
+    const files = {};
+
+    // Which tab, range and PHU is picked for each tab bar, range control and history graph
+    const picked = {tabs: {}, ranges: {}, phus: {}};
+
+    // Each file is fetched once, however many figures share it (as they do templates and map boundaries)
+    function fetchJSON(path) {
+        if (!(path in files)) {
+            files[path] = fetch(bundle.root + path).then(function (response) {
+                if (!response.ok) {
+                    throw new Error("Could not fetch " + path + ": " + response.status);
+                }
+                return response.json();
+            });
+        }
+        return files[path];
+    }
+
+    // Returns a copy of the figure at path (Plotly changes figures it draws), with its shared parts filled in
+    async function loadFigure(path) {
+        const fig = structuredClone(await fetchJSON(path));
+        const layout = fig.layout || (fig.layout = {});
+
+        if (typeof layout.template === "string") {
+            layout.template = await fetchJSON(layout.template);
+        }
+        for (const trace of fig.data || []) {
+            if (typeof trace.geojson === "string") {
+                trace.geojson = await fetchJSON(trace.geojson);
+            }
+        }
+        return fig;
+    }
+
+    function plot(graph, fig) {
+        const config = Object.assign({responsive: true}, JSON.parse(graph.dataset.config || "{}"));
+        return Plotly.react(graph, fig.data, fig.layout, config);
+    }
+
+    function draw(id, path) {
+        const graph = document.getElementById(id);
+        return loadFigure(path).then(function (fig) { return plot(graph, fig); });
+    }
+
+    function updateHistory(id) {
+        const history = bundle.histories[id];
+        const phu = picked.phus[id];
+
+        if (phu !== undefined && phu in history.figures) {
+            draw(id, history.figures[phu][picked.tabs[history.tabs]][picked.ranges[history.range]]);
+        }
+    }
+
+    function updateHistories(control) {
+        for (const id in bundle.histories) {
+            if (bundle.histories[id].tabs === control || bundle.histories[id].range === control) {
+                updateHistory(id);
+            }
+        }
+    }
+
+    // Swaps in the selected tab's values, keeping the PHU boundaries already loaded with the map
+    function switchMetric(tabs, tab) {
+        const map = bundle.maps[tabs];
+        const graph = document.getElementById(map.graph);
+
+        loadFigure(map.figures[tab]).then(function (fig) {
+            fig.data[0].geojson = graph.data[0].geojson;
+            return plot(graph, fig);
+        });
+    }
+
+    document.querySelectorAll(".nav-tabs[id]").forEach(function (tabs) {
+        const active = tabs.querySelector(".nav-link.active");
+        picked.tabs[tabs.id] = active && active.dataset.tab;
+
+        tabs.addEventListener("click", function (event) {
+            const link = event.target.closest("[data-tab]");
+            if (!link) {
+                return;
+            }
+            event.preventDefault();
+
+            tabs.querySelectorAll("[data-tab]").forEach(function (other) {
+                other.classList.toggle("active", other === link);
+            });
+            picked.tabs[tabs.id] = link.dataset.tab;
+
+            if (tabs.id in bundle.maps) {
+                switchMetric(tabs.id, link.dataset.tab);
+            }
+            updateHistories(tabs.id);
+        });
+    });
+
+    for (const control in bundle.ranges) {
+        document.querySelectorAll("input[name='" + control + "']").forEach(function (input) {
+            if (input.checked) {
+                picked.ranges[control] = input.value;
+            }
+
+            input.addEventListener("change", function () {
+                picked.ranges[control] = input.value;
+
+                const figures = bundle.ranges[control][input.value];
+                for (const id in figures) {
+                    draw(id, figures[id]);
+                }
+                updateHistories(control);
+            });
+        });
+    }
+
+    document.querySelectorAll(".dash-graph[data-figure]").forEach(function (graph) {
+        draw(graph.id, graph.dataset.figure).then(function () {
+            // Map locations are the positions of the PHUs in the ID table, which the boundaries are joined to
+            for (const id in bundle.histories) {
+                if (bundle.histories[id].map === graph.id) {
+                    graph.on("plotly_click", function (event) {
+                        const point = event.points[0];
+                        if (point && point.location !== undefined) {
+                            picked.phus[id] = bundle.phu_ids[point.location];
+                            updateHistory(id);
+                        }
+                    });
+                }
+            }
+        });
+    });
+})();
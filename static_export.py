@@ -0,0 +1,362 @@
+# Exports the current dashboard snapshot as a static site, which any static file server or CDN can serve
+# without a Python process per request. Run with `python static_export.py [folder]` (./data/static by default)
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import plotly
+
+from html import escape
+from metrics import span
+from fig_creator import date_ranges, history_dict
+
+# The page layouts, sidebar and callback wiring are the live app's - importing it builds the current snapshot
+import app
+
+# Script that draws the exported pages, and switches their map tabs, date ranges and PHU histories
+static_js_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static_export.js")
+
+# Function that renders each Dash component type to HTML, keyed by (namespace, type)
+static_renderers = {}
+
+# Elements written without a closing tag
+void_tags = {"hr", "img", "input", "br", "meta", "link"}
+
+def static_renderer (namespace, *types):
+    '''
+    Registers the decorated function as the HTML renderer of the given component types. Renderers are
+    called with the component's props and the StaticPage being rendered, and return its HTML
+    '''
+
+    def register(func):
+        for component_type in types:
+            static_renderers[(namespace, component_type)] = func
+        return func
+
+    return register
+
+def tag (name, attrs=None, children=""):
+    '''
+    Returns an HTML element, leaving out attributes that are None or False and writing style dicts as inline CSS
+    '''
+
+    parts = [name]
+
+    for attr, value in (attrs or {}).items():
+        if value is None or value is False:
+            continue
+        if attr == "style":
+            value = ";".join(f"{prop}:{css}" for prop, css in value.items())
+        parts.append(attr if value is True else f'{attr}="{escape(str(value))}"')
+
+    if name in void_tags:
+        return f"<{' '.join(parts)}>"
+
+    return f"<{' '.join(parts)}>{children}</{name}>"
+
+def classes (*names):
+    return " ".join(name for name in names if name) or None
+
+class StaticBundle:
+    '''
+    Folder of an exported site. Figures are written once each under a hash of their JSON, minified, with
+    their template and any map boundaries written to files of their own - so figures (and pages) sharing
+    them only reference them, and every figure file can be cached forever
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+        os.makedirs(os.path.join(path, "figs"), exist_ok=True)
+        os.makedirs(os.path.join(path, "assets"), exist_ok=True)
+
+    def write_json(self, obj):
+        '''
+        Writes obj as minified JSON to figs/, unless an identical file was already written, and returns
+        its path within the site
+        '''
+
+        data = json.dumps(obj, separators=(',', ':'), cls=plotly.utils.PlotlyJSONEncoder)
+        name = f"figs/{hashlib.sha1(data.encode()).hexdigest()[:16]}.json"
+
+        if name not in self.files:
+            self.write_text(name, data)
+
+        return name
+
+    def write_figure(self, fig):
+        # Built figures are Plotly figures, while stored ones are read back as dicts shared with the figure cache
+        fig = json.loads(fig.to_json() if hasattr(fig, 'to_json') else json.dumps(fig))
+        layout = fig.setdefault('layout', {})
+
+        if isinstance(layout.get('template'), dict):
+            layout['template'] = self.write_json(layout['template'])
+
+        for trace in fig.get('data', []):
+            if isinstance(trace.get('geojson'), dict):
+                trace['geojson'] = self.write_json(trace['geojson'])
+
+        return self.write_json(fig)
+
+    def write_text(self, name, text):
+        os.makedirs(os.path.dirname(os.path.join(self.path, name)), exist_ok=True)
+
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(text)
+        self.files[name] = len(text.encode())
+
+    def copy(self, name, source):
+        shutil.copy(source, os.path.join(self.path, name))
+        self.files[name] = os.path.getsize(source)
+
+class StaticPage:
+    '''
+    Page of an exported site being rendered, which keeps the ids and stores it contains so that the
+    script's bindings can be written for them
+    '''
+
+    def __init__(self, bundle, path):
+        self.bundle = bundle
+        self.path = path
+        self.file = "index.html" if path == "/" else f"{path.strip('/')}/index.html"
+        self.root = "../" * self.file.count("/")
+        self.ids = set()
+        self.stores = {}
+
+    def link(self, href):
+        '''
+        Returns a dashboard path ("/testing") or asset ("./assets/neut.png") relative to this page, so the
+        site can be served from any folder
+        '''
+
+        if href.startswith("./"):
+            return self.root + href[2:]
+        if href.startswith("/"):
+            return (self.root or "./") + (f"{href.strip('/')}/" if href.strip('/') else "")
+
+        return href
+
+def render (component, page):
+    '''
+    Returns the HTML of a Dash component (or list of them, or text) as rendered on the given page
+    '''
+
+    if component is None:
+        return ""
+    if isinstance(component, (list, tuple)):
+        return "".join(render(child, page) for child in component)
+    if isinstance(component, (str, int, float)):
+        return escape(str(component))
+
+    props = component.to_plotly_json()['props']
+    if props.get('id') is not None:
+        page.ids.add(props['id'])
+
+    # Dash's HTML components are the elements they are named after
+    if component._namespace == "dash_html_components":
+        return render_html(component._type.lower(), props, page)
+
+    renderer = static_renderers.get((component._namespace, component._type))
+    if renderer is None:
+        raise ValueError(f"No static renderer for {component._namespace}.{component._type}")
+
+    return renderer(props, page)
+
+def render_html (name, props, page):
+    attrs = {'id': props.get('id'), 'class': props.get('className'), 'style': props.get('style'),
+             'src': page.link(props['src']) if 'src' in props else None,
+             'href': page.link(props['href']) if 'href' in props else None,
+             'title': props.get('title'), 'alt': props.get('alt')}
+
+    return tag(name, attrs, render(props.get('children'), page))
+
+def render_div (props, page, *names):
+    return tag("div", {'id': props.get('id'), 'style': props.get('style'), 'class': classes(*names, props.get('className'))},
+               render(props.get('children'), page))
+
+@static_renderer("dash_bootstrap_components", "Container")
+def render_container (props, page):
+    return render_div(props, page, "container-fluid" if props.get('fluid') else "container")
+
+@static_renderer("dash_bootstrap_components", "Row")
+def render_row (props, page):
+    return render_div(props, page, "row", props.get('justify') and f"justify-content-{props['justify']}",
+                      props.get('align') and f"align-items-{props['align']}")
+
+@static_renderer("dash_bootstrap_components", "Col")
+def render_col (props, page):
+    width = props.get('width')
+
+    return render_div(props, page, "col" if width is None else f"col-{width}",
+                      props.get('align') and f"align-self-{props['align']}")
+
+@static_renderer("dash_bootstrap_components", "Card")
+def render_card (props, page):
+    return render_div(props, page, "card")
+
+@static_renderer("dash_bootstrap_components", "CardBody")
+def render_card_body (props, page):
+    return render_div(props, page, "card-body")
+
+@static_renderer("dash_bootstrap_components", "Nav")
+def render_nav (props, page):
+    return render_div(props, page, "nav", props.get('vertical') and "flex-column", props.get('pills') and "nav-pills")
+
+@static_renderer("dash_bootstrap_components", "NavLink")
+def render_nav_link (props, page):
+    # Pages are separate files, so the current page's link is marked active when it is written
+    active = props.get('active') == "exact" and props.get('href') == page.path
+
+    return tag("a", {'id': props.get('id'), 'href': page.link(props.get('href', "/")),
+                     'class': classes("nav-link", active and "active", props.get('className'))},
+               render(props.get('children'), page))
+
+@static_renderer("dash_bootstrap_components", "Tabs")
+def render_tabs (props, page):
+    items = []
+
+    for tab in props.get('children') or []:
+        tab_props = tab.to_plotly_json()['props']
+        active = tab_props.get('tab_id') == props.get('active_tab')
+
+        items.append(tag("li", {'class': "nav-item"},
+                         tag("a", {'href': "#", 'data-tab': tab_props.get('tab_id'), 'class': classes("nav-link", active and "active")},
+                             escape(tab_props.get('label', "")))))
+
+    return tag("ul", {'id': props.get('id'), 'class': classes("nav nav-tabs", props.get('className'))}, "".join(items))
+
+@static_renderer("dash_bootstrap_components", "RadioItems")
+def render_radio_items (props, page):
+    items = []
+
+    for i, option in enumerate(props.get('options') or []):
+        option_id = f"{props['id']}-{i}"
+
+        items.append(tag("div", {'class': classes("form-check", props.get('inline') and "form-check-inline")},
+                         tag("input", {'type': "radio", 'class': "form-check-input", 'id': option_id, 'name': props['id'],
+                                       'value': option['value'], 'checked': option['value'] == props.get('value')}) +
+                         tag("label", {'class': "form-check-label", 'for': option_id}, escape(str(option['label'])))))
+
+    return tag("div", {'id': props.get('id'), 'class': props.get('className')}, "".join(items))
+
+@static_renderer("dash_core_components", "Graph")
+def render_graph (props, page):
+    # Figures are fetched and drawn by the page's script, so the page itself stays small
+    return tag("div", {'id': props.get('id'), 'class': classes("dash-graph", props.get('className')), 'style': props.get('style'),
+                       'data-figure': page.bundle.write_figure(props['figure']),
+                       'data-config': json.dumps(props.get('config') or {}, separators=(',', ':'))})
+
+@static_renderer("dash_core_components", "Store")
+def render_store (props, page):
+    # Stored data is only used by the script, and is exported with its bindings
+    page.stores[props['id']] = props.get('data')
+    return ""
+
+@static_renderer("dash_core_components", "Location")
+def render_location (props, page):
+    return ""
+
+def page_bindings (page, snapshot):
+    '''
+    Returns the bindings the script uses in place of the live server's callbacks for the graphs on a rendered
+    page - the figure of each map tab, the figures of each date range and the history of each PHU for each map
+    tab and date range - writing every figure they refer to
+    '''
+
+    bundle, fig_dict = page.bundle, snapshot.fig_dict
+    phu_ids = [int(phu_id) for phu_id in snapshot.data_dict['phu_match']['PHU_ID']]
+    bindings = {'root': page.root, 'phu_ids': phu_ids, 'maps': {}, 'ranges': {}, 'histories': {}}
+
+    for prefix in app.history_pages:
+        metrics = page.stores.get(f"{prefix}-map-metrics")
+        if metrics is None:
+            continue
+
+        bindings['maps'][f"{prefix}-tabs"] = {'graph': f"{prefix}-map",
+                                              'figures': {tab: bundle.write_figure(fig) for tab, fig in metrics.items()}}
+
+        if f"{prefix}-phu-history" in page.ids:
+            tabs = [tab for tab in metrics if tab in history_dict]
+
+            bindings['histories'][f"{prefix}-phu-history"] = {
+                'map': f"{prefix}-map", 'tabs': f"{prefix}-tabs", 'range': f"{prefix}-range",
+                'figures': {phu_id: {tab: {label: bundle.write_figure(fig_dict.get_history(phu_id, tab, days))
+                                           for label, days in date_ranges.items()} for tab in tabs} for phu_id in phu_ids}}
+
+    for prefix, keys in app.range_graphs.items():
+        if f"{prefix}-range" in page.ids:
+            bindings['ranges'][f"{prefix}-range"] = {label: {key: bundle.write_figure(fig_dict.get_range(key, days)) for key in keys}
+                                                     for label, days in date_ranges.items()}
+
+    return bindings
+
+def export_page (bundle, snapshot, path):
+    '''
+    Writes the page of the snapshot at path to the bundle as HTML, with the sidebar of the live app and the
+    bindings of its graphs, and returns the file it was written to
+    '''
+
+    page = StaticPage(bundle, path)
+    body = render(app.create_sidebar(snapshot), page) + \
+           tag("div", {'id': "page-content", 'style': app.CONTENT_STYLE}, render(snapshot.pages[path], page))
+
+    # Closing tags inside the JSON would end the script element early
+    bindings = json.dumps(page_bindings(page, snapshot), separators=(',', ':')).replace("</", "<\\/")
+
+    head = tag("meta", {'charset': "utf-8"}) + tag("title", {}, escape(app.app.title)) + \
+           tag("link", {'rel': "icon", 'href': page.link("./assets/favicon.ico")}) + \
+           "".join(tag("link", {'rel': "stylesheet", 'href': sheet}) for sheet in app.app.config.external_stylesheets)
+
+    scripts = tag("script", {'type': "application/json", 'id': "static-bundle"}, bindings) + \
+              tag("script", {'src': page.link("./assets/plotly.min.js")}) + \
+              tag("script", {'src': page.link("./assets/static.js")})
+
+    bundle.write_text(page.file, f"<!DOCTYPE html>\n<html><head>{head}</head><body>{body}{scripts}</body></html>\n")
+
+    return page.file
+
+def export_snapshot (snapshot, path="./data/static"):
+    '''
+    Writes a static site of every page of the snapshot to path: the pages as HTML, every figure they can
+    show prebuilt as minified JSON, and the scripts and assets drawing them. The site is written beside path
+    and swapped in whole, so a server never serves a mix of two exports. Returns the size of each file written
+    '''
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    bundle = StaticBundle(tmp_path)
+
+    with span("static_export"):
+        for page_path in snapshot.pages:
+            export_page(bundle, snapshot, page_path)
+
+        # The arrows and icon - the live app's own scripts are replaced by the static one
+        assets = os.path.join(os.path.dirname(os.path.abspath(app.__file__)), "assets")
+        for name in os.listdir(assets):
+            if not name.endswith(".js"):
+                bundle.copy(f"assets/{name}", os.path.join(assets, name))
+
+        bundle.write_text("assets/plotly.min.js", plotly.offline.get_plotlyjs())
+        with open(static_js_path, 'r') as f:
+            bundle.write_text("assets/static.js", f.read())
+
+    old_path = f"{path}.old{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    return bundle.files
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else "./data/static"
+
+    start = time.perf_counter()
+    files = export_snapshot(app.scheduler.snapshot, path)
+
+    print(f"Exported {len(app.scheduler.snapshot.pages)} pages and {sum(name.startswith('figs/') for name in files)} "
+          f"figure files ({sum(files.values()) / 1e6:.1f} MB) to {path} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the dashboard modules from the repository root, and the synthetic resources from 'benchmarks'
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
@@ -0,0 +1,54 @@
+# Checks that extending the stored derived tables (see 'derived.py') with newly added days gives the same
+# tables as deriving them in full, and that they are derived in full when earlier rows change.
+# Run from the repository root with `python -m pytest`
+
+import pandas as pd
+import pytest
+
+from data_handler import key_dict, date_col_dict, set_types
+from derived import derived_tables, update_derived
+from synthetic import make_resources, make_phu_match
+
+@pytest.fixture(scope="module")
+def data_dict():
+    data_dict = {key: set_types(key, df).sort_values(date_col_dict[key], kind='stable', ignore_index=True)
+                 for key, df in make_resources(120).items()}
+    data_dict['phu_match'] = make_phu_match()
+
+    return data_dict
+
+def up_to(data_dict, last):
+    '''
+    Function returns the resources in data_dict with only their rows up to the given date
+    '''
+
+    return {**{key: df[df[date_col_dict[key]] <= last].reset_index(drop=True) for key, df in data_dict.items()
+               if key in key_dict}, 'phu_match': data_dict['phu_match']}
+
+def assert_tables_equal(result, expected):
+    for name in derived_tables:
+        pd.testing.assert_frame_equal(result[name], expected[name])
+
+@pytest.mark.parametrize("added", [0, 1, 7, 30])
+def test_extending_matches_full_update(data_dict, added):
+    end = data_dict['cases_tl']['Reported Date'].max()
+    stored = update_derived(up_to(data_dict, end - pd.Timedelta(days=added)))
+
+    assert_tables_equal(update_derived(data_dict, stored), update_derived(data_dict))
+
+def test_revised_rows_are_derived_in_full(data_dict):
+    end = data_dict['cases_phu']['FILE_DATE'].max()
+    stored = update_derived(up_to(data_dict, end - pd.Timedelta(days=1)))
+
+    # A revision to the first day, long before the rows the tables are extended from
+    revised = {**data_dict, 'cases_phu': data_dict['cases_phu'].copy()}
+    revised['cases_phu'].loc[0, 'ACTIVE_CASES'] += 50
+
+    assert_tables_equal(update_derived(revised, stored), update_derived(revised))
+
+def test_empty_resource(data_dict):
+    empty = {**data_dict, 'cases_phu': data_dict['cases_phu'].iloc[:0]}
+    stored = update_derived(empty)
+
+    assert len(stored['phu']) == 0 and len(stored['active']) == 0
+    assert_tables_equal(update_derived(data_dict, update_derived(empty, stored)), update_derived(data_dict))
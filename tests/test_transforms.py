@@ -0,0 +1,80 @@
+# Checks that the vectorized transforms in 'data_handler.py' give the same output as the original ones
+# on small synthetic resources. Run from the repository root with `python -m pytest`
+
+import numpy as np
+import pandas as pd
+
+from data_handler import key_dict, set_types, data_transforms
+from synthetic import make_resources, make_phu_match
+
+def legacy_transforms (data_dict):
+    '''
+    Function performs a variety of data transforms to DataFrames in the input dictionary, 
+    which are used for downstream figure creation (as written before the transforms were vectorized)
+    '''
+
+    data_dict['hosp_vax']['icu'] = data_dict['hosp_vax']['icu_unvac'] +\
+                                   data_dict['hosp_vax']['icu_partial_vac'] +\
+                                   data_dict['hosp_vax']['icu_full_vac']
+
+    data_dict['hosp_vax']['nonicu'] = data_dict['hosp_vax']['hospitalnonicu_unvac'] +\
+                                     data_dict['hosp_vax']['hospitalnonicu_partial_vac'] +\
+                                     data_dict['hosp_vax']['hospitalnonicu_full_vac'] 
+
+    data_dict['hosp_vax']['date'] = pd.to_datetime(data_dict['hosp_vax']['date'], format='%Y-%m-%d')
+    data_dict['hosp_vax']['tot_unvac'] = data_dict['hosp_vax']['hospitalnonicu_unvac'] + data_dict['hosp_vax']['icu_unvac']
+    data_dict['hosp_vax']['tot_partial_vac'] = data_dict['hosp_vax']['hospitalnonicu_partial_vac'] + data_dict['hosp_vax']['icu_partial_vac']
+    data_dict['hosp_vax']['tot_full_vac'] = data_dict['hosp_vax']['hospitalnonicu_full_vac'] + data_dict['hosp_vax']['icu_full_vac']
+    data_dict['hosp_vax']['total'] = data_dict['hosp_vax']['icu'] + data_dict['hosp_vax']['nonicu']
+
+    data_dict['cases_tl']['Reported Date'] = pd.to_datetime(data_dict['cases_tl']['Reported Date'], format='%Y-%m-%d')
+    data_dict['cases_tl']['Deaths'] = data_dict['cases_tl']['Deaths'].where(~data_dict['cases_tl']['Deaths'].isna(), data_dict['cases_tl']['Deaths_New_Methodology'])
+    data_dict['cases_tl']['Tests'] = data_dict['cases_tl']['Total tests completed in the last day']
+    data_dict['cases_tl']['Percent positive tests in last day'] = data_dict['cases_tl']['Percent positive tests in last day'] / 100
+    data_dict['cases_tl']['Positive Tests'] = data_dict['cases_tl']['Total tests completed in the last day'] * data_dict['cases_tl']['Percent positive tests in last day']
+    data_dict['cases_tl']['New Cases'] = np.concatenate((np.array([np.nan]), data_dict['cases_tl']['Total Cases'].to_numpy()[1:] - data_dict['cases_tl']['Total Cases'].to_numpy()[:-1]))
+    data_dict['cases_tl']['New Deaths'] = np.concatenate((np.array([np.nan]), data_dict['cases_tl']['Deaths'].to_numpy()[1:] - data_dict['cases_tl']['Deaths'].to_numpy()[:-1]))
+    data_dict['cases_tl']['New Deaths'] = data_dict['cases_tl']['New Deaths'].apply(lambda x: x if x >= 0 else np.nan)
+
+    data_dict['cases_vaxed']['Date'] = pd.to_datetime(data_dict['cases_vaxed']['Date'], format='%Y-%m-%d')
+    data_dict['cases_vaxed']['Tot Cases'] = data_dict['cases_vaxed']['covid19_cases_unvac'] + data_dict['cases_vaxed']['covid19_cases_partial_vac'] +\
+                                            data_dict['cases_vaxed']['covid19_cases_full_vac'] + data_dict['cases_vaxed']['covid19_cases_vac_unknown']
+
+
+    data_dict['vax_stat']['Date'] = pd.to_datetime(data_dict['vax_stat']['report_date'], format='%Y-%m-%d')
+    data_dict['vax_stat']['Tot Vaxed'] = data_dict['vax_stat']['total_individuals_fully_vaccinated']
+    data_dict['vax_stat']['part Vaxed'] = data_dict['vax_stat']['total_individuals_at_least_one'] - data_dict['vax_stat']['total_individuals_fully_vaccinated']
+    data_dict['vax_stat']['UnVaxed'] = 14826276 - data_dict['vax_stat']['total_individuals_at_least_one']
+    data_dict['vax_stat']['UnVaxed12o'] = 13038032 - data_dict['vax_stat']['total_individuals_at_least_one']
+
+    data_dict['vax_stat']['per_partially'] = data_dict['vax_stat']['total_individuals_at_least_one'] / 14826276
+    data_dict['vax_stat']['per_fully'] = data_dict['vax_stat']['total_individuals_fully_vaccinated'] / 14826276
+    data_dict['vax_stat']['per_boosted'] = data_dict['vax_stat']['total_individuals_3doses'] / 14826276
+
+    data_dict['vax_age']['Date'] = pd.to_datetime(data_dict['vax_age']['Date'])
+
+    data_dict['cases_phu']['FILE_DATE'] = pd.to_datetime(data_dict['cases_phu']['FILE_DATE'], format='%Y-%m-%d')
+    cases_phu = data_dict['cases_phu'][['FILE_DATE', 'ACTIVE_CASES']].groupby('FILE_DATE').sum()
+    data_dict['cases_tl'] = pd.merge(data_dict['cases_tl'], cases_phu, how='left', left_on='Reported Date', right_on='FILE_DATE')
+
+    data_dict['tests_phu']['DATE'] = pd.to_datetime(data_dict['tests_phu']['DATE'], format='%Y-%m-%d')
+    data_dict['tests_phu']['test_volumes_7d_avg'] = data_dict['tests_phu']['test_volumes_7d_avg'].apply(lambda x: int(x.replace(',', '')))
+
+    data_dict['tests_age']['DATE'] = pd.to_datetime(data_dict['tests_age']['DATE'], format='%Y-%m-%d')
+    tests_age_key = {"0to13": "0 to 13 Years Old",
+                        "14to17": "14 to 17 Years Old",
+                        "18to24": "18 to 24 Years Old",
+                        "25to64": "25 to 64 Years Old",
+                        "65+": "65+ Years Old"}
+    data_dict['tests_age']['age_category'] = data_dict['tests_age']['age_category'].apply(lambda x: tests_age_key[x])
+
+    return data_dict
+
+def test_transforms_match_original():
+    resources = {key: set_types(key, df) for key, df in make_resources(200).items()}
+
+    expected = legacy_transforms({key: df.copy() for key, df in resources.items()})
+    result = data_transforms({**{key: df.copy() for key, df in resources.items()}, 'phu_match': make_phu_match()})
+
+    for key in key_dict:
+        pd.testing.assert_frame_equal(result[key], expected[key])
@@ -1,6 +1,4 @@
 import numpy as np
-import pandas as pd
-import locale
 
 from dash import html
 import dash_bootstrap_components as dbc
@@ -13,20 +11,15 @@ def custom_strftime(format, t):
     # Formats the date string for display
     return t.strftime(format).replace('{S}', str(t.day) + suffix(t.day))
 
-def change_card(data, col, date_col, title, color_invert=False, percentage=False):
+def change_card(kpis, key, title, color_invert=False, percentage=False):
     '''
     Creates the html objects for the daily update panels at the top of each page,
-    ensuring proper formatting of the figures and arrow sprite
+    ensuring proper formatting of the figures and arrow sprite. Values are read from
+    the precomputed KPI table (see kpi_snapshot in data_handler.py)
     '''
-    locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
 
-    data[date_col] = pd.to_datetime(data[date_col], format='%Y-%m-%d')
-
-    curr = data[data[date_col] == max(data[date_col])][col].iloc[0]
-
-    b_data = data[data[date_col] < max(data[date_col])]
-
-    last = b_data[b_data[date_col] == max(b_data[date_col])][col].iloc[0]
+    curr = kpis.at[key, 'current']
+    last = kpis.at[key, 'previous']
 
     change = curr - last
     change_a = abs(change)
@@ -42,8 +35,9 @@ def change_card(data, col, date_col, title, color_invert=False, percentage=False
         curr_str = str(round(curr, 1))
         chg_str = str(round(change_a, 2))
     else:
-        curr_str = locale.format("%d", curr, grouping=True) if not np.isnan(curr) else "N/A"
-        chg_str = locale.format("%d", change_a, grouping=True) if not np.isnan(change_a) else "N/A"
+        # Thousands are grouped with commas, as in the en_US locale
+        curr_str = f"{int(curr):,}" if not np.isnan(curr) else "N/A"
+        chg_str = f"{int(change_a):,}" if not np.isnan(change_a) else "N/A"
 
     if color_invert:
         color_list.reverse()